@@ -24,6 +24,7 @@ from multiprocessing import cpu_count
 from catkin_tools.common import wide_log
 
 from catkin_tools.execution.jobs import JobServer
+from catkin_tools.execution.logs import get_compression_methods
 
 
 def add_context_args(parser):
@@ -96,6 +97,22 @@ def add_cmake_and_make_and_catkin_make_args(parser):
         help='Pass no additional arguments to make for catkin packages (does not affect --make-args).')
 
 
+def add_log_compression_args(parser):
+    """Add the args of the compression of the build logs to an argparse parser.
+
+    :param parser: The python argparse parser object (or subparser)
+    :type parser: ArgumentParser
+    """
+
+    add = parser.add_argument
+    add('--log-compression', choices=['none'] + get_compression_methods(), default=None,
+        help='Compress the logs of the build as they are written. They can still be read with --show-log, or with '
+             'zcat or zstdcat. (default is none)')
+    add('--log-compression-level', metavar='LEVEL', type=int, default=None,
+        help='The level of the log compression, higher levels make smaller logs but use more CPU, from 1 to 9 for '
+             'zlib and from 1 to 19 for zstd.')
+
+
 def _extract_cmake_and_make_arguments(args, extract_catkin_make):
     """Extract arguments which are meant to be passed to CMake and GNU Make
     through the catkin_tools command line interface.
@@ -267,13 +284,15 @@ def handle_make_arguments(
     return make_args
 
 
-def configure_make_args(make_args, use_internal_make_jobserver):
+def configure_make_args(make_args, use_internal_make_jobserver, host_session=None):
     """Initialize the internal GNU Make jobserver or configure it as a pass-through
 
     :param make_args: arguments to be passed to GNU Make
     :type make_args: list
     :param use_internal_make_jobserver: if true, use the internal jobserver
     :type make_args: bool
+    :param host_session: if given, share the jobserver with the other catkin invocations on this host, under this name
+    :type host_session: str
     :rtype: tuple (final make_args, using makeflags, using cliflags, using jobserver)
     """
 
@@ -307,7 +326,8 @@ def configure_make_args(make_args, use_internal_make_jobserver):
     JobServer.initialize(
         max_jobs=jobs_flags.get('jobs', None),
         max_load=jobs_flags.get('load-average', None),
-        gnu_make_enabled=use_internal_make_jobserver)
+        gnu_make_enabled=use_internal_make_jobserver,
+        host_session=host_session)
 
     # If the jobserver is supported
     if JobServer.gnu_make_enabled():
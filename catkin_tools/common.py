@@ -17,6 +17,7 @@ from __future__ import print_function
 import datetime
 import os
 import re
+import signal
 import subprocess
 
 from catkin_pkg.packages import find_packages
@@ -298,13 +299,60 @@ def terminal_width_linux():
     return int(width)
 
 
+# The width of the terminal, cached while the terminal's size is watched
+_terminal_width = None
+_terminal_width_watched = False
+
+
+def _reset_terminal_width():
+    global _terminal_width
+    _terminal_width = None
+
+
+def watch_terminal_width():
+    """Cache the width of the terminal until a SIGWINCH signal tells that the terminal was resized.
+
+    Until this is called, :py:func:`terminal_width` queries the terminal
+    each time it is called. This has to be called from the main thread.
+
+    :returns: True if the terminal is watched
+    :rtype: bool
+    """
+    global _terminal_width_watched
+    if _terminal_width_watched:
+        return True
+    if not hasattr(signal, 'SIGWINCH'):
+        return False
+
+    previous_handler = signal.getsignal(signal.SIGWINCH)
+
+    def on_resized(signum, frame):
+        _reset_terminal_width()
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+
+    try:
+        signal.signal(signal.SIGWINCH, on_resized)
+    except ValueError:
+        # Signal handlers can only be set in the main thread
+        return False
+    _terminal_width_watched = True
+    return True
+
+
 def terminal_width():
     """Returns the estimated width of the terminal"""
+    global _terminal_width
+    if _terminal_width is not None:
+        return _terminal_width
     try:
-        return terminal_width_windows() if os.name == 'nt' else terminal_width_linux()
+        width = terminal_width_windows() if os.name == 'nt' else terminal_width_linux()
     except ValueError:
         # Failed to get the width, use the default 80
-        return 80
+        width = 80
+    if _terminal_width_watched:
+        _terminal_width = width
+    return width
 
 _ansi_escape = re.compile(r'\x1b[^m]*m')
 
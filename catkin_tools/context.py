@@ -67,6 +67,9 @@ class Context(object):
                    'make_args',
                    'use_internal_make_jobserver',
                    'catkin_make_args',
+                   'package_memory',
+                   'log_compression',
+                   'log_compression_level',
                    'whitelist',
                    'blacklist']
 
@@ -161,6 +164,10 @@ class Context(object):
                 else:
                     context_args[k] = v
 
+        # A stored compression level belongs to the stored compression method
+        if opts_vars.get('log_compression') is not None and opts_vars.get('log_compression_level') is None:
+            context_args['log_compression_level'] = None
+
         # Create the build context
         ctx = Context(**context_args)
 
@@ -200,6 +207,9 @@ class Context(object):
         make_args=None,
         use_internal_make_jobserver=True,
         catkin_make_args=None,
+        package_memory=None,
+        log_compression=None,
+        log_compression_level=None,
         space_suffix=None,
         whitelist=None,
         blacklist=None
@@ -234,6 +244,12 @@ class Context(object):
         :type use_internal_make_jobserver: bool
         :param catkin_make_args: extra make arguments to be passed to make for each catkin package
         :type catkin_make_args: list
+        :param package_memory: declarations of the memory needed to build some packages, like 'pcl_ros=3g'
+        :type package_memory: list
+        :param log_compression: method with which the logs are compressed, 'zlib' or 'zstd', or None or 'none'
+        :type log_compression: str
+        :param log_compression_level: level of the log compression, or None for the default of the method
+        :type log_compression_level: int
         :param space_suffix: suffix for build, devel, and install spaces which are not explicitly set.
         :type space_suffix: str
         :param whitelist: a list of packages to build by default
@@ -274,6 +290,11 @@ class Context(object):
         self.make_args = make_args or []
         self.use_internal_make_jobserver = use_internal_make_jobserver
         self.catkin_make_args = catkin_make_args or []
+        self.package_memory = package_memory or []
+
+        # Handle the compression of the logs
+        self.log_compression = log_compression
+        self.log_compression_level = log_compression_level
 
         # List of packages in the workspace is set externally
         self.packages = []
@@ -410,6 +431,7 @@ class Context(object):
                 clr("@{cf}Additional Make Args:@|        @{yf}{make_args}@|"),
                 clr("@{cf}Additional catkin Make Args:@| @{yf}{catkin_make_args}@|"),
                 clr("@{cf}Internal Make Job Server:@|    @{yf}{_Context__use_internal_make_jobserver}@|"),
+                clr("@{cf}Log Compression:@|             @{yf}{log_compression}@|"),
             ],
             [
                 clr("@{cf}Whitelisted Packages:@|        @{yf}{whitelisted_packages}@|"),
@@ -433,6 +455,14 @@ class Context(object):
             extend_value = 'None'
             extend_mode = clr('          ')
 
+        # Construct string for the log compression
+        if self.log_compression in [None, 'none']:
+            log_compression = 'None'
+        elif self.log_compression_level is None:
+            log_compression = self.log_compression
+        else:
+            log_compression = '{} (level {})'.format(self.log_compression, self.log_compression_level)
+
         def existence_str(path):
             return clr(' @{gf}[exists]@|' if os.path.exists(path) else '@{rf}[missing]@|')
 
@@ -444,6 +474,7 @@ class Context(object):
             'cmake_args': ' '.join(self.__cmake_args or ['None']),
             'make_args': ' '.join(self.__make_args or ['None']),
             'catkin_make_args': ', '.join(self.__catkin_make_args or ['None']),
+            'log_compression': log_compression,
             'source_missing': existence_str(self.source_space_abs),
             'build_missing': existence_str(self.build_space_abs),
             'devel_missing': existence_str(self.devel_space_abs),
@@ -669,6 +700,36 @@ class Context(object):
             raise RuntimeError("Setting of context members is not allowed while locked.")
         self.__catkin_make_args = value
 
+    @property
+    def package_memory(self):
+        return self.__package_memory
+
+    @package_memory.setter
+    def package_memory(self, value):
+        if self.__locked:
+            raise RuntimeError("Setting of context members is not allowed while locked.")
+        self.__package_memory = value
+
+    @property
+    def log_compression(self):
+        return self.__log_compression
+
+    @log_compression.setter
+    def log_compression(self, value):
+        if self.__locked:
+            raise RuntimeError("Setting of context members is not allowed while locked.")
+        self.__log_compression = value
+
+    @property
+    def log_compression_level(self):
+        return self.__log_compression_level
+
+    @log_compression_level.setter
+    def log_compression_level(self, value):
+        if self.__locked:
+            raise RuntimeError("Setting of context members is not allowed while locked.")
+        self.__log_compression_level = value
+
     @property
     def packages(self):
         return self.__packages
@@ -0,0 +1,262 @@
+"""Sandboxing of job stages in cgroup v2 sub-groups for exact resource accounting.
+
+When this process can write to its own cgroup, as in a delegated systemd
+scope or a container, each command stage is run in a transient sub-group.
+The kernel then accounts for the CPU time, peak memory and I/O of the whole
+process tree of the stage, including any compilers spawned by `make`, and
+can throttle it with `memory.high`.
+"""
+
+import errno
+import os
+import re
+
+# Mount point of the unified cgroup hierarchy
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# Controllers which are enabled for the stage sub-groups if they are available
+SANDBOX_CONTROLLERS = ['cpu', 'memory', 'io']
+
+# Characters which aren't allowed in the names of the stage sub-groups
+_UNSAFE_NAME_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def get_own_cgroup(proc_path='/proc/self/cgroup', root=CGROUP_ROOT):
+    """Get the path of the cgroup v2 group which contains this process.
+
+    :param proc_path: The file listing the cgroups of this process
+    :param root: The mount point of the unified cgroup hierarchy
+    :returns: The path of the group, or None if cgroup v2 isn't used
+    :rtype: str
+    """
+    # Systems in the hybrid mode mount the unified hierarchy below the legacy ones
+    roots = [root, os.path.join(root, 'unified')]
+
+    try:
+        with open(proc_path) as cgroup_file:
+            lines = cgroup_file.read().splitlines()
+    except (IOError, OSError):
+        return None
+
+    for line in lines:
+        # The unified hierarchy has the id 0 and no controllers
+        if line.startswith('0::'):
+            for root in roots:
+                path = os.path.join(root, line[3:].lstrip('/'))
+                if os.path.isfile(os.path.join(path, 'cgroup.procs')) and \
+                        os.path.isfile(os.path.join(path, 'cgroup.controllers')):
+                    return path
+    return None
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _write_file(path, value):
+    try:
+        with open(path, 'w') as f:
+            f.write(value)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def read_cgroup_stats(path):
+    """Read the resources used by all of the processes of a cgroup.
+
+    :param path: The path of the group
+    :returns: Map with the keys `cpu_time` in seconds, and `peak_rss` and
+        `io_bytes` in bytes, any of which may be None if its controller
+        isn't enabled or the kernel doesn't report it
+    :rtype: dict
+    """
+    stats = dict(cpu_time=None, peak_rss=None, io_bytes=None)
+
+    cpu_stat = _read_file(os.path.join(path, 'cpu.stat'))
+    if cpu_stat is not None:
+        for line in cpu_stat.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0] == 'usage_usec':
+                stats['cpu_time'] = int(fields[1]) / 1e6
+
+    # Only reported by Linux 5.19 and later
+    memory_peak = _read_file(os.path.join(path, 'memory.peak'))
+    if memory_peak is not None and memory_peak.strip().isdigit():
+        stats['peak_rss'] = int(memory_peak)
+
+    io_stat = _read_file(os.path.join(path, 'io.stat'))
+    if io_stat is not None:
+        io_bytes = 0
+        for line in io_stat.splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key in ('rbytes', 'wbytes'):
+                    io_bytes += int(value)
+        stats['io_bytes'] = io_bytes
+
+    return stats
+
+
+class CgroupSandbox(object):
+
+    """Runs command stages in their own transient cgroup v2 sub-groups.
+
+    All of the sub-groups are created in one group for the whole execution,
+    which is a child of the group this process started in. Because a cgroup with
+    processes can't delegate controllers to its children, this process is
+    first moved into a leaf of its own group if it's the only process in it.
+    Otherwise, the controllers available to the stage sub-groups are those
+    already enabled in the `cgroup.subtree_control` of this process's group.
+
+    A stage's subprocess moves itself into its sub-group before executing
+    its command, so none of its descendants can escape the accounting.
+    """
+
+    def __init__(self, path, memory_high=None):
+        """
+        :param path: The path of the group which contains the stage sub-groups
+        :param memory_high: Memory usage in bytes above which the processes of
+            each stage are throttled, or None
+        """
+        self.path = path
+        self.memory_high = memory_high
+
+        # Map from (job_id, stage_label) -> path of the stage sub-group
+        self._groups = {}
+        # Sub-groups which still had processes when their stage finished
+        self._stale_groups = []
+
+        available = (_read_file(os.path.join(path, 'cgroup.controllers')) or '').split()
+        self.controllers = [c for c in SANDBOX_CONTROLLERS if c in available]
+        for controller in self.controllers:
+            _write_file(os.path.join(path, 'cgroup.subtree_control'), '+' + controller)
+
+        # Peak memory usage is only reported by Linux 5.19 and later
+        self.reports_peak_memory = os.path.isfile(os.path.join(path, 'memory.peak'))
+
+    @classmethod
+    def create(cls, memory_high=None, parent=None):
+        """Create a sandbox in the group of this process if it's writable.
+
+        :param memory_high: Memory usage in bytes above which the processes of
+            each stage are throttled, or None
+        :param parent: The group in which to create the sandbox, defaults to
+            the group of this process
+        :returns: The sandbox, or None if cgroup v2 isn't available or the
+            group isn't delegated to this user
+        :rtype: :py:class:`CgroupSandbox`
+        """
+        parent = parent or get_own_cgroup()
+        if parent is None or not os.access(os.path.join(parent, 'cgroup.procs'), os.W_OK):
+            return None
+
+        # If this process is alone in its group, as in a scope started for it,
+        # move it to a leaf so the controllers can be delegated to the sandbox
+        procs = (_read_file(os.path.join(parent, 'cgroup.procs')) or '').split()
+        if procs == [str(os.getpid())]:
+            leaf = os.path.join(parent, 'catkin-{}-main'.format(os.getpid()))
+            try:
+                os.mkdir(leaf)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    leaf = None
+            if leaf is not None and _write_file(os.path.join(leaf, 'cgroup.procs'), '0'):
+                available = (_read_file(os.path.join(parent, 'cgroup.controllers')) or '').split()
+                for controller in SANDBOX_CONTROLLERS:
+                    if controller in available:
+                        _write_file(os.path.join(parent, 'cgroup.subtree_control'), '+' + controller)
+
+        path = os.path.join(parent, 'catkin-{}'.format(os.getpid()))
+        try:
+            os.mkdir(path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                return None
+        return cls(path, memory_high)
+
+    def __contains__(self, key):
+        return key in self._groups
+
+    def wrap(self, key, kwargs):
+        """Create the sub-group of a stage and wrap its command to run in it.
+
+        :param key: Tuple of (job_id, stage_label)
+        :param kwargs: The keyword arguments of `async_execute_process`
+        :returns: The keyword arguments with the wrapped command, or the
+            original ones if the sub-group couldn't be created
+        :rtype: dict
+        """
+        group = os.path.join(self.path, _UNSAFE_NAME_CHARS.sub('_', '.'.join(key)))
+        try:
+            os.mkdir(group)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                return kwargs
+        self._groups[key] = group
+        if self.memory_high is not None and 'memory' in self.controllers:
+            _write_file(os.path.join(group, 'memory.high'), str(int(self.memory_high)))
+
+        # Writing 0 to cgroup.procs moves the writing process itself
+        procs = os.path.join(group, 'cgroup.procs')
+        kwargs = dict(kwargs)
+        if kwargs.get('shell'):
+            cmd = kwargs['cmd'] if isinstance(kwargs['cmd'], str) else ' '.join(kwargs['cmd'])
+            kwargs['cmd'] = 'echo 0 2>/dev/null > "{}"; {}'.format(procs, cmd)
+        else:
+            kwargs['cmd'] = ['/bin/sh', '-c', 'echo 0 2>/dev/null > "$0"; exec "$@"', procs] + list(kwargs['cmd'])
+        return kwargs
+
+    def stop(self, key):
+        """Read the resources used by a finished stage and remove its sub-group.
+
+        :param key: Tuple of (job_id, stage_label)
+        :returns: Map of resources as returned by :py:func:`read_cgroup_stats`,
+            or None if the stage didn't run in a sub-group
+        :rtype: dict
+        """
+        group = self._groups.pop(key, None)
+        if group is None:
+            return None
+
+        stats = read_cgroup_stats(group)
+        if not stats['cpu_time']:
+            # The subprocess couldn't move itself into the sub-group
+            stats = None
+
+        if not self._remove_group(group):
+            self._stale_groups.append(group)
+        return stats
+
+    def _remove_group(self, group):
+        """Remove a sub-group, killing any processes left behind in it."""
+        try:
+            os.rmdir(group)
+            return True
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return True
+            if exc.errno != errno.EBUSY:
+                return False
+        # Daemonized descendants of the stage are still in it (Linux 5.14 and later)
+        _write_file(os.path.join(group, 'cgroup.kill'), '1')
+        return False
+
+    def close(self):
+        """Remove the sandbox and all of its remaining sub-groups."""
+        for group in list(self._groups.values()) + self._stale_groups:
+            self._remove_group(group)
+            try:
+                os.rmdir(group)
+            except OSError:
+                pass
+        self._groups = {}
+        self._stale_groups = []
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
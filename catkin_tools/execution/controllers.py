@@ -14,17 +14,30 @@ from catkin_tools.common import disable_wide_log
 from catkin_tools.common import format_time_delta
 from catkin_tools.common import format_time_delta_short
 from catkin_tools.common import remove_ansi_escape
+from catkin_tools.common import slice_to_printed_length
 from catkin_tools.common import terminal_width
+from catkin_tools.common import watch_terminal_width
 from catkin_tools.common import wide_log
 
 from catkin_tools.notifications import notify
 
+from catkin_tools.terminal_color import ansi
 from catkin_tools.terminal_color import fmt
 from catkin_tools.terminal_color import sanitize
 from catkin_tools.terminal_color import ColorMapper
 
+from .diagnostics import DiagnosticSummary
+from .diagnostics import ERROR
+from .diagnostics import WARNING
+from .event_bus import EventBus
 from .jobs import JobServer
 
+# Maximum number of bytes of the output of a stage printed when it finishes
+MAX_DISPLAYED_OUTPUT_BYTES = 1024 * 1024
+
+# Default rate in Hz at which the status line is updated
+DEFAULT_STATUS_RATE = 10.0
+
 # This map translates more human reable format strings into colorized versions
 _color_translation_map = {
     # 'output': 'colorized_output'
@@ -52,10 +65,16 @@ _color_translation_map = {
     "Depends on failed job {} via {}":
     fmt("@{yf}Depends on failed job @!{}@| @{yf}via @!{}@|"),
 
+    "Depends on abandoned job {}":
+    fmt("@{yf}Depends on abandoned job @!{}@|"),
+
     # Stage finishing
     "Starting >> {}:{}":
     fmt("Starting  @{gf} >>@| @{cf}{}@|:@{bf}{}@|"),
 
+    "... {} bytes of earlier output omitted ...":
+    fmt("@!@{kf}... {} bytes of earlier output omitted ...@|"),
+
     "Subprocess > {}:{} `cd {} && {}`":
     fmt("Subprocess  @!@{gf}>@| @{cf}{}@|:@{bf}{}@| @!@{kf}`cd {} && {}`@|"),
 
@@ -88,6 +107,9 @@ _color_translation_map = {
     "[{}:{} ({}%) - {}]":
     fmt("[@{cf}{}@|:@{bf}{}@| @{bf}({}%)@| - @{yf}{}@|]"),
 
+    "[{}:{} ({}%, {} left) - {}]":
+    fmt("[@{cf}{}@|:@{bf}{}@| @{bf}({}%, {} left)@| - @{yf}{}@|]"),
+
     # Summary
     "[{}] Summary: All {} jobs completed successfully!":
     fmt("[{}] @/@!Summary:@| @/All @!{}@| @/jobs completed successfully!@|"),
@@ -101,6 +123,9 @@ _color_translation_map = {
     "[{}] Warnings: {} completed jobs produced warnings.":
     fmt("[{}]   @/@!@{yf}Warnings:@|  @/@!{}@| @/completed jobs produced warnings.@|"),
 
+    "[{}] Diagnostics: {} warnings and {} errors.":
+    fmt("[{}]   @/@!@{yf}Diagnostics:@| @/@!{}@| @/warnings and@| @/@!{}@| @/errors.@|"),
+
     "[{}] Skipped: None.":
     fmt("[{}]   @/@!@{kf}Skipped:   None.@|"),
 
@@ -131,6 +156,88 @@ color_mapper = ColorMapper(_color_translation_map)
 clr = color_mapper.clr
 
 
+class StatusLineRenderer(object):
+
+    """Renders a status line which is rewritten in place on the terminal.
+
+    Only the parts of the line which changed since it was last rendered are
+    written, by moving the cursor to them. The line is split into parts at
+    each color reset, so that each part can be written on its own. Once a
+    part changes its length, the rest of the line is written. Without
+    colors, the terminal may not understand cursor movements, so the whole
+    line is written each time.
+    """
+
+    def __init__(self, stream=None):
+        """
+        :param stream: The stream of the terminal, or None for stdout
+        """
+        self.stream = stream
+        # Number of characters written to the terminal
+        self.bytes_written = 0
+
+        # The parts of the line on the terminal, and its printed length, or None if it was overwritten
+        self._parts = None
+        self._length = 0
+
+    def invalidate(self):
+        """Render the whole line the next time, after something was printed over it."""
+        self._parts = None
+
+    def render(self, line, width):
+        """Render the status line, leaving the cursor at its start.
+
+        :param line: The status line, which may contain color escape sequences
+        :param width: The width of the terminal, to which the line is truncated
+        """
+        length = len(remove_ansi_escape(line))
+        if length >= width:
+            line = slice_to_printed_length(line, width - 4) + '...'
+            length = len(remove_ansi_escape(line))
+
+        reset = ansi('reset')
+        if reset:
+            parts = [part + reset for part in line.split(reset)]
+            parts[-1] = parts[-1][:-len(reset)]
+        else:
+            parts = [line]
+
+        out = []
+        if self._parts is None:
+            out.append(line + ('\x1b[K' if reset else ' ' * max(0, width - 1 - length)))
+        elif not reset:
+            out.append(line + ' ' * max(0, self._length - length))
+        else:
+            column = 0
+            for index, part in enumerate(parts):
+                part_length = len(remove_ansi_escape(part))
+                old_part = self._parts[index] if index < len(self._parts) else None
+                if part == old_part:
+                    column += part_length
+                    continue
+                move = '\x1b[{}G'.format(column + 1)
+                if old_part is not None and len(remove_ansi_escape(old_part)) == part_length:
+                    out.append(move + part)
+                    column += part_length
+                    continue
+                # The parts after one whose length changed have moved
+                out.append(move + ''.join(parts[index:]) + ('\x1b[K' if length < self._length else ''))
+                break
+            else:
+                if length < self._length:
+                    out.append('\x1b[{}G\x1b[K'.format(column + 1))
+
+        self._parts = parts
+        self._length = length
+        if len(out) == 0:
+            return
+
+        data = '\r' + ''.join(out) + '\r'
+        stream = self.stream or sys.stdout
+        stream.write(data)
+        self.bytes_written += len(data)
+
+
 class ConsoleStatusController(threading.Thread):
 
     """Status thread for displaying events to the console.
@@ -155,8 +262,9 @@ class ConsoleStatusController(threading.Thread):
             show_active_status=True,
             show_summary=True,
             show_full_summary=False,
-            active_status_rate=10.0,
-            pre_start_time=None):
+            active_status_rate=DEFAULT_STATUS_RATE,
+            pre_start_time=None,
+            event_handlers=None):
         """
         :param label: The label for this task (build, clean, etc)
         :param job_labels: The labels to be used for the jobs (packages, tests, etc)
@@ -171,8 +279,9 @@ class ConsoleStatusController(threading.Thread):
         :param show_active_status: Periodically show a status line displaying the active jobs
         :param show_summary: Show numbers of jobs that completed with errors and warnings
         :param show_full_summary: Show lists of jobs in each termination category
-        :param active_status_rate: The rate in Hz at which the status line should be printed
+        :param active_status_rate: The maximum rate in Hz at which the status line is updated
         :param pre_start_time: The actual start time to report, if preprocessing was done
+        :param event_handlers: Callables which are also given every event, before it is displayed
         """
         super(ConsoleStatusController, self).__init__()
 
@@ -192,7 +301,18 @@ class ConsoleStatusController(threading.Thread):
         self.show_full_summary = show_full_summary
         self.show_summary = show_summary
         self.active_status_rate = max(active_status_rate, 0.1)
+        self.status_renderer = StatusLineRenderer()
         self.pre_start_time = pre_start_time
+        self.event_handlers = event_handlers or []
+
+        # An event bus only delivers the output which is shown as it is generated
+        if isinstance(event_queue, EventBus):
+            event_queue.subscribe([event_id for event_id, shown in [
+                ('STDOUT', show_live_stdout), ('STDERR', show_live_stderr)] if shown])
+
+        # The status line is rendered with the width of the terminal, which is cached while it isn't resized
+        if show_active_status:
+            watch_terminal_width()
 
         # Map from jid -> job
         self.jobs = dict([(j.jid, j) for j in jobs])
@@ -201,6 +321,27 @@ class ConsoleStatusController(threading.Thread):
         self.max_jid_length = 1 + \
             max([len(jid) + max([len(s.label) for s in job.stages] or [0]) for jid, job in self.jobs.items()])
 
+    def _log(self, msg):
+        """Print a message over the status line, which is then rendered again in full."""
+        wide_log(msg)
+        self.status_renderer.invalidate()
+
+    def _output_lines(self, output):
+        """Get the lines of the output of a stage to print.
+
+        Only the end of very long output is read, so that the rest of it
+        doesn't have to be read back, or decompressed, from the log.
+
+        :param output: The :py:class:`CapturedOutput` of the stage
+        :rtype: list
+        """
+        omitted, data = output.tail(MAX_DISPLAYED_OUTPUT_BYTES)
+        lines = data.decode('utf-8', 'replace' if omitted > 0 else 'strict').splitlines()
+        if omitted > 0:
+            # The first line was cut off
+            lines = [clr('... {} bytes of earlier output omitted ...').format(omitted)] + lines[1:]
+        return [l for l in lines if (self.show_compact_io is False or len(l.strip()) > 0)]
+
     def run(self):
         pending_jobs = []
         queued_jobs = []
@@ -208,7 +349,18 @@ class ConsoleStatusController(threading.Thread):
         completed_jobs = {}
         abandoned_jobs = []
         failed_jobs = []
+        cancelled_jobs = []
         warned_jobs = []
+        # Map from filename -> number of spawns which were retried because of it
+        spawn_retries = dict()
+        # Memory in bytes not reserved by active jobs, if memory is budgeted
+        memory_headroom = None
+        # Map from jid -> time in seconds the job spent waiting for jobserver tokens
+        token_waits = dict()
+        # Numbers of jobs the adaptive concurrency has switched between
+        adjusted_jobs = []
+        # Counts of the compiler and CMake diagnostics found in the output
+        diagnostics = DiagnosticSummary()
 
         cumulative_times = dict()
         start_times = dict()
@@ -221,21 +373,24 @@ class ConsoleStatusController(threading.Thread):
         if not self.show_active_status:
             disable_wide_log()
 
+        # Time at which the status line is next rendered
+        next_frame = time.time()
+
         while True:
             # Write a continuously-updated status line
             if self.show_active_status:
-                # Try to get an event from the queue (non-blocking)
-                try:
-                    event = self.event_queue.get(False)
-                except Empty:
-                    # Print live status (overwrites last line)
+                now = time.time()
+                if now >= next_frame:
+                    next_frame = now + 1.0 / self.active_status_rate
+
+                    # Print live status (overwrites the last line, rewriting what changed)
                     status_line = clr('[{} {} s] [{}/{} complete] [{}/{} jobs] [{} queued]').format(
                         self.label,
                         format_time_delta_short(time.time() - start_time),
                         len(completed_jobs),
                         len(self.jobs),
                         JobServer.running_jobs(),
-                        JobServer.max_jobs(),
+                        JobServer.effective_jobs(),
                         len(queued_jobs) + len(active_jobs) - len(active_stages)
                     )
 
@@ -248,6 +403,8 @@ class ConsoleStatusController(threading.Thread):
                         status_line += clr(' [@!@{rf}High Load@|]')
                     if not JobServer.mem_ok():
                         status_line += clr(' [@!@{rf}Low Memory@|]')
+                    if memory_headroom is not None:
+                        status_line += clr(' [{:.1f} GB free]').format(max(0, memory_headroom) / 1024.0 ** 3)
 
                     # Add active jobs
                     if len(active_jobs) == 0:
@@ -255,20 +412,26 @@ class ConsoleStatusController(threading.Thread):
                     else:
                         active_labels = []
 
-                        for j, (s, t, p) in active_stages.items():
+                        for j, (s, t, p, f) in active_stages.items():
                             d = format_time_delta_short(cumulative_times[j] + time.time() - t)
                             if p == '':
                                 active_labels.append(clr('[{}:{} - {}]').format(j, s, d))
-                            else:
+                            elif f is None:
                                 active_labels.append(clr('[{}:{} ({}%) - {}]').format(j, s, p, d))
+                            else:
+                                active_labels.append(clr('[{}:{} ({}%, {} left) - {}]').format(
+                                    j, s, p, format_time_delta_short(max(0.0, f - time.time())), d))
 
                         status_line += ' ' + ' '.join(active_labels)
 
                     # Print the status line
-                    # wide_log(status_line)
-                    wide_log(status_line, rhs='', end='\r')
+                    self.status_renderer.render(status_line, terminal_width())
                     sys.stdout.flush()
-                    time.sleep(1.0 / self.active_status_rate)
+
+                # Wait for an event until the status line is due again
+                try:
+                    event = self.event_queue.get(True, max(0.0, next_frame - time.time()))
+                except Empty:
                     continue
             else:
                 # Try to get an event from the queue (blocking)
@@ -281,6 +444,10 @@ class ConsoleStatusController(threading.Thread):
             if event is None:
                 break
 
+            # Pass the event on to any other consumers
+            for handler in self.event_handlers:
+                handler(event)
+
             # Handle the received events
             eid = event.event_id
 
@@ -290,6 +457,8 @@ class ConsoleStatusController(threading.Thread):
                 active_jobs = event.data['active']
                 completed_jobs = event.data['completed']
                 abandoned_jobs = event.data['abandoned']
+                cancelled_jobs = event.data['cancelled']
+                memory_headroom = event.data.get('memory_headroom')
 
                 # Check if all jobs have finished in some way
                 if all([len(event.data[t]) == 0 for t in ['pending', 'queued', 'active']]):
@@ -297,7 +466,8 @@ class ConsoleStatusController(threading.Thread):
 
             elif 'STARTED_JOB' == eid:
                 cumulative_times[event.data['job_id']] = 0.0
-                wide_log(clr('Starting >>> {:<{}}').format(
+                token_waits[event.data['job_id']] = event.data.get('token_wait', 0.0)
+                self._log(clr('Starting >>> {:<{}}').format(
                     event.data['job_id'],
                     self.max_jid_length))
 
@@ -305,17 +475,33 @@ class ConsoleStatusController(threading.Thread):
                 duration = format_time_delta(cumulative_times[event.data['job_id']])
 
                 if event.data['succeeded']:
-                    wide_log(clr('Finished <<< {:<{}} [ {} ]').format(
+                    self._log(clr('Finished <<< {:<{}} [ {} ]').format(
                         event.data['job_id'],
                         self.max_jid_length,
                         duration))
                 else:
                     failed_jobs.append(event.data['job_id'])
-                    wide_log(clr('Failed <<< {:<{}} [ {} ]').format(
+                    self._log(clr('Failed <<< {:<{}} [ {} ]').format(
                         event.data['job_id'],
                         self.max_jid_length,
                         duration))
 
+            elif 'CANCELLED_JOB' == eid:
+                duration = format_time_delta(cumulative_times[event.data['job_id']])
+
+                if 'INTERRUPTED' == event.data['reason']:
+                    reason = clr('Interrupted by user')
+                elif 'DEP_FAILED' == event.data['reason']:
+                    reason = clr('Depends on failed job {}').format(event.data['peer_job_id'])
+                else:
+                    reason = clr('Job {} failed').format(event.data['peer_job_id'])
+
+                self._log(clr('Cancelled <<< {:<{}} [ {} after {} ]').format(
+                    event.data['job_id'],
+                    self.max_jid_length,
+                    reason,
+                    duration))
+
             elif 'ABANDONED_JOB' == eid:
                 # Create a human-readable reason string
                 if 'DEP_FAILED' == event.data['reason']:
@@ -328,35 +514,56 @@ class ConsoleStatusController(threading.Thread):
                             event.data['direct_dep_job_id'])
                 elif 'PEER_FAILED' == event.data['reason']:
                     reason = clr('Unrelated job failed')
+                elif 'INTERRUPTED' == event.data['reason']:
+                    reason = clr('Interrupted by user')
                 elif 'MISSING_DEPS' == event.data['reason']:
                     reason = clr('Depends on unknown jobs: {}').format(
                         ', '.join([clr('@!{}@|').format(jid) for jid in event.data['dep_ids']]))
+                elif 'DEP_ABANDONED' == event.data['reason']:
+                    reason = clr('Depends on abandoned job {}').format(event.data['direct_dep_job_id'])
+                elif 'UNSCHEDULABLE' == event.data['reason']:
+                    reason = clr('Can never be started')
 
-                wide_log(clr('Abandoned <<< {:<{}} [ {} ]').format(
+                self._log(clr('Abandoned <<< {:<{}} [ {} ]').format(
                     event.data['job_id'],
                     self.max_jid_length,
                     reason))
 
             elif 'STARTED_STAGE' == eid:
-                active_stages[event.data['job_id']] = [event.data['stage_label'], event.time, '']
+                token_waits[event.data['job_id']] = \
+                    token_waits.get(event.data['job_id'], 0.0) + event.data.get('token_wait', 0.0)
+                active_stages[event.data['job_id']] = [event.data['stage_label'], event.time, '', None]
                 start_times[event.data['job_id']] = event.time
 
                 if self.show_stage_events:
-                    wide_log(clr('Starting >> {}:{}').format(
+                    self._log(clr('Starting >> {}:{}').format(
                         event.data['job_id'],
                         event.data['stage_label']))
 
             elif 'STAGE_PROGRESS' == eid:
                 active_stages[event.data['job_id']][2] = event.data['percent']
+                # The estimated time at which the stage will finish
+                eta = event.data.get('eta')
+                active_stages[event.data['job_id']][3] = event.time + eta if eta is not None else None
 
             elif 'SUBPROCESS' == eid:
                 if self.show_stage_events:
-                    wide_log(clr('Subprocess > {}:{} `cd {} && {}`').format(
+                    self._log(clr('Subprocess > {}:{} `cd {} && {}`').format(
                         event.data['job_id'],
                         event.data['stage_label'],
                         event.data['cwd'],
                         ' '.join(event.data['cmd'])))
 
+            elif 'SPAWN_RETRY' == eid:
+                filename = event.data['filename'] or 'unknown file'
+                spawn_retries[filename] = spawn_retries.get(filename, 0) + 1
+                if self.show_stage_events:
+                    self._log(clr('Retrying > {}:{} after transient error on `{}` (attempt {})').format(
+                        event.data['job_id'],
+                        event.data['stage_label'],
+                        filename,
+                        event.data['attempt']))
+
             elif 'FINISHED_STAGE' == eid:
                 # Get the stage duration
                 duration = event.time - start_times[event.data['job_id']]
@@ -365,14 +572,24 @@ class ConsoleStatusController(threading.Thread):
                 # This is no longer the active stage for this job
                 del active_stages[event.data['job_id']]
 
+                diagnostics.add(event.data.get('diagnostics', []))
+
                 header_border = None
                 header_title = None
                 lines = []
                 footer_title = None
                 footer_border = None
 
+                # Stages which were stopped by cancelling their job didn't fail on their own
+                stage_cancelled = event.data.get('cancelled', False)
+
                 # Generate headers / borders for output
-                if event.data['succeeded']:
+                if stage_cancelled:
+                    footer_title = clr(
+                        'Cancelled << {}:{}').format(
+                            event.data['job_id'],
+                            event.data['stage_label'])
+                elif event.data['succeeded']:
                     footer_title = clr(
                         'Finished << {}:{}').format(
                             event.data['job_id'],
@@ -419,18 +636,19 @@ class ConsoleStatusController(threading.Thread):
                             max(0, self.max_jid_length - len(event.data['job_id'])),
                             event.data['retcode'])
 
-                if self.show_buffered_stdout:
+                if stage_cancelled:
+                    # The output of stopped subprocesses isn't interesting
+                    pass
+                elif self.show_buffered_stdout:
                     if len(event.data['interleaved']) > 0:
-                        lines = [l for l in event.data['interleaved'].decode(
-                            'utf-8').splitlines() if (self.show_compact_io is False or len(l.strip()) > 0)]
+                        lines = self._output_lines(event.data['interleaved'])
                     else:
                         header_border = None
                         header_title = None
                         footer_border = None
                 elif self.show_buffered_stderr:
                     if len(event.data['stderr']) > 0:
-                        lines = [l for l in event.data['stderr'].decode(
-                            'utf-8').splitlines() if (self.show_compact_io is False or len(l.strip()) > 0)]
+                        lines = self._output_lines(event.data['stderr'])
                     else:
                         header_border = None
                         header_title = None
@@ -438,32 +656,41 @@ class ConsoleStatusController(threading.Thread):
 
                 # Print the output
                 if header_border:
-                    wide_log(header_border)
+                    self._log(header_border)
                 if header_title:
-                    wide_log(header_title)
+                    self._log(header_title)
                 if len(lines) > 0:
-                    wide_log('\n'.join(lines))
+                    self._log('\n'.join(lines))
                 if footer_border:
-                    wide_log(footer_border)
+                    self._log(footer_border)
                 if footer_title:
-                    wide_log(footer_title)
+                    self._log(footer_title)
 
             elif 'STDERR' == eid:
                 if self.show_live_stderr:
                     prefix = clr('[{}:{}] ').format(
                         event.data['job_id'],
                         event.data['stage_label'])
-                    wide_log(''.join(prefix + l for l in event.data['data'].splitlines(True)))
+                    self._log(''.join(prefix + l for l in event.data['data'].splitlines(True)))
 
             elif 'STDOUT' == eid:
                 if self.show_live_stdout:
                     prefix = clr('[{}:{}] ').format(
                         event.data['job_id'],
                         event.data['stage_label'])
-                    wide_log(''.join(prefix + l for l in event.data['data'].splitlines(True)))
+                    self._log(''.join(prefix + l for l in event.data['data'].splitlines(True)))
+
+            elif 'JOBS_ADJUSTED' == eid:
+                adjusted_jobs.append(event.data['jobs'])
+                if self.show_stage_events:
+                    self._log(clr('Adjusted jobs: {} -> {} [ {} ]').format(
+                        event.data['previous_jobs'],
+                        event.data['jobs'],
+                        ', '.join(['{} {:.1f}%'.format(resource, pressure)
+                                   for resource, pressure in sorted(event.data['pressures'].items())])))
 
             elif 'MESSAGE' == eid:
-                wide_log(event.data['msg'])
+                self._log(event.data['msg'])
 
         if not self.show_summary:
             return
@@ -505,7 +732,73 @@ class ConsoleStatusController(threading.Thread):
                         self.label,
                         jid))
 
-        all_abandoned_jobs = [j for j in self.jobs if j not in completed_jobs]
+        if len(diagnostics) > 0:
+            wide_log(clr('[{}] Diagnostics: {} warnings and {} errors.').format(
+                self.label,
+                '{:,}'.format(diagnostics.severities[WARNING]),
+                '{:,}'.format(diagnostics.severities[ERROR])))
+            for title, counter in [('Top flags', diagnostics.flags), ('Top files', diagnostics.files)]:
+                if len(counter) > 0:
+                    wide_log(clr('[{}]  - {}').format(
+                        self.label,
+                        '{}: {}'.format(title, ', '.join([
+                            '{} ({})'.format(key, count) for key, count in counter.most_common(5)]))))
+
+        if len(spawn_retries) > 0:
+            wide_log(clr('[{}] Spawn retries: {} subprocess spawns hit transient errors.').format(
+                self.label,
+                sum(spawn_retries.values())))
+            if self.show_full_summary:
+                for filename, count in sorted(spawn_retries.items()):
+                    wide_log(clr('[{}]  - {} ({})').format(
+                        self.label,
+                        filename,
+                        count))
+
+        if sum(token_waits.values()) > 0:
+            longest_wait_jid = max(token_waits, key=token_waits.get)
+            wide_log(clr('[{}] Token wait: {} total, longest {} ({}).').format(
+                self.label,
+                format_time_delta(sum(token_waits.values())),
+                format_time_delta(token_waits[longest_wait_jid]),
+                longest_wait_jid))
+            if self.show_full_summary:
+                for jid, wait in sorted(token_waits.items(), key=lambda w: w[1], reverse=True):
+                    wide_log(clr('[{}]  - {} ({})').format(
+                        self.label,
+                        jid,
+                        format_time_delta(wait)))
+
+        if len(adjusted_jobs) > 0:
+            wide_log(clr('[{}] Adaptive jobs: adjusted {} times, between {} and {} jobs.').format(
+                self.label,
+                len(adjusted_jobs),
+                min(adjusted_jobs),
+                max(adjusted_jobs)))
+
+        if self.show_stage_events and isinstance(self.event_queue, EventBus):
+            stats = self.event_queue.stats()
+            wide_log(clr('[{}] Events: {} delivered, {} coalesced, {} dropped, queue depth up to {}, '
+                         'latency {:.1f} ms mean, {:.1f} ms max.').format(
+                self.label,
+                stats['delivered'],
+                stats['coalesced'],
+                stats['dropped'],
+                stats['max_depth'],
+                1000.0 * stats['mean_latency'],
+                1000.0 * stats['max_latency']))
+
+        if len(cancelled_jobs) > 0:
+            wide_log(clr('[{}] Cancelled: {} jobs were stopped while running.').format(
+                self.label,
+                len(cancelled_jobs)))
+            if self.show_full_summary:
+                for jid in cancelled_jobs:
+                    wide_log(clr('[{}]  - {}').format(
+                        self.label,
+                        jid))
+
+        all_abandoned_jobs = [j for j in self.jobs if j not in completed_jobs and j not in cancelled_jobs]
         if len(all_abandoned_jobs) == 0:
             wide_log(clr('[{}] Abandoned: No jobs were abandoned.').format(
                 self.label))
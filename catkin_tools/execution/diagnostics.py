@@ -0,0 +1,161 @@
+"""Incremental extraction of compiler and CMake diagnostics from build output.
+
+The :py:class:`DiagnosticParser` finds the warnings and errors reported by
+GCC, Clang and CMake in the output of a stage as it is received, like::
+
+    /src/foo/src/foo.cpp:12:5: warning: unused variable 'x' [-Wunused-variable]
+    CMake Warning (dev) at /src/foo/CMakeLists.txt:4 (add_library):
+
+Each diagnostic is a dict with the `file`, `line` and `column` it refers to,
+its `severity`, which is `error` or `warning`, the `flag` which enabled it,
+like `-Wunused-variable`, if the tool reported one, and its `message`. The
+diagnostics of each build are stored in an index next to its log segment,
+see :py:meth:`catkin_tools.execution.logs.BuildLog.add_diagnostics`.
+"""
+
+import re
+
+from collections import Counter
+
+from catkin_tools.common import remove_ansi_escape
+
+# Severities of diagnostics
+ERROR = 'error'
+WARNING = 'warning'
+
+# GCC and Clang: file:line[:column]: severity: message [flag]
+_COMPILER_PATTERN = re.compile(
+    r'^(?P<file>[^:\s][^:]*):(?P<line>[0-9]+):(?:(?P<column>[0-9]+):)?\s+'
+    r'(?P<severity>fatal error|error|warning):\s+(?P<message>.*?)(?:\s+\[(?P<flag>-W[^\]]*)\])?\s*$')
+
+# CMake: CMake Warning (dev) at file:line (command):
+_CMAKE_PATTERN = re.compile(
+    r'^CMake (?P<severity>Error|Warning)(?P<dev> \(dev\))? at (?P<file>.+?):(?P<line>[0-9]+) \((?P<command>[^)]*)\):')
+
+# Maximum number of bytes of a line which are parsed
+MAX_LINE_LENGTH = 16 * 1024
+
+
+class DiagnosticParser(object):
+
+    """Finds diagnostics in output as it is received, one complete line at a time."""
+
+    def __init__(self):
+        self._tail = b''
+        # A CMake diagnostic whose message is on the lines which follow it
+        self._cmake_diagnostic = None
+
+    def feed(self, data):
+        """Parse the next chunk of output.
+
+        :param data: The bytes of output
+        :returns: A list of the diagnostics in the complete lines of output
+        :rtype: list
+        """
+        data = self._tail + data
+        end = data.rfind(b'\n') + 1
+        self._tail = data[end:end + MAX_LINE_LENGTH]
+        return self._parse(data[:end])
+
+    def flush(self):
+        """Parse the last line of output, if it wasn't terminated.
+
+        :rtype: list
+        """
+        data, self._tail = self._tail, b''
+        return self._parse(data)
+
+    def _parse(self, data):
+        # Most output doesn't contain any diagnostic, so don't decode it
+        if self._cmake_diagnostic is None and b'rror' not in data and b'arning' not in data:
+            return []
+
+        diagnostics = []
+        for line in data.decode('utf-8', 'replace').splitlines():
+            line = remove_ansi_escape(line[:MAX_LINE_LENGTH])
+
+            if self._cmake_diagnostic is not None:
+                # The message of a CMake diagnostic is the first line after it
+                if len(line.strip()) == 0:
+                    continue
+                self._cmake_diagnostic['message'] = line.strip()
+                self._cmake_diagnostic = None
+                continue
+
+            match = _COMPILER_PATTERN.match(line)
+            if match is not None:
+                diagnostics.append(dict(
+                    file=match.group('file'),
+                    line=int(match.group('line')),
+                    column=int(match.group('column')) if match.group('column') else None,
+                    severity=ERROR if 'error' in match.group('severity') else WARNING,
+                    flag=match.group('flag'),
+                    message=match.group('message')))
+                continue
+
+            match = _CMAKE_PATTERN.match(line)
+            if match is not None:
+                self._cmake_diagnostic = dict(
+                    file=match.group('file'),
+                    line=int(match.group('line')),
+                    column=None,
+                    severity=ERROR if match.group('severity') == 'Error' else WARNING,
+                    flag='-Wdev' if match.group('dev') else None,
+                    message=match.group('command'))
+                diagnostics.append(self._cmake_diagnostic)
+        return diagnostics
+
+
+class DiagnosticSummary(object):
+
+    """Counts the diagnostics of a build, by severity, flag and file."""
+
+    def __init__(self):
+        self.severities = Counter()
+        self.flags = Counter()
+        self.files = Counter()
+
+    def add(self, diagnostics):
+        """Count diagnostics.
+
+        :param diagnostics: A list of diagnostic dicts
+        """
+        for diagnostic in diagnostics:
+            self.severities[diagnostic['severity']] += 1
+            if diagnostic['severity'] == WARNING:
+                if diagnostic['flag'] is not None:
+                    self.flags[diagnostic['flag']] += 1
+                self.files[diagnostic['file']] += 1
+
+    def __len__(self):
+        return sum(self.severities.values())
+
+
+def format_diagnostic(diagnostic, style='text'):
+    """Format a diagnostic for humans, or for the annotations of a CI system.
+
+    :param diagnostic: A diagnostic dict, with the `job_id` which reported it
+    :param style: `text` for the format of GCC, or `github` for GitHub
+        Actions workflow commands
+    :rtype: str
+    """
+    location = '{}:{}'.format(diagnostic['file'], diagnostic['line'])
+    if diagnostic['column'] is not None:
+        location += ':{}'.format(diagnostic['column'])
+
+    if style == 'github':
+        properties = ['file=' + diagnostic['file'], 'line={}'.format(diagnostic['line'])]
+        if diagnostic['column'] is not None:
+            properties.append('col={}'.format(diagnostic['column']))
+        title = diagnostic['job_id'] + (' ' + diagnostic['flag'] if diagnostic['flag'] else '')
+        properties.append('title=' + title)
+        # Workflow commands end at the first line break
+        message = diagnostic['message'].replace('%', '%25').replace('\r', '%0D').replace('\n', '%0A')
+        return '::{} {}::{}'.format(diagnostic['severity'], ','.join(properties), message)
+
+    return '{}: {}: {}{} ({})'.format(
+        location,
+        diagnostic['severity'],
+        diagnostic['message'],
+        ' [{}]'.format(diagnostic['flag']) if diagnostic['flag'] else '',
+        diagnostic['job_id'])
@@ -0,0 +1,187 @@
+"""An event queue between the executor and the controllers which coalesces output.
+
+Subprocesses produce output in many small chunks, and turning each of them
+into its own event on a `queue.Queue` costs a lock round-trip and a wake-up
+of the controller thread per chunk. The :py:class:`EventBus` is used in the
+place of the queue, and instead:
+
+- drops output events which no controller has subscribed to,
+- merges the output events of each stage which arrive within a short window
+  into one event, which is delivered once the window has passed or before
+  the next event which isn't output, so that the output of a stage always
+  comes before the event of it finishing,
+- counts how many events it delivered, merged and dropped, how many were
+  waiting at most, and how long they waited.
+"""
+
+import threading
+import time
+
+from collections import deque
+
+try:
+    # Python3
+    from queue import Empty
+except ImportError:
+    # Python2
+    from Queue import Empty
+
+from .events import ExecutionEvent
+
+# Events which carry output, and can be merged or dropped
+OUTPUT_EVENT_IDS = ['STDOUT', 'STDERR']
+
+# Time in seconds for which the output events of a stage are merged
+COALESCE_PERIOD = 0.05
+
+
+class EventBus(object):
+
+    """A queue of execution events which coalesces output events.
+
+    It can be used in the place of a `queue.Queue` by the executor and the
+    controllers, through `put` and `get`.
+    """
+
+    def __init__(self, coalesce_period=COALESCE_PERIOD):
+        """
+        :param coalesce_period: Time in seconds for which the output events
+            of a stage are merged, or 0 to not merge them
+        """
+        self.coalesce_period = coalesce_period
+
+        # Ids of the output events which are delivered
+        self.subscriptions = set()
+
+        self._condition = threading.Condition()
+        self._events = deque()
+        # Map from (event id, job id, stage label) -> (event, list of data) of the output being merged
+        self._batches = {}
+        # The keys of the batches, in the order they were started
+        self._batch_order = deque()
+
+        self._counters = dict(put=0, delivered=0, coalesced=0, dropped=0, max_depth=0)
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    def subscribe(self, event_ids):
+        """Deliver output events with these ids, which are otherwise dropped.
+
+        :param event_ids: A list of ids from OUTPUT_EVENT_IDS
+        """
+        with self._condition:
+            self.subscriptions.update(event_ids)
+
+    def wants(self, event_id):
+        """Check if events with an id are delivered, or dropped.
+
+        :rtype: bool
+        """
+        return event_id not in OUTPUT_EVENT_IDS or event_id in self.subscriptions
+
+    def put(self, event):
+        """Add an event, a `None` event tells the controllers to stop.
+
+        :type event: :py:class:`ExecutionEvent`
+        """
+        with self._condition:
+            self._counters['put'] += 1
+
+            if event is not None and event.event_id in OUTPUT_EVENT_IDS:
+                if event.event_id not in self.subscriptions:
+                    self._counters['dropped'] += 1
+                    return
+                if self.coalesce_period > 0:
+                    key = (event.event_id, event.data['job_id'], event.data['stage_label'])
+                    if key in self._batches:
+                        self._batches[key][1].append(event.data['data'])
+                        self._counters['coalesced'] += 1
+                        return
+                    self._batches[key] = (event, [event.data['data']])
+                    self._batch_order.append(key)
+                    # Wake the consumer up so that it waits for the end of the window
+                    self._condition.notify()
+                    return
+
+            # Nothing may overtake the output which came before it
+            self._flush_batches(None)
+            self._enqueue(event)
+            self._condition.notify()
+
+    def _enqueue(self, event):
+        self._events.append(event)
+        self._counters['max_depth'] = max(self._counters['max_depth'], len(self._events))
+
+    def _flush_batches(self, now):
+        """Deliver the merged output whose window has passed, or all of it if `now` is None."""
+        while len(self._batch_order) > 0:
+            event, data = self._batches[self._batch_order[0]]
+            if now is not None and now < event.time + self.coalesce_period:
+                break
+            del self._batches[self._batch_order.popleft()]
+            if len(data) > 1:
+                # The merged event keeps the time of its first output, so its latency covers the window
+                merged = ExecutionEvent(event.event_id, **dict(event.data, data=''.join(data)))
+                merged.time = event.time
+                merged.monotonic_time = event.monotonic_time
+                event = merged
+            self._enqueue(event)
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the next event.
+
+        :param block: Wait for an event if there isn't one
+        :param timeout: The maximum time in seconds to wait, or None to wait
+            until there is an event
+        :raises: `queue.Empty` if there isn't any event
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                now = time.time()
+                self._flush_batches(now)
+                if len(self._events) > 0:
+                    event = self._events.popleft()
+                    self._counters['delivered'] += 1
+                    if event is not None:
+                        latency = max(0.0, now - event.time)
+                        self._total_latency += latency
+                        self._max_latency = max(self._max_latency, latency)
+                    return event
+
+                if not block or (deadline is not None and now >= deadline):
+                    raise Empty
+
+                # Wait for the next event, or for the oldest merged output to be due
+                wait = None if deadline is None else deadline - now
+                if len(self._batch_order) > 0:
+                    due = self._batches[self._batch_order[0]][0].time + self.coalesce_period - now
+                    wait = due if wait is None else min(wait, due)
+                self._condition.wait(max(0.0, wait) if wait is not None else None)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        """Get the number of events waiting to be delivered, including merged output."""
+        with self._condition:
+            return len(self._events) + len(self._batch_order)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def stats(self):
+        """Get the counters of the events which passed through the bus.
+
+        :returns: Dict with the numbers of events `put`, `delivered`,
+            `coalesced` into other events and `dropped`, the current `depth`
+            and the `max_depth` of the queue, and the `mean_latency` and
+            `max_latency` in seconds between events being created and delivered
+        :rtype: dict
+        """
+        with self._condition:
+            stats = dict(self._counters)
+            stats['depth'] = len(self._events) + len(self._batch_order)
+            stats['mean_latency'] = self._total_latency / max(1, stats['delivered'])
+            stats['max_latency'] = self._max_latency
+        return stats
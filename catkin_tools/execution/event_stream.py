@@ -0,0 +1,113 @@
+"""A machine-readable stream of the events of an execution.
+
+Every :py:class:`ExecutionEvent` given to an :py:class:`EventStreamWriter` is
+written as one line of JSON, and the stream is flushed after each line so
+that other tools can follow it while the execution runs::
+
+    {"event": "STARTED_STAGE", "seq": 12, "time": 1792140900.12, "monotonic": 3.52,
+     "job_id": "rospack", "stage_label": "make", "token_wait": 0.0}
+
+Each line has the `event` id, its sequence number `seq`, the wall-clock
+`time`, and the `monotonic` time in seconds since the stream was opened,
+which never goes backwards, along with the data of the event. References to
+the output of a stage are written as its size in bytes. `FINISHED_STAGE`
+events also have the `duration` of the stage. The environment of
+subprocesses is left out, since it can hold secrets, and `JOB_STATUS` events
+are only written when the state of a job changed.
+"""
+
+import json
+import os
+
+from .events import monotonic
+from .logs import CapturedOutput
+
+# Data of events which is never written
+OMITTED_EVENT_DATA = ['env']
+
+# Data of JOB_STATUS events which describes the state of the jobs
+_JOB_STATUS_KEYS = ['pending', 'queued', 'active', 'abandoned', 'cancelled', 'completed']
+
+
+def open_event_stream(spec):
+    """Open the destination of an event stream.
+
+    :param spec: A filename, or `fd:N` for the already open file descriptor N
+    :returns: A writable text file
+    :raises: ValueError if the file descriptor is invalid, IOError or
+        OSError if the file can't be opened
+    """
+    if spec.startswith('fd:'):
+        try:
+            fd = int(spec[len('fd:'):])
+        except ValueError:
+            raise ValueError("'{}' is not a file descriptor number".format(spec[len('fd:'):]))
+        return os.fdopen(fd, 'w')
+    return open(spec, 'w')
+
+
+def _encode(value):
+    """Encode the values of event data which aren't JSON types."""
+    if isinstance(value, CapturedOutput):
+        return len(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+class EventStreamWriter(object):
+
+    """Writes events as JSON lines, to be used as an event handler of a controller."""
+
+    def __init__(self, stream):
+        """
+        :param stream: A writable text file, see :py:func:`open_event_stream`
+        """
+        self.stream = stream
+        self.start_time = monotonic()
+        self.n_events = 0
+
+        # Map from (job id, stage label) -> monotonic time at which the stage started
+        self._stage_start_times = {}
+        self._job_status = None
+
+    def handle(self, event):
+        """Write an ExecutionEvent to the stream."""
+        eid = event.event_id
+        data = dict([(k, v) for k, v in event.data.items() if k not in OMITTED_EVENT_DATA])
+
+        if 'JOB_STATUS' == eid:
+            job_status = [data.get(key) for key in _JOB_STATUS_KEYS]
+            if job_status == self._job_status:
+                return
+            self._job_status = job_status
+        elif 'STARTED_STAGE' == eid:
+            self._stage_start_times[data['job_id'], data['stage_label']] = event.monotonic_time
+        elif 'FINISHED_STAGE' == eid:
+            start_time = self._stage_start_times.pop((data['job_id'], data['stage_label']), None)
+            data['duration'] = event.monotonic_time - start_time if start_time is not None else None
+
+        data.update(
+            event=eid,
+            seq=self.n_events,
+            time=event.time,
+            monotonic=round(event.monotonic_time - self.start_time, 6))
+        self.n_events += 1
+
+        if self.stream is None:
+            return
+        try:
+            self.stream.write(json.dumps(data, default=_encode, sort_keys=True) + '\n')
+            self.stream.flush()
+        except (IOError, OSError, ValueError):
+            # A reader going away doesn't stop the execution, it just stops the stream
+            self.stream = None
+
+    def close(self):
+        if self.stream is None:
+            return
+        try:
+            self.stream.close()
+        except (IOError, OSError):
+            pass
+        self.stream = None
@@ -1,6 +1,13 @@
 
 import time
 
+try:
+    # Python3
+    from time import monotonic
+except ImportError:
+    # Python2 doesn't have a monotonic clock
+    from time import time as monotonic
+
 
 class ExecutionEvent(object):
 
@@ -18,12 +25,15 @@ class ExecutionEvent(object):
         'STARTED_JOB',  # A job has started to be executed
         'FINISHED_JOB',  # A job has finished executing (succeeded or failed)
         'ABANDONED_JOB',  # A job has been abandoned for some reason
+        'CANCELLED_JOB',  # A job has been stopped while it was executing
         'STARTED_STAGE',  # A job stage has started to be executed
         'FINISHED_STAGE',  # A job stage has finished executing (succeeded or failed)
         'STAGE_PROGRESS',  # A job stage has executed partially
         'STDOUT',  # A status message from a job
         'STDERR',  # A warning or error message from a job
         'SUBPROCESS',
+        'SPAWN_RETRY',  # Spawning a subprocess failed with a transient error and will be retried
+        'JOBS_ADJUSTED',  # The number of concurrent jobs was adapted to the pressure on the system
         'MESSAGE'
     ]
 
@@ -33,8 +43,9 @@ class ExecutionEvent(object):
         :param event_id: One of the valid EVENT_IDS
         :param **kwargs: The additional data to be passed along with this event.
         """
-        # Store the time this event was generated
+        # Store the time this event was generated, and a time which never goes backwards
         self.time = time.time()
+        self.monotonic_time = monotonic()
 
         # Make sure the event ID is valid
         if event_id not in ExecutionEvent.EVENT_IDS:
@@ -1,10 +1,11 @@
 from __future__ import print_function
 
+import errno
+import os
+import signal
 import time
 import traceback
 
-from itertools import tee
-
 import trollius as asyncio
 
 from concurrent.futures import ThreadPoolExecutor
@@ -13,43 +14,270 @@ from concurrent.futures import FIRST_COMPLETED
 from osrf_pycommon.process_utils import async_execute_process
 from osrf_pycommon.process_utils import get_loop
 
+try:
+    import psutil
+except ImportError:
+    # Only the root process of a stage is signalled without psutil
+    psutil = None
 
 from .events import ExecutionEvent
 
+from .graph import JobGraph
+
 from .io import IOBufferLogger
 
 from .jobs import JobServer
 
+from .logs import BuildLog
+
+from .resources import ResourceClassLimiter
+from .resources import ResourceMonitor
+
 from .stages import CommandStage
 from .stages import FunctionStage
 
+# Period in seconds after which the subprocesses of cancelled jobs are killed
+# if they haven't exited after being asked to terminate
+CANCEL_KILL_TIMEOUT = 5.0
+
+# Period in seconds at which the number of jobs is adapted to the system pressure
+ADAPTIVE_JOBS_PERIOD = 1.0
+
+# Futures which interrupt the running executions when they complete
+_interrupt_futures = []
+
+
+class SpawnRetryPolicy(object):
+
+    """Policy for retrying subprocess spawns which fail with transient errors.
+
+    The most common transient error is `ETXTBSY` ("Text file busy"), which
+    happens when a command is executed while another process, often a
+    concurrent build or install, still has the executable open for writing.
+    Retries are delayed with an exponential backoff, without blocking the
+    event loop.
+
+    The policy also counts the transient errors, so that spawn contention can
+    be reported at the end of a build.
+    """
+
+    TRANSIENT_ERRNOS = [errno.ETXTBSY]
 
-def split(values, cond):
-    """Split an iterable based on a condition."""
-    head, tail = tee((cond(v), v) for v in values)
-    return [v for c, v in head if c], [v for c, v in tail if not c]
+    def __init__(self, max_attempts=10, initial_delay=0.01, max_delay=1.0, backoff=2.0):
+        """
+        :param max_attempts: Maximum number of times a subprocess is spawned before giving up
+        :param initial_delay: Delay in seconds before the first retry
+        :param max_delay: Maximum delay in seconds between retries
+        :param backoff: Factor by which the delay grows after each retry
+        """
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+
+        # Number of spawns which raised a transient error
+        self.transient_errors = 0
+        # Number of spawns which were abandoned after max_attempts
+        self.exhausted = 0
+        # Map from filename -> number of transient errors it caused
+        self.files = {}
+
+    def is_transient(self, exc):
+        """Return True if an error raised while spawning a subprocess is transient."""
+        return exc.errno in self.TRANSIENT_ERRNOS or 'Text file busy' in str(exc)
+
+    def get_retry_delay(self, exc, attempt):
+        """Record a spawn error and get the delay before the next attempt.
+
+        :param exc: The OSError raised by the spawn
+        :param attempt: The number of attempts which have been made, starting at 1
+        :returns: Delay in seconds, or None if the spawn should not be retried
+        """
+        if not self.is_transient(exc):
+            return None
+
+        self.transient_errors += 1
+        self.files[exc.filename] = self.files.get(exc.filename, 0) + 1
+
+        if attempt >= self.max_attempts:
+            self.exhausted += 1
+            return None
+
+        return min(self.max_delay, self.initial_delay * self.backoff ** (attempt - 1))
+
+
+def _set_result_if_pending(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def wait_for_slot(loop, limiter):
+    """Get a future which completes when a resource class slot is released.
+
+    :param loop: The event loop which should wake up the waiter
+    :param limiter: The ResourceClassLimiter whose slots are awaited
+    :returns: A future which completes with None
+    """
+    future = asyncio.Future(loop=loop)
+    limiter.add_waiter(future)
+    return future
+
+
+def _get_process_tree(pid):
+    """Get a process and all of its descendants as psutil Processes.
+
+    :returns: List of Processes, or None if psutil is not available
+    """
+    if psutil is None:
+        return None
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.Error:
+        return []
+
+
+class JobCanceller(object):
+
+    """Stops the subprocesses of jobs which are cancelled while they are running.
+
+    The subprocesses of command stages are not started in their own process
+    groups, so when psutil is available, the whole process tree of a stage
+    is collected when it is cancelled. Each process is asked to terminate
+    with SIGTERM, and killed with SIGKILL if it is still running after
+    `kill_timeout` seconds.
+
+    The jobserver token of a cancelled job is given back as soon as it is
+    cancelled, instead of once its subprocesses have exited, so that other
+    jobs can use it in the meantime.
+    """
+
+    def __init__(self, loop, kill_timeout=CANCEL_KILL_TIMEOUT):
+        """
+        :param loop: The event loop on which to schedule killing subprocesses
+        :param kill_timeout: Seconds to wait after SIGTERM before sending SIGKILL
+        """
+        self.loop = loop
+        self.kill_timeout = kill_timeout
+
+        # Map from job id -> pid of the running subprocess of the job
+        self.pids = {}
+        # Set of ids of cancelled jobs
+        self.cancelled = set()
+        # Set of ids of jobs which hold a jobserver token
+        self.token_holders = set()
+
+    def add_process(self, job_id, pid):
+        """Register the running subprocess of a job."""
+        self.pids[job_id] = pid
+        if job_id in self.cancelled:
+            self._terminate(job_id, pid)
+
+    def remove_process(self, job_id):
+        """Unregister the subprocess of a job once it has exited."""
+        self.pids.pop(job_id, None)
+
+    def is_cancelled(self, job_id):
+        return job_id in self.cancelled
+
+    def hold_token(self, job_id):
+        """Register that a job holds a jobserver token."""
+        self.token_holders.add(job_id)
+
+    def release_token(self, job_id):
+        """Give back the jobserver token of a job, unless it was given back when the job was cancelled."""
+        if job_id in self.token_holders:
+            self.token_holders.remove(job_id)
+            JobServer.release()
+
+    def cancel(self, job_id):
+        """Cancel a job, terminating its running subprocess if it has one.
+
+        The job itself notices that it has been cancelled before its next stage.
+        """
+        if job_id in self.cancelled:
+            return
+        self.cancelled.add(job_id)
+        if job_id in self.pids:
+            self._terminate(job_id, self.pids[job_id])
+        self.release_token(job_id)
+
+    def _terminate(self, job_id, pid):
+        processes = _get_process_tree(pid)
+        self._signal(job_id, pid, processes, signal.SIGTERM)
+        self.loop.call_later(
+            self.kill_timeout,
+            self._signal, job_id, pid, processes, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+    def _signal(self, job_id, pid, processes, sig):
+        if processes is None:
+            # Without psutil, only signal the subprocess if it hasn't exited,
+            # since its pid could otherwise have been reused
+            if self.pids.get(job_id) == pid:
+                try:
+                    os.kill(pid, sig)
+                except OSError:
+                    pass
+            return
+
+        for process in processes:
+            try:
+                # This also checks that the pid hasn't been reused
+                if process.is_running():
+                    process.send_signal(sig)
+            except psutil.Error:
+                pass
+
+
+def interrupt_jobs():
+    """Interrupt all running executions.
+
+    Their queued and pending jobs are abandoned and their active jobs are
+    cancelled, after which :py:func:`execute_jobs` returns.
+    """
+    for future in _interrupt_futures:
+        _set_result_if_pending(future)
 
 
 @asyncio.coroutine
-def async_job(label, job, threadpool, event_queue, log_path):
+def async_job(label, job, threadpool, event_queue, build_log, resource_monitor=None, spawn_retry_policy=None,
+              canceller=None, provided_f=None, limiter=None):
     """Run a sequence of Stages from a Job and collect their output.
 
     :param job: A Job instance
     :threadpool: A thread pool executor for blocking stages
     :event_queue: A queue for asynchronous events
+    :build_log: The BuildLog of the execution, to which the output of the stages is logged
+    :resource_monitor: A ResourceMonitor which accounts for command stages
+    :spawn_retry_policy: A SpawnRetryPolicy for transient errors when spawning commands
+    :canceller: A JobCanceller which can stop this job, and gives back its jobserver token once it is cancelled
+    :provided_f: A future which is completed once the job's `provides` stage has succeeded
+    :limiter: A ResourceClassLimiter which limits the concurrent stages of each resource class
     """
 
+    if spawn_retry_policy is None:
+        spawn_retry_policy = SpawnRetryPolicy()
+    if canceller is None:
+        canceller = JobCanceller(get_loop())
+
     # Initialize success flag
     all_stages_succeeded = True
 
-    # Jobs start occuping a jobserver job
+    # Jobs start occuping a jobserver job, which the canceller gives back if the job is cancelled
     occupying_job = True
+    canceller.hold_token(job.jid)
 
     # Execute each stage of this job
     for stage in job.stages:
         # Logger reference in this scope for error reporting
         logger = None
 
+        # Resources used by this stage, if they could be measured
+        cpu_time, peak_rss, io_bytes = None, None, None
+
+        # Time spent waiting to get a jobserver token back before this stage
+        token_wait = 0.0
+
         # Abort the job if one of the stages has failed
         if job.continue_on_failure and not all_stages_succeeded:
             break
@@ -57,38 +285,79 @@ def async_job(label, job, threadpool, event_queue, log_path):
         # If the stage doesn't require a job token, release it temporarily
         if stage.occupy_job:
             if not occupying_job:
-                while JobServer.try_acquire() is None:
-                    yield asyncio.From(asyncio.sleep(0.2))
+                wait_start = time.time()
+                yield asyncio.From(JobServer.acquire_async(get_loop()))
+                canceller.hold_token(job.jid)
+                token_wait += time.time() - wait_start
                 occupying_job = True
         else:
             if occupying_job:
-                JobServer.release()
+                canceller.release_token(job.jid)
                 occupying_job = False
 
+        # Wait for a slot of the stage's resource class, without holding a
+        # jobserver token, so that it can be used by stages of other classes
+        if limiter is not None:
+            while not limiter.available(stage.resource_class):
+                if canceller.is_cancelled(job.jid):
+                    break
+                if occupying_job:
+                    canceller.release_token(job.jid)
+                    occupying_job = False
+                yield asyncio.From(wait_for_slot(get_loop(), limiter))
+
+        # Don't start any more stages once the job has been cancelled
+        if canceller.is_cancelled(job.jid):
+            all_stages_succeeded = False
+            break
+
+        if limiter is not None:
+            limiter.acquire(stage.resource_class)
+            if stage.occupy_job and not occupying_job:
+                wait_start = time.time()
+                yield asyncio.From(JobServer.acquire_async(get_loop()))
+                canceller.hold_token(job.jid)
+                token_wait += time.time() - wait_start
+                occupying_job = True
+
         # Notify stage started
         event_queue.put(ExecutionEvent(
             'STARTED_STAGE',
             job_id=job.jid,
-            stage_label=stage.label))
+            stage_label=stage.label,
+            token_wait=token_wait))
 
         if type(stage) is CommandStage:
             try:
                 # Initiate the command
+                attempt = 0
                 while True:
+                    attempt += 1
                     try:
-                        protocol_type = stage.logger_factory(label, job.jid, stage.label, event_queue, log_path)
+                        protocol_type = stage.logger_factory(label, job.jid, stage.label, event_queue, build_log)
+                        process_kwargs = stage.async_execute_process_kwargs
+                        if resource_monitor is not None:
+                            process_kwargs = resource_monitor.prepare((job.jid, stage.label), process_kwargs)
                         transport, logger = yield asyncio.From(
                             async_execute_process(
                                 protocol_type,
-                                **stage.async_execute_process_kwargs))
+                                **process_kwargs))
                         break
                     except OSError as exc:
-                        if 'Text file busy' in str(exc):
-                            # This is a transient error, try again shortly
-                            # TODO: report the file causing the problem (exc.filename)
-                            time.sleep(0.01)
-                            continue
-                        raise
+                        delay = spawn_retry_policy.get_retry_delay(exc, attempt)
+                        if delay is None:
+                            raise
+
+                        # This is a transient error, try again shortly
+                        event_queue.put(ExecutionEvent(
+                            'SPAWN_RETRY',
+                            job_id=job.jid,
+                            stage_label=stage.label,
+                            attempt=attempt,
+                            filename=exc.filename,
+                            error=str(exc),
+                            delay=delay))
+                        yield asyncio.From(asyncio.sleep(delay))
 
                 # Notify that a subprocess has been created
                 event_queue.put(ExecutionEvent(
@@ -97,16 +366,28 @@ def async_job(label, job, threadpool, event_queue, log_path):
                     stage_label=stage.label,
                     **stage.async_execute_process_kwargs))
 
+                # Account for the resources used by the command
+                if resource_monitor is not None:
+                    resource_monitor.start((job.jid, stage.label), transport.get_pid())
+                canceller.add_process(job.jid, transport.get_pid())
+
                 # Asynchronously yield until this command is  completed
                 retcode = yield asyncio.From(logger.complete)
+
+                canceller.remove_process(job.jid)
+                if resource_monitor is not None:
+                    cpu_time, peak_rss, io_bytes = resource_monitor.stop((job.jid, stage.label))
             except:
+                canceller.remove_process(job.jid)
+                if resource_monitor is not None:
+                    resource_monitor.stop((job.jid, stage.label))
                 if logger is None:
-                    logger = IOBufferLogger(label, job.jid, stage.label, event_queue, log_path)
+                    logger = IOBufferLogger(label, job.jid, stage.label, event_queue, build_log)
                 logger.err(str(traceback.format_exc()))
                 retcode = 3
 
         elif type(stage) is FunctionStage:
-            logger = IOBufferLogger(label, job.jid, stage.label, event_queue, log_path)
+            logger = IOBufferLogger(label, job.jid, stage.label, event_queue, build_log)
             try:
                 # Asynchronously yield until this function is completed
                 retcode = yield asyncio.From(get_loop().run_in_executor(
@@ -129,17 +410,33 @@ def async_job(label, job, threadpool, event_queue, log_path):
         # Close the logger
         logger.close()
 
+        if limiter is not None:
+            limiter.release(stage.resource_class)
+
         # Store the results from this stage
         event_queue.put(ExecutionEvent(
             'FINISHED_STAGE',
             job_id=job.jid,
             stage_label=stage.label,
             succeeded=stage_succeeded,
-            stdout=logger.stdout_buffer,
-            stderr=logger.stderr_buffer,
-            interleaved=logger.interleaved_buffer,
-            logfile_filename=logger.unique_logfile_name,
-            retcode=retcode))
+            stdout=logger.stdout,
+            stderr=logger.stderr,
+            interleaved=logger.interleaved,
+            logfile_filename=logger.logfile_name,
+            retcode=retcode,
+            cancelled=not stage_succeeded and canceller.is_cancelled(job.jid),
+            cpu_time=cpu_time,
+            peak_rss=peak_rss,
+            io_bytes=io_bytes,
+            diagnostics=logger.diagnostics))
+
+        # Let the dependants of this job start while its remaining stages run
+        if stage_succeeded and stage.label == job.provides and provided_f is not None:
+            _set_result_if_pending(provided_f)
+
+    # Give the jobserver token back
+    if occupying_job:
+        canceller.release_token(job.jid)
 
     # Finally, return whether all stages of the job completed
     raise asyncio.Return(job.jid, all_stages_succeeded)
@@ -153,7 +450,16 @@ def execute_jobs(
         log_path,
         max_toplevel_jobs=None,
         continue_on_failure=False,
-        continue_without_deps=False):
+        continue_without_deps=False,
+        priorities=None,
+        spawn_retry_policy=None,
+        fail_fast=False,
+        resource_class_limits=None,
+        memory_budget=None,
+        adaptive_concurrency=None,
+        sandbox=None,
+        log_compression=None,
+        log_compression_level=None):
     """Process a number of jobs asynchronously.
 
     :param jobs: A list of topologically-sorted Jobs with no circular dependencies.
@@ -162,12 +468,35 @@ def execute_jobs(
     :param max_toplevel_jobs: Max number of top-level jobs
     :param continue_on_failure: Keep running jobs even if one fails.
     :param continue_without_deps: Run jobs even if their dependencies fail.
+    :param priorities: Map from job id to a sort key, ready jobs with larger
+        keys are started first (see :py:func:`scheduling.get_job_priorities`).
+        If None, ready jobs are started in topological order.
+    :param spawn_retry_policy: The SpawnRetryPolicy used to retry spawning
+        commands which fail with transient errors, its counters are updated
+        as the jobs run.
+    :param fail_fast: Unless continuing on failure, cancel the active jobs
+        and terminate their subprocesses as soon as any job fails.
+    :param resource_class_limits: Map from stage resource class to the
+        maximum number of stages of that class which can run at once. Jobs
+        whose next limited stage can't start are passed over in favor of
+        jobs whose stages can.
+    :param memory_budget: A MemoryBudget which only lets jobs start if their
+        estimated memory usage fits, or None to not limit memory.
+    :param adaptive_concurrency: An AdaptiveConcurrency which periodically
+        adjusts the number of jobserver tokens in circulation to the
+        pressure on the system, or None to always use all of them.
+    :param sandbox: A CgroupSandbox in which each command stage is run in
+        its own cgroup to account for its resources exactly, or None.
+    :param log_compression: The method with which the log segment is
+        compressed as it is written, 'zlib' or 'zstd', or None.
+    :param log_compression_level: The level of the log compression, or None
+        for the default level of the method.
     """
 
     # Map of jid -> job
     job_map = dict([(j.jid, j) for j in jobs])
-    # Jobs which are not ready to be executed
-    pending_jobs = []
+    # Map of jid -> job for jobs which are not ready to be executed
+    pending_jobs = dict([(j.jid, j) for j in jobs])
     # Jobs which are ready to be executed once workers are available
     queued_jobs = []
     # List of active jobs
@@ -178,71 +507,286 @@ def execute_jobs(
     completed_jobs = {}
     # List of jobs whose deps failed
     abandoned_jobs = []
+    # List of jobs which were cancelled while they were active
+    cancelled_jobs = []
+    # Map of jid -> (reason, peer job id) for active jobs which are being cancelled
+    cancel_reasons = {}
+    # Map of jid -> future completed by active jobs once their dependants can start
+    provided_fs = {}
+    # Set of ids of jobs whose dependants were started before they finished
+    provided_jobs = set()
+
+    # Dependency counters which determine when each job becomes ready
+    job_graph = JobGraph(jobs)
+
+    # Get the event loop which wakes up this coroutine
+    loop = get_loop()
 
     # Create a thread pool executor for blocking python stages in the asynchronous jobs
     threadpool = ThreadPoolExecutor(max_workers=JobServer.max_jobs())
 
+    # Measure the resources used by each command stage
+    resource_monitor = ResourceMonitor(loop, sandbox=sandbox)
+
+    # The output of all of the stages is logged to one segment, which is closed at the end of the execution
+    build_log = BuildLog(log_path, label, log_compression, log_compression_level)
+
+    # Share one spawn retry policy between all jobs so its counters cover the whole execution
+    if spawn_retry_policy is None:
+        spawn_retry_policy = SpawnRetryPolicy()
+
+    # Stops the subprocesses of cancelled jobs
+    canceller = JobCanceller(loop)
+
+    # Limits the number of concurrent stages of each resource class
+    limiter = ResourceClassLimiter(resource_class_limits)
+
+    # Completes when this execution is interrupted by the user
+    interrupt_f = asyncio.Future(loop=loop)
+    _interrupt_futures.append(interrupt_f)
+    interrupted = False
+
+    # Set when the remaining jobs are abandoned because none of them can ever start
+    unschedulable = False
+
     # Immediately abandon jobs with bad dependencies
-    pending_jobs, new_abandoned_jobs = split(jobs, lambda j: all([d in job_map for d in j.deps]))
+    for job in jobs:
+        missing_dep_ids = [d for d in job.deps if d not in job_map]
+        if len(missing_dep_ids) > 0:
+            del pending_jobs[job.jid]
+            job_graph.abandon(job.jid)
+            abandoned_jobs.append(job)
+            event_queue.put(ExecutionEvent(
+                'ABANDONED_JOB',
+                job_id=job.jid,
+                reason='MISSING_DEPS',
+                dep_ids=missing_dep_ids))
+
+    # Also abandon the jobs which depend on them, since they could never start
+    for missing_deps_job in list(abandoned_jobs):
+        for abandoned_job, direct_dep_job_id in job_graph.abandon_dependants(missing_deps_job.jid):
+            del pending_jobs[abandoned_job.jid]
+            abandoned_jobs.append(abandoned_job)
+            event_queue.put(ExecutionEvent(
+                'ABANDONED_JOB',
+                job_id=abandoned_job.jid,
+                reason='DEP_ABANDONED',
+                direct_dep_job_id=direct_dep_job_id,
+                dep_job_id=missing_deps_job.jid))
 
-    for abandoned_job in new_abandoned_jobs:
-        abandoned_jobs.append(abandoned_job)
-        event_queue.put(ExecutionEvent(
-            'ABANDONED_JOB',
-            job_id=abandoned_job.jid,
-            reason='MISSING_DEPS',
-            dep_ids=[d for d in abandoned_job.deps if d not in job_map]))
+    def prioritize(ready_jobs):
+        # Stable sort, so equally-urgent jobs keep their topological order
+        if priorities is not None:
+            ready_jobs.sort(key=lambda j: priorities[j.jid], reverse=True)
 
     # Initialize list of ready and pending jobs (jobs not ready to be executed)
-    queued_jobs, pending_jobs = split(pending_jobs, lambda j: len(j.deps) == 0)
+    queued_jobs = job_graph.get_ready_jobs()
+    for queued_job in queued_jobs:
+        del pending_jobs[queued_job.jid]
+    prioritize(queued_jobs)
+
+    def abandon_all_jobs(reason, **data):
+        # Abandon all of the queued and pending jobs
+        for abandoned_job in queued_jobs + list(pending_jobs.values()):
+            job_graph.abandon(abandoned_job.jid)
+            abandoned_jobs.append(abandoned_job)
+            event_queue.put(ExecutionEvent(
+                'ABANDONED_JOB',
+                job_id=abandoned_job.jid,
+                reason=reason,
+                **data))
+        del queued_jobs[:]
+        pending_jobs.clear()
+
+    def cancel_active_jobs(reason, peer_job_id=None):
+        # Stop the active jobs, which give their tokens back once they have stopped
+        for active_job in active_jobs:
+            if active_job.jid not in cancel_reasons:
+                cancel_reasons[active_job.jid] = (reason, peer_job_id)
+                canceller.cancel(active_job.jid)
+
+    def queue_jobs(new_queued_jobs):
+        # Move jobs whose dependencies have completed from pending to queued
+        for queued_job in new_queued_jobs:
+            del pending_jobs[queued_job.jid]
+        queued_jobs.extend(new_queued_jobs)
+        prioritize(queued_jobs)
+
+        # Notify of newly queued jobs
+        for queued_job in new_queued_jobs:
+            event_queue.put(ExecutionEvent(
+                'QUEUED_JOB',
+                job_id=queued_job.jid))
+
+    def get_next_job():
+        # Get the most urgent queued job which could start its stages now
+        if (max_toplevel_jobs is not None) and (len(active_jobs) >= max_toplevel_jobs):
+            return None
+        for queued_job in queued_jobs:
+            if memory_budget is not None and not memory_budget.fits(queued_job.jid):
+                continue
+            if limiter.job_available(queued_job):
+                return queued_job
+        return None
+
+    def get_memory_headroom():
+        return memory_budget.headroom() if memory_budget is not None else None
+
+    def can_activate_job():
+        return get_next_job() is not None
+
+    # Sample the load and memory conditions in the background
+    JobServer.start_sampling(loop)
+
+    # Periodically adapt the number of jobs to the pressure on the system
+    adapt_handles = []
+
+    def adapt_jobs():
+        pressures = adaptive_concurrency.sample()
+        if pressures is not None:
+            previous_jobs = JobServer.effective_jobs()
+            n_jobs = adaptive_concurrency.update(pressures)
+            if n_jobs != previous_jobs:
+                JobServer.set_effective_jobs(n_jobs)
+                event_queue.put(ExecutionEvent(
+                    'JOBS_ADJUSTED',
+                    previous_jobs=previous_jobs,
+                    jobs=n_jobs,
+                    pressures=pressures))
+        adapt_handles[:] = [loop.call_later(ADAPTIVE_JOBS_PERIOD, adapt_jobs)]
+
+    if adaptive_concurrency is not None:
+        adapt_jobs()
+
+    # Future of the jobserver token for the next job, and when it was requested
+    token_f = None
+    token_request_time = None
 
     # Process all jobs asynchronously until there are none left
     while len(active_job_fs) + len(queued_jobs) + len(pending_jobs) > 0:
 
-        # Activate jobs while the jobserver dispenses tokens
-        while ((len(queued_jobs) > 0) and
-               ((max_toplevel_jobs is None) or (len(active_jobs) < max_toplevel_jobs)) and
-               (JobServer.try_acquire() is not None)):
+        # Give back the token if no job can use it anymore, or stop waiting for it
+        if token_f is not None and not can_activate_job():
+            if not token_f.cancel():
+                JobServer.release()
+            token_f = None
+            token_request_time = None
 
-            # Pop a job off of the job queue
-            job = queued_jobs.pop(0)
+        # Activate jobs while the jobserver dispenses tokens
+        while can_activate_job():
+            if token_f is None:
+                token_f = JobServer.acquire_async(loop)
+                token_request_time = token_request_time or time.time()
+            if not token_f.done():
+                break
+            token_f = None
+
+            # Take the job off of the job queue
+            job = get_next_job()
+            queued_jobs.remove(job)
 
             # Label it (for debugging)
             JobServer.add_label(job.jid)
 
-            # Notify that the job is being started
+            # Notify that the job is being started, and how long it waited for the jobserver
             event_queue.put(ExecutionEvent(
                 'STARTED_JOB',
-                job_id=job.jid))
+                job_id=job.jid,
+                token_wait=time.time() - token_request_time))
+            token_request_time = None
 
             # Start the job coroutine
             active_jobs.append(job)
-            active_job_fs.add(async_job(label, job, threadpool, event_queue, log_path))
+            job_graph.start(job.jid)
+            if memory_budget is not None:
+                memory_budget.reserve(job.jid)
+            if job.provides is not None:
+                provided_fs[job.jid] = asyncio.Future(loop=loop)
+            active_job_fs.add(asyncio.Task(
+                async_job(
+                    label, job, threadpool, event_queue, build_log, resource_monitor, spawn_retry_policy, canceller,
+                    provided_fs.get(job.jid), limiter),
+                loop=loop))
 
         # Report running jobs
         event_queue.put(ExecutionEvent(
             'JOB_STATUS',
-            pending=[j.jid for j in pending_jobs],
+            pending=list(pending_jobs),
             queued=[j.jid for j in queued_jobs],
             active=[j.jid for j in active_jobs],
             abandoned=[j.jid for j in abandoned_jobs],
-            completed=completed_jobs
+            cancelled=cancelled_jobs,
+            completed=completed_jobs,
+            memory_headroom=get_memory_headroom()
         ))
 
+        # Wake up as soon as a job completes, or as soon as a token is acquired
+        # if there are jobs which could be started
+        wait_fs = set(active_job_fs) | set(provided_fs.values())
+        slot_f = None
+        if token_f is not None:
+            wait_fs.add(token_f)
+        elif len(queued_jobs) > 0 and len(active_job_fs) > 0:
+            # The queued jobs are waiting for slots of their resource classes
+            slot_f = wait_for_slot(loop, limiter)
+            wait_fs.add(slot_f)
+        if not interrupted:
+            wait_fs.add(interrupt_f)
+
+        if len(wait_fs - set([interrupt_f])) == 0:
+            # Nothing can make progress (this only happens if a job can never be queued)
+            unschedulable = True
+            abandon_all_jobs('UNSCHEDULABLE')
+            break
+
         # Process jobs as they complete asynchronously
-        done_job_fs, active_job_fs = yield asyncio.From(asyncio.wait(
-            active_job_fs,
-            timeout=0.10,
+        done_fs, _ = yield asyncio.From(asyncio.wait(
+            wait_fs,
             return_when=FIRST_COMPLETED))
 
+        if slot_f is not None and not slot_f.done():
+            slot_f.cancel()
+
+        # Stop everything if the user has interrupted the execution
+        if interrupt_f.done() and not interrupted:
+            interrupted = True
+            abandon_all_jobs('INTERRUPTED')
+            cancel_active_jobs('INTERRUPTED')
+
+        # Start the dependants of jobs which have provided what they need
+        for job_id, provided_f in list(provided_fs.items()):
+            if provided_f.done():
+                del provided_fs[job_id]
+                provided_jobs.add(job_id)
+                queue_jobs(job_graph.complete(job_id))
+
+        done_job_fs = done_fs & active_job_fs
+        active_job_fs = active_job_fs - done_job_fs
+
         for done_job_f in done_job_fs:
             # Capture a result once the job has finished
             job_id, succeeded = yield asyncio.From(done_job_f)
-
-            # Release a jobserver token now that this job has succeeded
-            JobServer.release(job_id)
             active_jobs = [j for j in active_jobs if j.jid != job_id]
 
+            # This job finished without providing anything early
+            if job_id in provided_fs:
+                provided_fs.pop(job_id).cancel()
+
+            # The job has given its jobserver token back
+            JobServer.del_label(job_id)
+            if memory_budget is not None:
+                memory_budget.release(job_id)
+
+            if job_id in cancel_reasons and not succeeded:
+                reason, peer_job_id = cancel_reasons[job_id]
+                cancelled_jobs.append(job_id)
+                event_queue.put(ExecutionEvent(
+                    'CANCELLED_JOB',
+                    job_id=job_id,
+                    reason=reason,
+                    peer_job_id=peer_job_id))
+                continue
+
             # Generate event with the results of this job
             event_queue.put(ExecutionEvent(
                 'FINISHED_JOB',
@@ -257,70 +801,74 @@ def execute_jobs(
                 # Handle different abandoning policies
                 if not continue_on_failure:
                     # Abort all pending jobs if any job fails
-                    new_abandoned_jobs = queued_jobs + pending_jobs
-                    queued_jobs = []
-                    pending_jobs = []
+                    abandon_all_jobs('PEER_FAILED', peer_job_id=job_id)
+
+                    # Also stop the jobs which are already running
+                    if fail_fast:
+                        cancel_active_jobs('PEER_FAILED', job_id)
 
-                    # Notify that jobs have been abandoned
-                    for abandoned_job in new_abandoned_jobs:
+                elif not continue_without_deps:
+                    # Abandon all jobs which depend on this job, directly or via other abandoned jobs
+                    for abandoned_job, direct_dep_job_id in job_graph.abandon_dependants(job_id):
+                        # Dependants of a job which provided them early may already be queued
+                        if abandoned_job.jid in pending_jobs:
+                            del pending_jobs[abandoned_job.jid]
+                        else:
+                            queued_jobs.remove(abandoned_job)
                         abandoned_jobs.append(abandoned_job)
+                        # Notify if any jobs have been abandoned
                         event_queue.put(ExecutionEvent(
                             'ABANDONED_JOB',
                             job_id=abandoned_job.jid,
-                            reason='PEER_FAILED',
-                            peer_job_id=job_id))
-
-                elif not continue_without_deps:
-                    unhandled_abandoned_job_ids = [job_id]
-
-                    # Abandon jobs which depend on abandoned jobs
-                    while len(unhandled_abandoned_job_ids) > 0:
-                        # Get the abandoned job
-                        abandoned_job_id = unhandled_abandoned_job_ids.pop(0)
-
-                        # Abandon all pending jobs which depend on this job_id
-                        unhandled_abandoned_jobs, pending_jobs = split(
-                            pending_jobs,
-                            lambda j: abandoned_job_id in j.deps)
-
-                        # Handle each new abandoned job
-                        for abandoned_job in unhandled_abandoned_jobs:
-                            abandoned_jobs.append(abandoned_job)
-                            # Notify if any jobs have been abandoned
-                            event_queue.put(ExecutionEvent(
-                                'ABANDONED_JOB',
-                                job_id=abandoned_job.jid,
-                                reason='DEP_FAILED',
-                                direct_dep_job_id=abandoned_job_id,
-                                dep_job_id=job_id))
-
-                        # Add additional job ids to check
-                        unhandled_abandoned_job_ids.extend(
-                            [j.jid for j in unhandled_abandoned_jobs])
+                            reason='DEP_FAILED',
+                            direct_dep_job_id=direct_dep_job_id,
+                            dep_job_id=job_id))
+
+                    # Stop the dependants which it provided for before it failed
+                    if job_id in provided_jobs:
+                        started_ids = set(job_graph.get_started_dependants(job_id))
+                        for active_job in active_jobs:
+                            if active_job.jid in started_ids and active_job.jid not in cancel_reasons:
+                                cancel_reasons[active_job.jid] = ('DEP_FAILED', job_id)
+                                canceller.cancel(active_job.jid)
 
             # Update the list of ready jobs (based on completed job dependencies)
-            new_queued_jobs, pending_jobs = split(
-                pending_jobs,
-                lambda j: j.all_deps_completed(completed_jobs))
-            queued_jobs.extend(new_queued_jobs)
-
-            # Notify of newly queued jobs
-            for queued_job in new_queued_jobs:
-                event_queue.put(ExecutionEvent(
-                    'QUEUED_JOB',
-                    job_id=queued_job.jid))
+            if job_id not in provided_jobs:
+                queue_jobs(job_graph.complete(job_id))
 
     # Report running jobs
     event_queue.put(ExecutionEvent(
         'JOB_STATUS',
-        pending=[j.jid for j in pending_jobs],
+        pending=list(pending_jobs),
         queued=[j.jid for j in queued_jobs],
         active=[j.jid for j in active_jobs],
         abandoned=[j.jid for j in abandoned_jobs],
-        completed=completed_jobs
+        cancelled=cancelled_jobs,
+        completed=completed_jobs,
+        memory_headroom=get_memory_headroom()
     ))
 
-    raise asyncio.Return(all(completed_jobs.values()))
+    # Stop waiting for a token, or give back the one which was acquired
+    if token_f is not None and not token_f.cancel():
+        JobServer.release()
+    JobServer.stop_sampling()
+
+    # Put all of the tokens back in circulation
+    for handle in adapt_handles:
+        handle.cancel()
+    if adaptive_concurrency is not None:
+        JobServer.set_effective_jobs(JobServer.max_jobs())
+
+    # Remove the cgroups of the stages
+    if sandbox is not None:
+        sandbox.close()
+
+    _interrupt_futures.remove(interrupt_f)
+
+    build_log.close()
+
+    raise asyncio.Return(
+        all(completed_jobs.values()) and not interrupted and len(cancelled_jobs) == 0 and not unschedulable)
 
 
 def run_until_complete(coroutine):
@@ -328,4 +876,11 @@ def run_until_complete(coroutine):
     loop = get_loop()
 
     # Run jobs
-    return loop.run_until_complete(coroutine)
+    task = asyncio.Task(coroutine, loop=loop)
+    try:
+        return loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        # Cancel the active jobs the same way as when a job fails, and wait for them to stop
+        interrupt_jobs()
+        loop.run_until_complete(task)
+        raise
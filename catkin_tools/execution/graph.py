@@ -0,0 +1,163 @@
+"""Incremental tracking of which jobs in a job graph are ready to run.
+
+The dependencies of a :py:class:`catkin_tools.execution.jobs.Job` are usually
+the full recursive closure of its dependencies, so checking every pending job
+against the set of completed jobs whenever a job completes is quadratic in the
+size of the workspace. A :py:class:`JobGraph` instead stores the transitive
+reduction of the graph along with the reverse edges, and counts the number of
+unfinished direct dependencies of each job, so that completing or abandoning a
+job only visits the edges to the jobs which directly depend on it.
+"""
+
+from collections import deque
+
+from .scheduling import get_topological_order
+
+
+def get_transitive_reduction(deps):
+    """Remove the dependencies which are implied by other dependencies.
+
+    A dependency of a job is removed if it is also a dependency of one of the
+    job's other dependencies. Each job still transitively depends on exactly
+    the same jobs as before.
+
+    :param deps: Map from job id to the ids of the jobs it depends on
+    :type deps: dict
+    :returns: Map from job id to the ids of the jobs it directly depends on
+    :rtype: dict
+    """
+    order = get_topological_order(deps)
+    index = dict([(jid, i) for i, jid in enumerate(order)])
+
+    # Bitsets of the topological indices of the transitive dependencies of each job
+    ancestors = {}
+    reduced_deps = {}
+    for jid in order:
+        covered = 0
+        reduced_deps[jid] = []
+        # Later dependencies might depend on earlier ones, but not the other way around
+        for dep_id in sorted([d for d in set(deps[jid]) if d in index], key=index.get, reverse=True):
+            if not (covered >> index[dep_id]) & 1:
+                reduced_deps[jid].append(dep_id)
+                covered |= ancestors[dep_id] | (1 << index[dep_id])
+        ancestors[jid] = covered
+
+    return reduced_deps
+
+
+class JobGraph(object):
+
+    """The state of the dependencies between a set of jobs as they are executed.
+
+    Jobs become ready once all of their dependencies have completed, whether
+    they succeeded or not. Abandoned jobs never become ready, and never
+    complete, so neither do the jobs which depend on them.
+
+    A job can be completed before it has finished (see `Job.provides`), in
+    which case its dependants might already have been started by the time it
+    fails.
+    """
+
+    def __init__(self, jobs):
+        """
+        :param jobs: A list of Jobs with no circular dependencies
+        :raises: ValueError if the jobs have circular dependencies
+        """
+        self.jobs = dict([(j.jid, j) for j in jobs])
+        self.job_ids = [j.jid for j in jobs]
+
+        # Map from job id -> ids of the jobs it directly depends on
+        self.deps = get_transitive_reduction(dict([(j.jid, j.deps) for j in jobs]))
+        # Map from job id -> ids of the jobs which directly depend on it
+        self.dependants = dict([(jid, []) for jid in self.deps])
+        for jid, dep_ids in self.deps.items():
+            for dep_id in dep_ids:
+                self.dependants[dep_id].append(jid)
+
+        # Map from job id -> number of direct dependencies which haven't completed
+        self.remaining = dict([(jid, len(dep_ids)) for jid, dep_ids in self.deps.items()])
+        # Set of ids of jobs which have been abandoned
+        self.abandoned = set()
+        # Set of ids of jobs which have been started
+        self.started = set()
+
+        # Number of edges visited while updating the graph
+        self.edge_visits = 0
+
+    def get_ready_jobs(self):
+        """Get the jobs which have no dependencies, in their original order.
+
+        :returns: List of Jobs
+        """
+        return [self.jobs[jid] for jid in self.job_ids if self.remaining[jid] == 0 and jid not in self.abandoned]
+
+    def complete(self, job_id):
+        """Mark a job as completed.
+
+        :param job_id: The id of a job which has completed, successfully or not
+        :returns: List of Jobs which have become ready to run
+        """
+        ready_jobs = []
+        for dependant_id in self.dependants[job_id]:
+            self.edge_visits += 1
+            self.remaining[dependant_id] -= 1
+            if self.remaining[dependant_id] == 0 and dependant_id not in self.abandoned:
+                ready_jobs.append(self.jobs[dependant_id])
+        return ready_jobs
+
+    def start(self, job_id):
+        """Mark a job as started, so that it is not abandoned anymore."""
+        self.started.add(job_id)
+
+    def abandon(self, job_id):
+        """Mark a job as abandoned without abandoning the jobs which depend on it.
+
+        :param job_id: The id of a job which will never be executed
+        """
+        self.abandoned.add(job_id)
+
+    def get_started_dependants(self, job_id):
+        """Get the jobs which transitively depend on a job, and have been started.
+
+        :param job_id: The id of a job
+        :returns: List of the ids of the started dependants, in breadth-first order
+        """
+        started = []
+        visited = set()
+        unhandled_job_ids = deque([job_id])
+        while len(unhandled_job_ids) > 0:
+            for dependant_id in self.dependants[unhandled_job_ids.popleft()]:
+                self.edge_visits += 1
+                if dependant_id in self.started and dependant_id not in visited:
+                    visited.add(dependant_id)
+                    started.append(dependant_id)
+                    unhandled_job_ids.append(dependant_id)
+        return started
+
+    def abandon_dependants(self, job_id):
+        """Abandon all of the jobs which transitively depend on a job.
+
+        Dependants which have already been started are not abandoned, but the
+        jobs which depend on them are.
+
+        :param job_id: The id of a job whose dependants can't be executed
+        :returns: List of (Job, direct dependency id) tuples for each newly
+            abandoned job, where the direct dependency is the job it was
+            abandoned because of, in breadth-first order
+        """
+        abandoned = []
+        visited = set()
+        unhandled_job_ids = deque([job_id])
+        while len(unhandled_job_ids) > 0:
+            abandoned_job_id = unhandled_job_ids.popleft()
+            for dependant_id in self.dependants[abandoned_job_id]:
+                self.edge_visits += 1
+                if dependant_id in self.started:
+                    if dependant_id not in visited:
+                        visited.add(dependant_id)
+                        unhandled_job_ids.append(dependant_id)
+                elif dependant_id not in self.abandoned:
+                    self.abandoned.add(dependant_id)
+                    abandoned.append((self.jobs[dependant_id], abandoned_job_id))
+                    unhandled_job_ids.append(dependant_id)
+        return abandoned
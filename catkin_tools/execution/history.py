@@ -0,0 +1,343 @@
+"""Persistent history of the time and resources used by previous builds.
+
+The history is stored in a small SQLite database in the build space. Each
+build adds one row per executed job stage, which records the stage's wall
+time, CPU time, peak memory usage and exit code, along with the profile and
+the source commit of the package it was built from.
+"""
+
+import os
+import time
+
+try:
+    import sqlite3
+except ImportError:
+    # Some minimal python builds do not include sqlite
+    sqlite3 = None
+
+# Maximum number of builds which are kept in the history
+MAX_HISTORY_BUILDS = 100
+
+# Number of recent successful runs of a job used to estimate its duration
+DURATION_SAMPLES = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    build_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT NOT NULL,
+    profile TEXT,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    succeeded INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    build_id INTEGER NOT NULL REFERENCES builds(build_id) ON DELETE CASCADE,
+    job_id TEXT NOT NULL,
+    stage_label TEXT NOT NULL,
+    source_commit TEXT,
+    start_time REAL NOT NULL,
+    wall_time REAL NOT NULL,
+    cpu_time REAL,
+    peak_rss INTEGER,
+    retcode INTEGER,
+    io_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS stages_by_job ON stages (job_id, start_time);
+CREATE INDEX IF NOT EXISTS stages_by_build ON stages (build_id);
+"""
+
+_STAGE_COLUMNS = [
+    'build_id', 'job_id', 'stage_label', 'source_commit', 'start_time',
+    'wall_time', 'cpu_time', 'peak_rss', 'retcode', 'io_bytes']
+
+# Cache of git directory -> checked out commit
+_source_commits = {}
+
+
+def _find_git_dir(path):
+    """Find the git directory of the repository containing a path."""
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return dot_git
+        elif os.path.isfile(dot_git):
+            # Submodules and worktrees use a file pointing to the git directory
+            with open(dot_git, 'r') as f:
+                line = f.readline().strip()
+            if line.startswith('gitdir:'):
+                return os.path.join(path, line[len('gitdir:'):].strip())
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _resolve_git_ref(git_dir, ref):
+    """Resolve a symbolic git ref from its loose or packed file."""
+    ref_path = os.path.join(git_dir, ref)
+    if os.path.isfile(ref_path):
+        with open(ref_path, 'r') as f:
+            return f.readline().strip()
+    packed_refs_path = os.path.join(git_dir, 'packed-refs')
+    if os.path.isfile(packed_refs_path):
+        with open(packed_refs_path, 'r') as f:
+            for line in f:
+                fields = line.strip().split(' ')
+                if len(fields) == 2 and fields[1] == ref:
+                    return fields[0]
+    return None
+
+
+def get_source_commit(path):
+    """Get the git commit checked out in the repository containing a path.
+
+    This reads the repository metadata directly instead of calling `git`, so
+    it is cheap enough to call for every package in a workspace.
+
+    :param path: A path inside of a git repository
+    :type path: str
+    :returns: The commit hash, or None if it can't be determined
+    :rtype: str
+    """
+    git_dir = _find_git_dir(path)
+    if git_dir is None:
+        return None
+    if git_dir not in _source_commits:
+        commit = None
+        try:
+            with open(os.path.join(git_dir, 'HEAD'), 'r') as f:
+                head = f.readline().strip()
+            if head.startswith('ref:'):
+                commit = _resolve_git_ref(git_dir, head[len('ref:'):].strip())
+            else:
+                commit = head
+        except (IOError, OSError):
+            pass
+        _source_commits[git_dir] = commit
+    return _source_commits[git_dir]
+
+
+class BuildHistory(object):
+
+    """A persistent store of the stages executed by previous builds."""
+
+    def __init__(self, path):
+        """
+        :param path: The path to the history database file
+        :raises: RuntimeError if sqlite is not available
+        """
+        if sqlite3 is None:
+            raise RuntimeError('The build history requires the python sqlite3 module.')
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_build(self, label, profile, start_time, end_time, succeeded, stages):
+        """Add a completed build and all of its stages to the history.
+
+        Builds beyond the most recent MAX_HISTORY_BUILDS are removed.
+
+        :param label: The label of the execution (build, clean, etc)
+        :param profile: The name of the profile which was built
+        :param start_time: The time at which the build started
+        :param end_time: The time at which the build finished
+        :param succeeded: True if all jobs succeeded
+        :param stages: A list of dicts with keys `job_id`, `stage_label`,
+            `source_commit`, `start_time`, `wall_time`, `cpu_time`,
+            `peak_rss`, `retcode` and `io_bytes`
+        :returns: The id of the new build
+        :rtype: int
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO builds (label, profile, start_time, end_time, succeeded) VALUES (?, ?, ?, ?, ?)',
+                (label, profile, start_time, end_time, int(bool(succeeded))))
+            build_id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO stages ({}) VALUES ({})'.format(
+                    ', '.join(_STAGE_COLUMNS), ', '.join(['?'] * len(_STAGE_COLUMNS))),
+                [[build_id] + [s.get(c) for c in _STAGE_COLUMNS[1:]] for s in stages])
+
+            # Drop the oldest builds
+            expired = 'SELECT build_id FROM builds ORDER BY build_id DESC LIMIT -1 OFFSET ?'
+            self.connection.execute(
+                'DELETE FROM stages WHERE build_id IN ({})'.format(expired), (MAX_HISTORY_BUILDS,))
+            self.connection.execute(
+                'DELETE FROM builds WHERE build_id IN ({})'.format(expired), (MAX_HISTORY_BUILDS,))
+
+        return build_id
+
+    def get_stages(self, job_id=None, stage_label=None, profile=None, source_commit=None,
+                   since=None, until=None, label='build'):
+        """Query the recorded stages.
+
+        All of the given parameters must match. Time bounds are compared
+        against the start time of each stage.
+
+        :param job_id: Only get stages of this job
+        :param stage_label: Only get stages with this label
+        :param profile: Only get stages built with this profile
+        :param source_commit: Only get stages built from this commit
+        :param since: Only get stages which started at or after this time
+        :param until: Only get stages which started before this time
+        :param label: Only get stages from this type of execution
+        :returns: A list of dicts ordered by start time, with the keys of
+            :py:meth:`add_build`'s stages as well as `build_id`, `profile`
+        :rtype: list
+        """
+        conditions = ['builds.label = ?']
+        values = [label]
+        for column, value in [
+                ('stages.job_id = ?', job_id),
+                ('stages.stage_label = ?', stage_label),
+                ('builds.profile = ?', profile),
+                ('stages.source_commit = ?', source_commit),
+                ('stages.start_time >= ?', since),
+                ('stages.start_time < ?', until)]:
+            if value is not None:
+                conditions.append(column)
+                values.append(value)
+
+        rows = self.connection.execute(
+            'SELECT {}, builds.profile AS profile FROM stages JOIN builds USING (build_id) '
+            'WHERE {} ORDER BY stages.start_time'.format(
+                ', '.join(['stages.' + c for c in _STAGE_COLUMNS]),
+                ' AND '.join(conditions)),
+            values)
+
+        return [dict(zip(row.keys(), row)) for row in rows]
+
+    def get_job_runs(self, profile=None, label='build', successful_only=True):
+        """Get the total wall time of each run of each job.
+
+        :param profile: Only get runs built with this profile
+        :param label: Only get runs from this type of execution
+        :param successful_only: Ignore runs in which any stage failed
+        :returns: Map from job id to a list of (start time, wall time) tuples, oldest first
+        :rtype: dict
+        """
+        rows = self.connection.execute(
+            'SELECT stages.job_id, MIN(stages.start_time), SUM(stages.wall_time), MAX(stages.retcode != 0) '
+            'FROM stages JOIN builds USING (build_id) '
+            'WHERE builds.label = ? AND (? IS NULL OR builds.profile = ?) '
+            'GROUP BY stages.build_id, stages.job_id ORDER BY MIN(stages.start_time)',
+            (label, profile, profile))
+
+        runs = {}
+        for job_id, start_time, wall_time, failed in rows:
+            if successful_only and failed:
+                continue
+            runs.setdefault(job_id, []).append((start_time, wall_time))
+        return runs
+
+    def get_job_durations(self, profile=None, label='build'):
+        """Estimate the duration of each job from its recent successful runs.
+
+        :returns: Map from job id to the mean wall time of its last few runs
+        :rtype: dict
+        """
+        durations = {}
+        for job_id, runs in self.get_job_runs(profile, label).items():
+            recent = [wall_time for _, wall_time in runs[-DURATION_SAMPLES:]]
+            durations[job_id] = sum(recent) / len(recent)
+        return durations
+
+    def get_job_peak_memory(self, profile=None, label='build'):
+        """Estimate the memory needed by each job from its recent runs.
+
+        Failed runs are included, since running out of memory is a common
+        reason for a build to fail.
+
+        :returns: Map from job id to the largest peak rss in bytes of any
+            stage of its last few runs
+        :rtype: dict
+        """
+        rows = self.connection.execute(
+            'SELECT stages.job_id, MAX(stages.peak_rss) '
+            'FROM stages JOIN builds USING (build_id) '
+            'WHERE builds.label = ? AND (? IS NULL OR builds.profile = ?) '
+            'GROUP BY stages.build_id, stages.job_id ORDER BY MIN(stages.start_time)',
+            (label, profile, profile))
+
+        runs = {}
+        for job_id, peak_rss in rows:
+            if peak_rss is not None:
+                runs.setdefault(job_id, []).append(peak_rss)
+        return dict([(job_id, max(peaks[-DURATION_SAMPLES:])) for job_id, peaks in runs.items()])
+
+
+def get_trend(values, n_samples=DURATION_SAMPLES):
+    """Compare the mean of the most recent values to the mean of those before.
+
+    :param values: A list of values, oldest first
+    :returns: The relative change, or None if there aren't enough values
+    :rtype: float
+    """
+    recent = values[-n_samples:]
+    previous = values[-2 * n_samples:-n_samples]
+    if len(previous) == 0:
+        return None
+    previous_mean = sum(previous) / len(previous)
+    if previous_mean <= 0:
+        return None
+    return (sum(recent) / len(recent) - previous_mean) / previous_mean
+
+
+class HistoryRecorder(object):
+
+    """Collects the stages of a running build from its execution events.
+
+    The stages are only written to the :py:class:`BuildHistory` by
+    :py:meth:`save`, once the build is over.
+    """
+
+    def __init__(self, label, profile, source_paths=None):
+        """
+        :param label: The label of the execution (build, clean, etc)
+        :param profile: The name of the profile being built
+        :param source_paths: Map from job id to the source path of its package
+        """
+        self.label = label
+        self.profile = profile
+        self.source_paths = source_paths or {}
+        self.start_time = time.time()
+        self.stages = []
+        self._stage_start_times = {}
+
+    def handle(self, event):
+        """Record an ExecutionEvent."""
+        eid = event.event_id
+
+        if 'STARTED_STAGE' == eid:
+            self._stage_start_times[event.data['job_id'], event.data['stage_label']] = event.time
+
+        elif 'FINISHED_STAGE' == eid:
+            job_id = event.data['job_id']
+            start_time = self._stage_start_times.pop((job_id, event.data['stage_label']), event.time)
+            source_path = self.source_paths.get(job_id)
+            self.stages.append(dict(
+                job_id=job_id,
+                stage_label=event.data['stage_label'],
+                source_commit=get_source_commit(source_path) if source_path else None,
+                start_time=start_time,
+                wall_time=event.time - start_time,
+                cpu_time=event.data.get('cpu_time'),
+                peak_rss=event.data.get('peak_rss'),
+                retcode=event.data['retcode'],
+                io_bytes=event.data.get('io_bytes')))
+
+    def save(self, history, succeeded):
+        """Add the recorded build to a history."""
+        return history.add_build(
+            self.label,
+            self.profile,
+            self.start_time,
+            time.time(),
+            succeeded,
+            self.stages)
@@ -0,0 +1,317 @@
+"""A jobserver shared by all of the catkin invocations of a user on one host.
+
+The shared jobserver is a named fifo in a well-known directory, which holds
+the tokens of all of the sessions, like the fifo of a GNU Make 4.4 jobserver.
+The first session fills it, and later sessions join it, so that concurrent
+builds of different workspaces or profiles don't each use all of the cores.
+
+Each session describes itself in a file of the `sessions` directory, which
+tells the other sessions how many tokens it holds and wants, and lets
+`catkin jobs` show who holds the tokens. The files of sessions whose process
+has exited are removed, and their tokens put back, by the next session which
+joins or leaves.
+"""
+
+import array
+import errno
+import fcntl
+import json
+import os
+import tempfile
+import time
+
+from termios import FIONREAD
+
+# Name of the file in which the number of tokens of the shared jobserver is stored
+_JOBS_FILE = 'jobs'
+
+
+def get_host_jobserver_dir():
+    """Get the directory of the host-wide jobserver of this user.
+
+    :returns: A directory in the user's runtime directory, or in the
+        temporary directory if there isn't one
+    :rtype: str
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'catkin_jobserver')
+    return os.path.join(tempfile.gettempdir(), 'catkin_jobserver_{}'.format(os.getuid()))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+def _count_tokens(fd):
+    """Get the number of tokens in a fifo, or 0 if it can't be determined."""
+    try:
+        buf = array.array('i', [0])
+        if fcntl.ioctl(fd, FIONREAD, buf) == 0:
+            return buf[0]
+    except (IOError, OSError):
+        pass
+    return 0
+
+
+def get_fair_shares(max_jobs, demands):
+    """Split the tokens between sessions with max-min fairness.
+
+    Sessions which want fewer tokens than an equal share get all of them, and
+    what they leave is split equally between the other sessions. Every
+    session gets at least one token, so none of them can be starved.
+
+    :param max_jobs: The number of tokens of the shared jobserver
+    :param demands: Map from session id to the number of tokens it wants
+    :returns: Map from session id to the number of tokens it may hold
+    :rtype: dict
+    """
+    shares = {}
+    remaining = max_jobs
+    unsatisfied = sorted(demands.items(), key=lambda item: item[1])
+    while len(unsatisfied) > 0:
+        equal_share = max(1, remaining // len(unsatisfied))
+        session_id, demand = unsatisfied.pop(0)
+        shares[session_id] = max(1, min(demand, equal_share))
+        remaining -= shares[session_id]
+    return shares
+
+
+class HostJobServerSession(object):
+
+    """The membership of one catkin invocation in the host-wide jobserver."""
+
+    def __init__(self, name, directory=None):
+        """
+        :param name: A description of the invocation shown by `catkin jobs`
+        :param directory: The directory of the shared jobserver
+        """
+        self.name = name
+        self.directory = directory or get_host_jobserver_dir()
+        self.fifo_path = os.path.join(self.directory, 'fifo')
+        self.sessions_dir = os.path.join(self.directory, 'sessions')
+        self.session_path = os.path.join(self.sessions_dir, '{}.json'.format(os.getpid()))
+        self.start_time = time.time()
+        self.max_jobs = None
+        self.job_pipe = None
+        self.make_pipe = None
+
+        self._last_status = None
+
+    def join(self, max_jobs):
+        """Open the shared fifo, filling it with tokens if this is the first session.
+
+        :param max_jobs: The number of tokens if this is the first session,
+            later sessions share the number of tokens of the first one
+        :returns: Tuple of the read and write file descriptors of the fifo
+        :rtype: tuple
+        """
+        for directory in [self.directory, self.sessions_dir]:
+            if not os.path.isdir(directory):
+                os.mkdir(directory, 0o700)
+
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            dead_sessions = prune_sessions(self.directory)
+            sessions = read_sessions(self.directory)
+            if len(sessions) == 0 or not os.path.exists(self.fifo_path):
+                # Any process still holding the old fifo keeps its own tokens
+                try:
+                    os.unlink(self.fifo_path)
+                except OSError:
+                    pass
+                os.mkfifo(self.fifo_path, 0o600)
+                self._open()
+                os.write(self.job_pipe[1], b'+' * max_jobs)
+                with open(os.path.join(self.directory, _JOBS_FILE), 'w') as jobs_file:
+                    jobs_file.write(str(max_jobs))
+                self.max_jobs = max_jobs
+            else:
+                self._open()
+                with open(os.path.join(self.directory, _JOBS_FILE)) as jobs_file:
+                    self.max_jobs = int(jobs_file.read())
+
+                self._return_lost_tokens(dead_sessions)
+
+            self.update(0, 0, [])
+
+        return self.job_pipe
+
+    def _return_lost_tokens(self, dead_sessions):
+        # Put back the tokens of sessions which were killed while holding them
+        lost_tokens = sum([s['held'] for s in dead_sessions])
+        if lost_tokens > 0:
+            os.write(self.job_pipe[1], b'+' * lost_tokens)
+
+    def _open(self):
+        # The read end stays non-blocking, since other sessions can take a token between checking and reading it
+        read_fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        write_fd = os.open(self.fifo_path, os.O_WRONLY)
+        self.job_pipe = (read_fd, write_fd)
+
+    def open_make_pipe(self):
+        """Open the fifo for versions of make which only use inherited descriptors.
+
+        Make before 4.4 blocks on reading its tokens, so it is given a
+        blocking read end of its own instead of the one of this session.
+
+        :returns: Tuple of the inheritable read and write file descriptors
+        :rtype: tuple
+        """
+        if self.make_pipe is None:
+            # This doesn't wait for a writer, since this session holds one
+            read_fd = os.open(self.fifo_path, os.O_RDONLY)
+            write_fd = os.open(self.fifo_path, os.O_WRONLY)
+            if hasattr(os, 'set_inheritable'):
+                os.set_inheritable(read_fd, True)
+                os.set_inheritable(write_fd, True)
+            self.make_pipe = (read_fd, write_fd)
+        return self.make_pipe
+
+    def update(self, held, waiting, jobs):
+        """Publish the tokens held and wanted by this session.
+
+        The session file is only rewritten when they change.
+
+        :param held: The number of tokens held by the jobs of this session
+        :param waiting: The number of jobs of this session waiting for a token
+        :param jobs: The labels of the jobs holding tokens
+        """
+        status = dict(
+            pid=os.getpid(),
+            name=self.name,
+            start_time=self.start_time,
+            held=held,
+            waiting=waiting,
+            jobs=list(jobs))
+        if status == self._last_status:
+            return
+        self._last_status = status
+
+        # Replace the file atomically so readers never see a partial one
+        tmp_path = self.session_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as session_file:
+                json.dump(status, session_file)
+            os.rename(tmp_path, self.session_path)
+        except (IOError, OSError):
+            pass
+
+    def fair_share(self):
+        """Get the number of tokens this session may hold while others want some.
+
+        :rtype: int
+        """
+        demands = dict([
+            (s['pid'], s['held'] + s['waiting']) for s in read_sessions(self.directory)
+            if s['held'] + s['waiting'] > 0])
+        demands[os.getpid()] = max(1, demands.get(os.getpid(), 0))
+        return get_fair_shares(self.max_jobs, demands)[os.getpid()]
+
+    def leave(self):
+        """Remove this session, and the fifo if it was the last one.
+
+        The tokens of the sessions which were killed are put back for the
+        sessions which remain.
+        """
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                os.unlink(self.session_path)
+            except OSError:
+                pass
+            dead_sessions = prune_sessions(self.directory)
+            if len(read_sessions(self.directory)) == 0:
+                try:
+                    os.unlink(self.fifo_path)
+                except OSError:
+                    pass
+            elif self.job_pipe is not None:
+                self._return_lost_tokens(dead_sessions)
+
+        for fd in (self.job_pipe or ()) + (self.make_pipe or ()):
+            os.close(fd)
+        self.job_pipe = None
+        self.make_pipe = None
+
+
+def _read_session_files(directory):
+    """Yield tuples of the path and contents of each session file."""
+    sessions_dir = os.path.join(directory or get_host_jobserver_dir(), 'sessions')
+    try:
+        filenames = os.listdir(sessions_dir)
+    except OSError:
+        return
+
+    for filename in filenames:
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(sessions_dir, filename)
+        try:
+            with open(path) as session_file:
+                yield path, json.load(session_file)
+        except (IOError, OSError, ValueError):
+            continue
+
+
+def read_sessions(directory=None):
+    """Read the sessions of the host-wide jobserver whose process is running.
+
+    :param directory: The directory of the shared jobserver
+    :returns: A list of dicts with the keys `pid`, `name`, `start_time`,
+        `held`, `waiting` and `jobs`, ordered by start time
+    :rtype: list
+    """
+    sessions = [session for _, session in _read_session_files(directory) if _pid_alive(session['pid'])]
+    return sorted(sessions, key=lambda s: s['start_time'])
+
+
+def prune_sessions(directory=None):
+    """Remove the files of the sessions whose process has exited.
+
+    :param directory: The directory of the shared jobserver
+    :returns: The removed sessions
+    :rtype: list
+    """
+    dead_sessions = []
+    for path, session in _read_session_files(directory):
+        if not _pid_alive(session['pid']):
+            try:
+                os.unlink(path)
+                dead_sessions.append(session)
+            except OSError:
+                pass
+    return dead_sessions
+
+
+def get_host_jobserver_status(directory=None):
+    """Get the state of the host-wide jobserver.
+
+    :param directory: The directory of the shared jobserver
+    :returns: Dict with the keys `max_jobs` and `available`, which are None if
+        the jobserver isn't running, and `sessions` as returned by
+        :py:func:`read_sessions`
+    :rtype: dict
+    """
+    directory = directory or get_host_jobserver_dir()
+    status = dict(max_jobs=None, available=None, sessions=read_sessions(directory))
+    if len(status['sessions']) == 0:
+        return status
+
+    try:
+        with open(os.path.join(directory, _JOBS_FILE)) as jobs_file:
+            status['max_jobs'] = int(jobs_file.read())
+        fd = os.open(os.path.join(directory, 'fifo'), os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            status['available'] = _count_tokens(fd)
+        finally:
+            os.close(fd)
+    except (IOError, OSError, ValueError):
+        pass
+
+    return status
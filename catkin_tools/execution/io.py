@@ -1,97 +1,181 @@
 
-import os
-import re
-import shutil
+import time
 
-from glob import glob
+from collections import deque
 
 from osrf_pycommon.process_utils import AsyncSubprocessProtocol
 
-from catkin_tools.common import mkdir_p
-
+from .diagnostics import DiagnosticParser
 from .events import ExecutionEvent
+from .logs import CapturedOutput
+from .logs import merge_spans
+from .progress import ProgressMonitor
+from .progress import ProgressParser
+
+
+# Maximum number of bytes of the most recent output of a stage kept in memory
+MAX_CAPTURED_BYTES = 1024 * 1024
 
+# Streams of captured output
+STDOUT = 'stdout'
+STDERR = 'stderr'
 
-MAX_LOGFILE_HISTORY = 10
+
+def wants_event(event_queue, event_id):
+    """Check if anything consumes the events with an id, to avoid creating them needlessly.
+
+    :param event_queue: The event queue, which may be an EventBus which
+        drops the output events nothing has subscribed to
+    :rtype: bool
+    """
+    wants = getattr(event_queue, 'wants', None)
+    return wants is None or wants(event_id)
+
+
+class OutputCapture(object):
+
+    """Captures the stdout and stderr of a stage as it is written to its log.
+
+    Rather than accumulating copies of the output, the capture records the
+    spans of the log segment which each stream has written, and keeps only
+    the most recent `max_bytes` of output in memory. The rest is read back
+    from the segment on demand, through :py:class:`CapturedOutput` references.
+    """
+
+    def __init__(self, max_bytes=MAX_CAPTURED_BYTES):
+        self.max_bytes = max_bytes
+
+        # Map from stream -> list of [offset, length] spans of the segment, and total length
+        self.spans = {STDOUT: [], STDERR: []}
+        self.sizes = {STDOUT: 0, STDERR: 0}
+
+        # The most recent (stream, bytes) chunks, after the first dropped_bytes of output
+        self._chunks = deque()
+        self._memory_bytes = 0
+        self.dropped_bytes = 0
+
+    def append(self, stream, data, offset):
+        """Record output which has been written to the log segment.
+
+        :param stream: STDOUT or STDERR
+        :param data: The bytes of output
+        :param offset: The offset of the segment at which they were written
+        """
+        if len(data) == 0:
+            return
+
+        # Extend the last span of the stream if nothing else was written since
+        spans = self.spans[stream]
+        if len(spans) > 0 and spans[-1][0] + spans[-1][1] == offset:
+            spans[-1][1] += len(data)
+        else:
+            spans.append([offset, len(data)])
+        self.sizes[stream] += len(data)
+
+        self._chunks.append((stream, data))
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, dropped = self._chunks.popleft()
+            self._memory_bytes -= len(dropped)
+            self.dropped_bytes += len(dropped)
+
+    def output(self, filename, stream=None):
+        """Get a reference to the output of a stream.
+
+        :param filename: The log segment containing the output
+        :param stream: STDOUT or STDERR, or None for the interleaved output
+        :rtype: :py:class:`CapturedOutput`
+        """
+        chunks = None
+        if self.dropped_bytes == 0:
+            chunks = [data for s, data in self._chunks if stream is None or s == stream]
+        if stream is None:
+            return CapturedOutput(
+                filename, merge_spans(self.spans[STDOUT], self.spans[STDERR]), sum(self.sizes.values()), chunks)
+        return CapturedOutput(filename, [tuple(span) for span in self.spans[stream]], self.sizes[stream], chunks)
 
 
 class IOBufferContainer(object):
 
     """A simple buffer container for use in logging.
 
-    This class will open a logfile for a given job stage and write to it
-    continuously while receiving stdout and stderr.
+    This class writes the output of a job stage to the log segment of the
+    execution as it receives stdout and stderr, and adds the stage to the
+    segment's index once it is closed.
+
+    The output is captured by an :py:class:`OutputCapture`, which keeps a
+    bounded amount of it in memory, and `stdout`, `stderr` and
+    `interleaved` are :py:class:`CapturedOutput` references to it.
     """
 
-    def __init__(self, label, job_id, stage_label, event_queue, log_path):
+    def __init__(self, label, job_id, stage_label, event_queue, build_log):
         self.label = label
         self.job_id = job_id
         self.stage_label = stage_label
         self.event_queue = event_queue
-        self.log_path = log_path
-
-        self.is_open = False
-        self.stdout_buffer = b""
-        self.stderr_buffer = b""
-        self.interleaved_buffer = b""
-
-        # Construct the logfile path for this job and stage
-        logfile_dir_path = os.path.join(log_path, self.job_id)
-        self.logfile_basename = os.path.join(logfile_dir_path, '.'.join([self.label, self.stage_label]))
-        self.logfile_name = '{}.log'.format(self.logfile_basename)
-
-        # Create the logfile dir if it doesn't exist
-        if not os.path.exists(logfile_dir_path):
-            mkdir_p(logfile_dir_path)
-
-        # Get the existing number of logfiles
-        # TODO: Make this number global across all build stages
-        existing_logfile_indices = sorted([int(lf.split('.')[-2])
-                                           for lf in glob('{}.*.log'.format(self.logfile_basename))])
-        if len(existing_logfile_indices) == 0:
-            self.logfile_index = 0
-        else:
-            self.logfile_index = 1 + existing_logfile_indices[-1]
-
-        # Generate the logfile name
-        self.unique_logfile_name = '{}.{:0>{}}.log'.format(self.logfile_basename, self.logfile_index, 3)
 
-        # Remove colliding file if necessary
-        if os.path.exists(self.logfile_name):
-            os.unlink(self.logfile_name)
+        self.capture = OutputCapture()
+        # Compiler and CMake diagnostics found in the output
+        self.diagnostics = []
+        self.start_time = time.time()
 
-        # Open logfile
-        self.log_file = open(self.logfile_name, 'wb')
+        # All of the stages of an execution are logged to the same segment
+        self.build_log = build_log
+        self.logfile_name = self.build_log.path
         self.is_open = True
 
     def close(self):
-        # Close logfile
-        self.log_file.close()
         self.is_open = False
+        self.build_log.add_stage(self.job_id, self.stage_label, self.start_time, self.capture.spans)
+        self.build_log.add_diagnostics(self.job_id, self.stage_label, self.diagnostics)
 
-        # Copy logfile to unique name
-        shutil.copy(self.logfile_name, self.unique_logfile_name)
+    def write(self, stream, data):
+        """Write output from a stream to the log and capture it.
 
-        # Remove older logfiles
-        for logfile_name in glob('{}.*.log'.format(self.logfile_basename)):
-            if (self.logfile_index - int(logfile_name.split('.')[-2])) >= MAX_LOGFILE_HISTORY:
-                os.unlink(logfile_name)
+        :type data: bytes
+        """
+        self.capture.append(stream, data, self.build_log.write(data))
+
+    def _output(self, stream):
+        if self.capture.dropped_bytes > 0:
+            # Make the output which isn't held in memory readable from the segment
+            self.build_log.flush()
+        return self.capture.output(self.logfile_name, stream)
+
+    @property
+    def stdout(self):
+        return self._output(STDOUT)
+
+    @property
+    def stderr(self):
+        return self._output(STDERR)
 
-        # Save output from stderr (these don't get deleted until cleaning the logfile directory)
-        if len(self.stderr_buffer) > 0:
-            with open(self.unique_logfile_name + '.stderr', 'wb') as logfile:
-                logfile.write(self.stderr_buffer)
+    @property
+    def interleaved(self):
+        return self._output(None)
+
+    @property
+    def stdout_buffer(self):
+        return self.stdout.read()
+
+    @property
+    def stderr_buffer(self):
+        return self.stderr.read()
+
+    @property
+    def interleaved_buffer(self):
+        return self.interleaved.read()
 
     def __del__(self):
         if self.is_open:
             self.close()
 
     @classmethod
-    def factory(cls, label, job_id, stage_label, event_queue, log_path):
+    def factory(cls, label, job_id, stage_label, event_queue, build_log):
         """Factory method for constructing with job metadata."""
 
         def init_proxy(*args, **kwargs):
-            return cls(label, job_id, stage_label, event_queue, log_path, *args, **kwargs)
+            return cls(label, job_id, stage_label, event_queue, build_log, *args, **kwargs)
 
         return init_proxy
 
@@ -104,93 +188,127 @@ class IOBufferLogger(IOBufferContainer):
     This class also generates `stdout` and `stderr` events.
     """
 
-    def __init__(self, label, job_id, stage_label, event_queue, log_path, *args, **kwargs):
-        IOBufferContainer.__init__(self, label, job_id, stage_label, event_queue, log_path)
+    def __init__(self, label, job_id, stage_label, event_queue, build_log, *args, **kwargs):
+        IOBufferContainer.__init__(self, label, job_id, stage_label, event_queue, build_log)
 
     def out(self, data):
         """
         :type data: str
         """
-        encoded_data = data.encode('utf-8')
-        self.stdout_buffer += encoded_data
-        self.interleaved_buffer += encoded_data
+        self.write(STDOUT, data.encode('utf-8'))
 
-        self.event_queue.put(ExecutionEvent(
-            'STDOUT',
-            job_id=self.job_id,
-            stage_label=self.stage_label,
-            data=data))
-
-        self.log_file.write(encoded_data)
+        if wants_event(self.event_queue, 'STDOUT'):
+            self.event_queue.put(ExecutionEvent(
+                'STDOUT',
+                job_id=self.job_id,
+                stage_label=self.stage_label,
+                data=data))
 
     def err(self, data):
         """
         :type data: str
         """
-        encoded_data = data.encode('utf-8')
-        self.stderr_buffer += encoded_data
-        self.interleaved_buffer += encoded_data
-
-        self.event_queue.put(ExecutionEvent(
-            'STDERR',
-            job_id=self.job_id,
-            stage_label=self.stage_label,
-            data=data))
+        self.write(STDERR, data.encode('utf-8'))
 
-        self.log_file.write(encoded_data)
+        if wants_event(self.event_queue, 'STDERR'):
+            self.event_queue.put(ExecutionEvent(
+                'STDERR',
+                job_id=self.job_id,
+                stage_label=self.stage_label,
+                data=data))
 
 
 class IOBufferProtocol(IOBufferContainer, AsyncSubprocessProtocol):
 
     """An asyncio protocol that collects stdout and stderr.
 
-    This class also generates `stdout` and `stderr` events.
+    This class also generates `stdout` and `stderr` events, and
+    `STAGE_PROGRESS` events for the progress the command reports in its
+    stdout, which is found by a parser of the class `progress_parser`.
+    Diagnostics are found in both streams by parsers of the class
+    `diagnostic_parser`.
 
     Since the underlying asyncio API constructs the actual protocols, this
     class provides a factory method to inject the job and stage information
     into the created protocol.
     """
 
-    def __init__(self, label, job_id, stage_label, event_queue, log_path, *args, **kwargs):
-        IOBufferContainer.__init__(self, label, job_id, stage_label, event_queue, log_path)
+    # The class of the parser of the progress reported in stdout
+    progress_parser = ProgressParser
+    # The class of the parsers of the diagnostics in stdout and stderr
+    diagnostic_parser = DiagnosticParser
+
+    def __init__(self, label, job_id, stage_label, event_queue, build_log, *args, **kwargs):
+        IOBufferContainer.__init__(self, label, job_id, stage_label, event_queue, build_log)
         AsyncSubprocessProtocol.__init__(self, *args, **kwargs)
+        self.progress_monitor = ProgressMonitor(self.progress_parser())
+        self.diagnostic_parsers = {STDOUT: self.diagnostic_parser(), STDERR: self.diagnostic_parser()}
+
+    # The subprocess protocol assigns the descriptors of the output of the
+    # process to `stdout` and `stderr`, which are kept apart from the captured output
+    @property
+    def stdout(self):
+        return IOBufferContainer.stdout.fget(self)
+
+    @stdout.setter
+    def stdout(self, value):
+        self.stdout_pipe = value
+
+    @property
+    def stderr(self):
+        return IOBufferContainer.stderr.fget(self)
+
+    @stderr.setter
+    def stderr(self, value):
+        self.stderr_pipe = value
+
+    def close(self):
+        # Parse the last lines, if the command didn't end them
+        for stream in [STDOUT, STDERR]:
+            self.diagnostics.extend(self.diagnostic_parsers[stream].flush())
+        IOBufferContainer.close(self)
 
     def on_stdout_received(self, data):
         """
         :type data: utf-8 encoded bytes
         """
-        self.stdout_buffer += data
-        self.interleaved_buffer += data
-        self.log_file.write(data)
-
-        decoded_data = data.decode('utf-8')
-
-        progress_matches = re.match('\[\s*([0-9]+)%\]', decoded_data)
-        if progress_matches is not None:
-            self.event_queue.put(ExecutionEvent(
-                'STAGE_PROGRESS',
-                job_id=self.job_id,
-                stage_label=self.stage_label,
-                percent=str(progress_matches.groups()[0])))
-
-        self.event_queue.put(ExecutionEvent(
-            'STDOUT',
-            job_id=self.job_id,
-            stage_label=self.stage_label,
-            data=decoded_data))
+        self.on_output_received(STDOUT, data)
 
     def on_stderr_received(self, data):
         """
         :type data: utf-8 encoded bytes
         """
-        self.stderr_buffer += data
-        self.interleaved_buffer += data
-        self.log_file.write(data)
+        self.on_output_received(STDERR, data)
 
-        decoded_data = data.decode('utf-8')
+    def on_output_received(self, stream, data, decoded_data=None):
+        """Log output, and generate the events for it.
+
+        :param stream: STDOUT or STDERR
+        :param data: The utf-8 encoded bytes of output
+        :param decoded_data: The output as a string, if it has already been
+            decoded, otherwise it's only decoded if its event is wanted
+        """
+        self.write(stream, data)
+        self.diagnostics.extend(self.diagnostic_parsers[stream].feed(data))
+
+        if stream == STDOUT:
+            progress = self.progress_monitor.feed(data, time.time())
+            if progress is not None:
+                self.event_queue.put(ExecutionEvent(
+                    'STAGE_PROGRESS',
+                    job_id=self.job_id,
+                    stage_label=self.stage_label,
+                    percent=str(progress['percent']),
+                    done=progress['done'],
+                    total=progress['total'],
+                    eta=progress['eta']))
+
+        event_id = 'STDOUT' if stream == STDOUT else 'STDERR'
+        if len(data) == 0 or not wants_event(self.event_queue, event_id):
+            return
 
         self.event_queue.put(ExecutionEvent(
-            'STDERR',
+            event_id,
             job_id=self.job_id,
             stage_label=self.stage_label,
-            data=decoded_data))
+            data=decoded_data if decoded_data is not None else data.decode('utf-8')))
@@ -2,20 +2,25 @@
 from __future__ import print_function
 
 from multiprocessing import cpu_count
+from tempfile import mkdtemp
 from tempfile import mkstemp
 from termios import FIONREAD
 
 import array
+import atexit
 import errno
 import fcntl
 import os
 import re
+import select
 import subprocess
 import time
 
 from catkin_tools.common import log
 from catkin_tools.common import version_tuple
 
+from catkin_tools.execution.host_jobserver import HostJobServerSession
+
 from catkin_tools.terminal_color import ColorMapper
 
 
@@ -25,13 +30,34 @@ clr = mapper.clr
 
 class Job(object):
 
-    """A Job is a series of operations, each of which is considered a "stage" of the job."""
+    """A Job is a series of operations, each of which is considered a "stage" of the job.
+
+    By default, the jobs which depend on a job are only started once the whole
+    job has completed. If the products which they need are available before
+    the end of the job, the job can instead provide them once a given stage
+    has succeeded, and its remaining stages continue alongside its dependants.
+    If one of them fails, the dependants which are still running are
+    cancelled, unless the build continues without dependencies. The
+    dependants which have already finished keep their results, since what
+    they needed had been provided.
+    """
+
+    def __init__(self, jid, deps, stages, continue_on_failure=True, provides=None):
+        """
+        :param jid: The unique id of this job
+        :param deps: The ids of the jobs which this job depends on
+        :param stages: The list of Stages to execute
+        :param provides: The label of the stage after which this job's
+            dependants can be started, or None to wait for the whole job
+        """
+        if provides is not None and provides not in [s.label for s in stages]:
+            raise ValueError('Job {} provides unknown stage: {}'.format(jid, provides))
 
-    def __init__(self, jid, deps, stages, continue_on_failure=True):
         self.jid = jid
         self.deps = deps
         self.stages = stages
         self.continue_on_failure = continue_on_failure
+        self.provides = provides
 
     def all_deps_completed(self, completed_jobs):
         """Return True if all dependencies have been completed."""
@@ -74,9 +100,17 @@ def memory_usage():
     return None, None
 
 
+# Period in seconds at which the system load and memory usage are sampled
+CONDITION_SAMPLE_PERIOD = 0.5
+
 JOBSERVER_SUPPORT_MAKEFILE = b'''
 all:
-\techo $(MAKEFLAGS) | grep -- '--jobserver-fds'
+\techo $(MAKEFLAGS) | grep -e '--jobserver-fds' -e '--jobserver-auth'
+'''
+
+JOBSERVER_FIFO_SUPPORT_MAKEFILE = b'''
+all:
+\techo $(MAKEFLAGS) | grep -- '--jobserver-auth=fifo:'
 '''
 
 
@@ -93,6 +127,10 @@ class JobServer:
     # jobserver interface
     _gnu_make_supported = None
 
+    # Flag designating whether the `make` program supports the named fifo
+    # form of the GNU Make jobserver interface (GNU Make 4.4 and later)
+    _gnu_make_fifo_supported = None
+
     def __init__(self):
         """
         """
@@ -101,50 +139,194 @@ class JobServer:
 
         self._load_ok = True
         self._mem_ok = True
+        self._last_sample_time = None
+        self._sample_handle = None
         self._internal_jobs = []
+        # Futures waiting for a token, and the event loop which is watching the job pipe for them
+        self._token_waiters = []
+        self._reader_loop = None
+        self._retry_handle = None
+        # Tokens taken out of circulation to lower the effective number of jobs
+        self._withheld_tokens = []
+        self._target_withheld = 0
         self.max_load = 0
         self.max_jobs = 0
         self.job_pipe = os.pipe()
+        # Path of the named fifo replacing the job pipe, if make supports it
+        self.job_fifo = None
+        # Descriptors of the job pipe inherited by versions of make without fifo support
+        self.make_job_pipe = self.job_pipe
+        # Membership in the jobserver shared by the catkin invocations on this host
+        self._host_session = None
+        # Number of tokens read from the job pipe and not released yet
+        self._held_tokens = 0
+        # Number of tokens this process may hold while other sessions want some
+        self._fair_share = None
+
+        self._set_inheritable(self.job_pipe)
+
+    @staticmethod
+    def _test_make(makefile_contents, args):
+        """Return True if running `make` with a makefile and arguments succeeds."""
 
+        fd, makefile = mkstemp()
+        os.write(fd, makefile_contents)
+        os.close(fd)
+
+        try:
+            ret = subprocess.call(['make', '-f', makefile] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            ret = -1
+
+        os.unlink(makefile)
+        return (ret == 0)
+
+    @staticmethod
+    def _test_gnu_make_support():
+        """
+        Test if the system 'make' supports the job server implementation.
+
+        This simply checks if the `--jobserver-fds` option, called
+        `--jobserver-auth` since GNU Make 4.2, is supported by the `make`
+        command. It does not tests if the jobserver is actually working
+        properly.
+        """
+
+        return JobServer._test_make(JOBSERVER_SUPPORT_MAKEFILE, ['-j2'])
+
+    @staticmethod
+    def _test_gnu_make_fifo_support():
+        """
+        Test if the system 'make' supports a jobserver given by a named fifo.
+        """
+
+        return JobServer._test_make(JOBSERVER_FIFO_SUPPORT_MAKEFILE, ['-j2', '--jobserver-style=fifo'])
+
+    def _open_fifo(self, use_path):
+        """
+        Replace the anonymous job pipe with a named fifo.
+
+        Child processes only share the pipe for as long as they keep the
+        file descriptors they inherited, while the fifo can be reopened by
+        path, even by tools which close the descriptors they inherit.
+
+        Make before 4.4 only inherits descriptors, and blocks on reading its
+        tokens, so it is given a blocking read end of its own.
+
+        :param use_path: True to give make the path of the fifo, False to
+            give it inherited descriptors
+        """
+
+        fifo_dir = mkdtemp(prefix='catkin_jobserver_')
+        fifo_path = os.path.join(fifo_dir, 'fifo')
+        try:
+            os.mkfifo(fifo_path, 0o600)
+
+            # The read end stays non-blocking, since make processes can take a token between checking and reading it
+            read_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+            write_fd = os.open(fifo_path, os.O_WRONLY)
+            make_read_fd = None if use_path else os.open(fifo_path, os.O_RDONLY)
+        except OSError:
+            self._remove_fifo(fifo_path)
+            raise
+
+        for fd in self.job_pipe:
+            os.close(fd)
+        self.job_pipe = (read_fd, write_fd)
+        if use_path:
+            self.make_job_pipe = self.job_pipe
+            self.job_fifo = fifo_path
+        else:
+            self.make_job_pipe = (make_read_fd, write_fd)
+            self._set_inheritable(self.make_job_pipe)
+        atexit.register(self._remove_fifo, fifo_path)
+
+    def _open_nonblocking_reader(self):
+        """
+        Read the tokens of the anonymous job pipe without blocking.
+
+        The flags of the read end are shared by the make processes which
+        inherit it, so on Linux the pipe is reopened through /proc for a read
+        end with flags of its own. Otherwise, the read end is only made
+        non-blocking if no make process shares it.
+        """
+
+        try:
+            read_fd = os.open('/proc/self/fd/{}'.format(self.job_pipe[0]), os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            if not self._gnu_make_supported:
+                flags = fcntl.fcntl(self.job_pipe[0], fcntl.F_GETFL)
+                fcntl.fcntl(self.job_pipe[0], fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            return
+
+        self.job_pipe = (read_fd, self.make_job_pipe[1])
+
+    @staticmethod
+    def _set_inheritable(fds):
         # Setting fd inheritance is required in Python > 3.4
         # This is set by default in Python 2.7
         # For more info see: https://docs.python.org/3.4/library/os.html#fd-inheritance
         if hasattr(os, 'set_inheritable'):
-            for fd in self.job_pipe:
+            for fd in fds:
                 os.set_inheritable(fd, True)
                 if not os.get_inheritable(fd):
                     log(clr('@{yf}@!Warning: jobserver file descriptors are not inheritable.@|'))
 
-    @staticmethod
-    def _test_gnu_make_support():
+    def _join_host_jobserver(self, name, max_jobs, use_fifo):
         """
-        Test if the system 'make' supports the job server implementation.
-
-        This simply checks if the `--jobserver-fds` option is supported by the
-        `make` command. It does not tests if the jobserver is actually working
-        properly.
+        Replace the job pipe with the fifo shared by the catkin invocations
+        on this host.
         """
 
-        fd, makefile = mkstemp()
-        os.write(fd, JOBSERVER_SUPPORT_MAKEFILE)
-        os.close(fd)
+        session = HostJobServerSession(name)
+        job_pipe = session.join(max_jobs)
 
-        ret = subprocess.call(['make', '-f', makefile, '-j2'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for fd in self.job_pipe:
+            os.close(fd)
+        self.job_pipe = job_pipe
+        # Older versions of make still share the tokens through blocking descriptors of their own
+        if use_fifo:
+            self.job_fifo = session.fifo_path
+        else:
+            self.job_fifo = None
+            self.make_job_pipe = session.open_make_pipe()
+        self._host_session = session
+        self._fair_share = session.max_jobs
+        atexit.register(session.leave)
 
-        os.unlink(makefile)
-        return (ret == 0)
+    def _update_host_session(self):
+        """Publish the tokens used by this process and get its fair share of the shared jobserver."""
+        waiting = len([f for f in self._token_waiters if not f.done()])
+        self._host_session.update(self._running_jobs(), waiting, self._internal_jobs)
+        self._fair_share = self._host_session.fair_share()
+
+    def _within_fair_share(self):
+        return self._host_session is None or self._running_jobs() < self._fair_share
+
+    @staticmethod
+    def _remove_fifo(fifo_path):
+        for remove, path in [(os.unlink, fifo_path), (os.rmdir, os.path.dirname(fifo_path))]:
+            try:
+                remove(path)
+            except OSError:
+                pass
 
     def _set_max_jobs(self, max_jobs):
         """Set the maximum number of jobs to be used with the jobserver.
 
         This will wait for all active jobs to be completed, then re-initialize the job pipe.
+        The number of jobs of a shared jobserver is set by its first session.
         """
 
+        if self._host_session is not None:
+            self.max_jobs = self._host_session.max_jobs
+            return
+
         # Read all possible tokens from the pipe
         try:
             tokens = os.read(self.job_pipe[0], self.max_jobs)
         except OSError as e:
-            if e.errno != errno.EINTR:
+            if e.errno not in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK):
                 raise
 
         # Update max jobs
@@ -223,45 +405,119 @@ class JobServer:
 
         return self._mem_ok
 
+    def _sample_conditions(self):
+        self._check_load()
+        self._check_mem()
+        self._last_sample_time = time.time()
+        self._withhold_tokens()
+        if self._host_session is not None:
+            self._update_host_session()
+
+    def _withhold_tokens(self):
+        """Take tokens out of circulation, or put them back, to reach the effective number of jobs.
+
+        Tokens which are in use can't be taken back, so they are withheld as
+        they are released.
+        """
+        while len(self._withheld_tokens) > self._target_withheld:
+            self._release(self._withheld_tokens.pop())
+        while len(self._withheld_tokens) < self._target_withheld and self._available_tokens() > 0:
+            token = self._acquire()
+            if token is None:
+                break
+            self._withheld_tokens.append(token)
+
     def _check_conditions(self):
-        return (self._check_load() and self._check_mem()) or self._running_jobs() == 0
+        # The conditions are sampled periodically instead of every time a token is requested
+        if self._sample_handle is None and (
+                self._last_sample_time is None or time.time() - self._last_sample_time >= CONDITION_SAMPLE_PERIOD):
+            self._sample_conditions()
+        return (self._load_ok and self._mem_ok) or self._running_jobs() == 0
+
+    def _sample_periodically(self, loop):
+        self._sample_conditions()
+        self._sample_handle = loop.call_later(CONDITION_SAMPLE_PERIOD, self._sample_periodically, loop)
+
+    def _dispatch_tokens(self, loop):
+        """Give tokens to the waiting futures in order, for as long as tokens can be acquired."""
+        self._retry_handle = None
+        self._token_waiters = [f for f in self._token_waiters if not f.done()]
+        self._withhold_tokens()
+
+        blocked_by_conditions = False
+        while len(self._token_waiters) > 0:
+            if not self._check_conditions() or not self._within_fair_share():
+                blocked_by_conditions = True
+                break
+            # Only read from the pipe when it has tokens, so that reading doesn't block
+            if self._available_tokens() == 0:
+                break
+            token = self._acquire()
+            if token is None:
+                break
+            self._token_waiters.pop(0).set_result(token)
+
+        # Watch the job pipe while there are waiters, unless it is the load,
+        # memory usage or fair share which is keeping them from getting tokens
+        fd = self.job_pipe[0]
+        if self._reader_loop is not None and (len(self._token_waiters) == 0 or blocked_by_conditions):
+            self._reader_loop.remove_reader(fd)
+            self._reader_loop = None
+        if len(self._token_waiters) > 0:
+            if blocked_by_conditions:
+                self._retry_handle = loop.call_later(CONDITION_SAMPLE_PERIOD, self._dispatch_tokens, loop)
+            elif self._reader_loop is None:
+                loop.add_reader(fd, self._dispatch_tokens, loop)
+                self._reader_loop = loop
 
     def _acquire(self):
         """
         Obtain a job server token. Be sure to call _release() to avoid
         deadlocks.
+
+        Returns None if the token was taken by another reader of a
+        non-blocking job pipe first.
         """
         try:
             # read a token from the job pipe
             token = os.read(self.job_pipe[0], 1)
+            self._held_tokens += 1
             return token
         except OSError as e:
-            if e.errno != errno.EINTR:
+            if e.errno not in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK):
                 raise
 
         return None
 
-    def _release(self):
+    def _release(self, token=b'+'):
         """
         Write a token to the job pipe.
         """
-        os.write(self.job_pipe[1], b'+')
+        os.write(self.job_pipe[1], token)
+        self._held_tokens -= 1
 
-    def _running_jobs(self):
+    def _available_tokens(self):
+        """Get the number of tokens in the job pipe, or 0 if it can't be determined."""
 
         try:
             buf = array.array('i', [0])
             if fcntl.ioctl(self.job_pipe[0], FIONREAD, buf) == 0:
-                return self.max_jobs - buf[0]
+                return buf[0]
         except NotImplementedError:
             pass
         except OSError:
             pass
 
-        return cls._singleton.max_jobs
+        return 0
+
+    def _running_jobs(self):
+        # Only the tokens held by this process are known when the job pipe is shared with other sessions
+        if self._host_session is not None:
+            return self._held_tokens - len(self._withheld_tokens)
+        return self.max_jobs - self._available_tokens() - len(self._withheld_tokens)
 
     @classmethod
-    def initialize(cls, max_jobs=None, max_load=None, max_mem=None, gnu_make_enabled=False):
+    def initialize(cls, max_jobs=None, max_load=None, max_mem=None, gnu_make_enabled=False, host_session=None):
         """
         Initialize the global GNU Make jobserver.
 
@@ -271,6 +527,8 @@ class JobServer:
         :param max_mem: do not dispatch additional jobs if system physical
         memory usage exceeds this value (see _set_max_mem for additional
         documentation)
+        :param host_session: share the tokens with the other catkin invocations
+        on this host, with this description of the invocation, or None
         """
 
         # Check if the jobserver is supported
@@ -281,13 +539,6 @@ class JobServer:
             log(clr('@!@{yf}WARNING:@| Make job server not supported. The number of Make '
                     'jobs may exceed the number of CPU cores.@|'))
 
-        # Create the jobserver singleton if necessary
-        if cls._singleton is None:
-            cls._singleton = JobServer()
-
-        # Set gnu make compatibilty enabled
-        cls._singleton._gnu_make_enabled = False
-
         # Set the maximum number of jobs
         if not max_jobs:
             try:
@@ -298,6 +549,35 @@ class JobServer:
         else:
             max_jobs = int(max_jobs)
 
+        # Create the jobserver singleton if necessary
+        if cls._singleton is None:
+            cls._singleton = JobServer()
+
+            # Check whether make can be given the path of a named fifo
+            if cls._gnu_make_supported and cls._gnu_make_fifo_supported is None:
+                cls._gnu_make_fifo_supported = cls._test_gnu_make_fifo_support()
+
+            if host_session is not None:
+                try:
+                    cls._singleton._join_host_jobserver(host_session, max_jobs, cls._gnu_make_fifo_supported)
+                except (IOError, OSError) as exc:
+                    log(clr('@!@{yf}WARNING:@| Failed to join the host-wide job server, '
+                            'using a job server of its own: {}@|').format(exc))
+
+            # Prefer a named fifo, which this process and make can open with flags of their own
+            if cls._gnu_make_supported and cls._singleton._host_session is None:
+                try:
+                    cls._singleton._open_fifo(cls._gnu_make_fifo_supported)
+                except OSError as exc:
+                    log(clr('@!@{yf}WARNING:@| Failed to create the make job server fifo, '
+                            'falling back to a pipe: {}@|').format(exc))
+                    cls._singleton._open_nonblocking_reader()
+            elif cls._singleton._host_session is None:
+                cls._singleton._open_nonblocking_reader()
+
+        # Set gnu make compatibilty enabled
+        cls._singleton._gnu_make_enabled = False
+
         cls._singleton._set_max_jobs(max_jobs)
         cls._singleton.max_load = max_load
         cls._singleton._set_max_mem(max_mem)
@@ -338,8 +618,10 @@ class JobServer:
                 time.sleep(0.01)
                 continue
 
-            # try to get a job token
+            # try to get a job token, or wait until the next one is written back
             token = cls._singleton._acquire()
+            if token is None:
+                select.select([cls._singleton.job_pipe[0]], [], [])
 
         return token
 
@@ -373,7 +655,8 @@ class JobServer:
         """
         while True:
             # make sure we're observing load and memory maximums
-            if cls._singleton._check_conditions() and cls.running_jobs() < cls.max_jobs():
+            if cls._singleton._check_conditions() and cls._singleton._within_fair_share() and \
+                    cls._singleton._available_tokens() > 0:
                 # try to get a job token
                 token = cls._singleton._acquire()
                 yield token
@@ -386,13 +669,52 @@ class JobServer:
         Yield None until a job server token is acquired, then yield it.
         """
         # make sure we're observing load and memory maximums
-        if cls._singleton._check_conditions() and cls.running_jobs() < cls.max_jobs():
+        if cls._singleton._check_conditions() and cls._singleton._within_fair_share() and \
+                cls._singleton._available_tokens() > 0:
             # try to get a job token
             token = cls._singleton._acquire()
             return token
 
         return None
 
+    @classmethod
+    def acquire_async(cls, loop):
+        """
+        Asynchronously acquire a job server token.
+
+        Rather than polling, the read end of the job pipe is watched by the
+        event loop, which also wakes up the waiters when tokens are written
+        back by child make processes. While the load or memory usage is too
+        high, the waiters are retried after the conditions are next sampled.
+
+        :param loop: The event loop which wakes up the waiters
+        :returns: A future which completes with the token once it has been
+            acquired, cancelling it gives up waiting
+        """
+        # Only the executor needs an event loop, the jobs themselves don't
+        import trollius as asyncio
+
+        future = asyncio.Future(loop=loop)
+        cls._singleton._token_waiters.append(future)
+        if cls._singleton._retry_handle is None:
+            cls._singleton._dispatch_tokens(loop)
+        return future
+
+    @classmethod
+    def start_sampling(cls, loop):
+        """
+        Sample the load and memory usage on a timer of the given event loop,
+        instead of whenever a token is requested.
+        """
+        if cls._singleton._sample_handle is None:
+            cls._singleton._sample_periodically(loop)
+
+    @classmethod
+    def stop_sampling(cls):
+        if cls._singleton._sample_handle is not None:
+            cls._singleton._sample_handle.cancel()
+            cls._singleton._sample_handle = None
+
     @classmethod
     def release(cls, label=None):
         """
@@ -412,10 +734,12 @@ class JobServer:
         Get required arguments for spawning child gnu Make processes.
         """
 
-        if cls.gnu_make_enabled():
-            return ["--jobserver-fds=%d,%d" % cls._singleton.job_pipe, "-j"]
-        else:
+        if not cls.gnu_make_enabled():
             return []
+        elif cls._singleton.job_fifo is not None:
+            return ["--jobserver-auth=fifo:%s" % cls._singleton.job_fifo, "-j"]
+        else:
+            return ["--jobserver-fds=%d,%d" % cls._singleton.make_job_pipe, "-j"]
 
     @classmethod
     def max_jobs(cls):
@@ -425,6 +749,26 @@ class JobServer:
 
         return cls._singleton.max_jobs
 
+    @classmethod
+    def effective_jobs(cls):
+        """
+        Get the number of jobs which are currently allowed, which is lower
+        than the maximum while tokens are withheld.
+        """
+
+        return cls._singleton.max_jobs - cls._singleton._target_withheld
+
+    @classmethod
+    def set_effective_jobs(cls, n_jobs):
+        """
+        Change the number of jobs which are allowed, up to the maximum.
+
+        Lowering it takes effect as the tokens in use are released.
+        """
+
+        cls._singleton._target_withheld = max(0, cls._singleton.max_jobs - max(1, n_jobs))
+        cls._singleton._withhold_tokens()
+
     @classmethod
     def running_jobs(cls):
         """
@@ -436,6 +780,15 @@ class JobServer:
 
         return cls._singleton._running_jobs()
 
+    @classmethod
+    def host_session(cls):
+        """
+        Get the membership in the host-wide jobserver, or None if the tokens
+        aren't shared with other catkin invocations.
+        """
+
+        return cls._singleton._host_session
+
     @classmethod
     def internal_jobs(cls):
         return cls._singleton._internal_jobs
@@ -0,0 +1,569 @@
+"""Append-only log segments which hold the output of all of the stages of a build.
+
+Each execution, like a build or a clean, writes the output of all of its
+stages to a single segment file as it is received, and records where the
+output of each stage is in an index file next to it::
+
+    _logs/build.20261016-101500.4242.log
+    _logs/build.20261016-101500.4242.index
+
+Each line of the index is a JSON object describing one stage, with the
+`job_id`, the `stage_label`, its `start_time` and `end_time`, and the
+`stdout` and `stderr` lists of (offset, length) spans of the segment.
+
+Segments can be compressed as they are written, with zlib or, if the
+`zstandard` module is installed, with zstd. The output is then compressed in
+frames of about COMPRESSION_FRAME_SIZE bytes, which are gzip members or zstd
+frames, so the segment can be read with `zcat` or `zstdcat`::
+
+    _logs/build.20261016-101500.4242.log.gz
+    _logs/build.20261016-101500.4242.frames
+    _logs/build.20261016-101500.4242.index
+
+The offsets of the index are offsets of the uncompressed output. Each line of
+the frames file maps a frame to the uncompressed output it holds, with its
+uncompressed offset and length, and its offset and length in the segment, so
+that reading a span only decompresses the frames which contain it.
+
+The compiler and CMake diagnostics found in the output of the stages are
+stored in a diagnostics file next to the index, with one JSON object per
+line, see :py:mod:`catkin_tools.execution.diagnostics`.
+
+Only the most recent MAX_LOG_BUILDS segments of each label are kept. The
+:py:class:`LogView` reads them back, and reconstructs the layout of the
+per-stage logfiles written by previous versions.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Number of builds of each label whose logs are kept
+MAX_LOG_BUILDS = 10
+
+# Size of the blocks in which captured output is read back from the logs
+READ_BLOCK_SIZE = 64 * 1024
+
+# Extensions of the segment, frames, index and diagnostics files
+SEGMENT_EXTENSION = '.log'
+FRAMES_EXTENSION = '.frames'
+INDEX_EXTENSION = '.index'
+DIAGNOSTICS_EXTENSION = '.diagnostics'
+
+# Map from compression method -> extension appended to the segment
+COMPRESSION_EXTENSIONS = {'zlib': '.gz', 'zstd': '.zst'}
+
+# Map from compression method -> (lowest, default, highest) compression level
+COMPRESSION_LEVELS = {'zlib': (1, 6, 9), 'zstd': (1, 3, 19)}
+
+# Number of bytes of output compressed into each frame of a compressed segment
+COMPRESSION_FRAME_SIZE = 256 * 1024
+
+
+def get_compression_methods():
+    """Get the compression methods which can be used for log segments.
+
+    :rtype: list
+    """
+    return ['zlib'] + (['zstd'] if zstandard is not None else [])
+
+
+def get_compression_method(filename):
+    """Get the compression method of a segment from its name, or None if it isn't compressed."""
+    for method, extension in COMPRESSION_EXTENSIONS.items():
+        if filename.endswith(extension):
+            return method
+    return None
+
+
+def _get_compressor(method, level):
+    """Get a function which compresses bytes into one self-contained frame."""
+    if method == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress
+
+    def compress(data):
+        # Each frame is a complete gzip member, and a sequence of them is a valid gzip file
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    return compress
+
+
+def _get_decompressor(method):
+    """Get a function which decompresses one frame."""
+    if method == 'zstd':
+        if zstandard is None:
+            raise IOError("The zstandard module is needed to read zstd compressed logs.")
+        return zstandard.ZstdDecompressor().decompress
+    return lambda frame: zlib.decompress(frame, 16 + zlib.MAX_WBITS)
+
+
+def read_frames(filename):
+    """Read the frames of a compressed segment.
+
+    :param filename: The compressed segment
+    :returns: A list of (offset, length, frame_offset, frame_length) tuples,
+        ordered by offset
+    :rtype: list
+    """
+    frames = []
+    try:
+        with open(get_frames_path(filename)) as frames_file:
+            for line in frames_file:
+                fields = line.split()
+                # The last line of an interrupted build can be incomplete
+                if len(fields) == 4 and line.endswith('\n'):
+                    frames.append(tuple([int(field) for field in fields]))
+    except (IOError, OSError):
+        pass
+    return frames
+
+
+def get_frames_path(filename):
+    """Get the path of the frames file of a compressed segment."""
+    return filename[:-len(SEGMENT_EXTENSION + COMPRESSION_EXTENSIONS[get_compression_method(filename)])] + \
+        FRAMES_EXTENSION
+
+
+class SegmentReader(object):
+
+    """Reads spans of the uncompressed output of a segment.
+
+    Plain segments are read directly, and only the frames of compressed
+    segments which contain the spans are read and decompressed.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: The log segment
+        """
+        self.filename = filename
+        self.method = get_compression_method(filename)
+        self._segment = open(filename, 'rb')
+
+        if self.method is not None:
+            self._decompress = _get_decompressor(self.method)
+            self._frames = read_frames(filename)
+            self._frame_offsets = [frame[0] for frame in self._frames]
+            # The most recently decompressed frame, since consecutive spans are often in the same one
+            self._frame_index = None
+            self._frame_data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._segment.close()
+
+    def _frame(self, index):
+        if index != self._frame_index:
+            _, _, frame_offset, frame_length = self._frames[index]
+            self._segment.seek(frame_offset)
+            self._frame_data = self._decompress(self._segment.read(frame_length))
+            self._frame_index = index
+        return self._frame_data
+
+    def iter_span(self, offset, length):
+        """Yield the output of a span in blocks of bytes.
+
+        :param offset: The offset of the span in the uncompressed output
+        :param length: The length of the span
+        """
+        if self.method is None:
+            self._segment.seek(offset)
+            while length > 0:
+                block = self._segment.read(min(length, READ_BLOCK_SIZE))
+                if len(block) == 0:
+                    break
+                length -= len(block)
+                yield block
+            return
+
+        index = bisect.bisect_right(self._frame_offsets, offset) - 1
+        while length > 0 and 0 <= index < len(self._frames):
+            frame_start = self._frames[index][0]
+            block = self._frame(index)[offset - frame_start:offset - frame_start + length]
+            if len(block) == 0:
+                break
+            offset += len(block)
+            length -= len(block)
+            index += 1
+            yield block
+
+
+class CapturedOutput(object):
+
+    """A reference to the output of one stream of a stage.
+
+    The output is a sequence of spans of the segment to which the stage was
+    logged. It is only read back when it is needed, from memory if all of
+    the output is still held there, and from the segment otherwise.
+    """
+
+    def __init__(self, filename, spans, size, chunks=None):
+        """
+        :param filename: The log segment containing the output
+        :param spans: A list of (offset, length) spans of the segment
+        :param size: The number of bytes of output
+        :param chunks: A list of the bytes of output if they are all in
+            memory, or None
+        """
+        self.filename = filename
+        self.spans = spans
+        self.size = size
+        self.chunks = chunks
+
+    def __len__(self):
+        return self.size
+
+    def iter_blocks(self):
+        """Yield the output in blocks of bytes."""
+        if self.chunks is not None:
+            for chunk in self.chunks:
+                yield chunk
+            return
+
+        with SegmentReader(self.filename) as segment:
+            for offset, length in self.spans:
+                for block in segment.iter_span(offset, length):
+                    yield block
+
+    def read(self):
+        """Read all of the output.
+
+        :rtype: bytes
+        """
+        return b''.join(self.iter_blocks())
+
+    def tail(self, max_bytes):
+        """Read the end of the output, without reading or decompressing the rest of it.
+
+        :param max_bytes: The maximum number of bytes to read
+        :returns: Tuple of the number of bytes which were left out, and the
+            last bytes of the output
+        :rtype: tuple
+        """
+        omitted = max(0, self.size - max_bytes)
+        if omitted == 0:
+            return 0, self.read()
+        if self.chunks is not None:
+            return omitted, b''.join(self.chunks)[omitted:]
+
+        # Find the spans which hold the last max_bytes of the output
+        spans = []
+        remaining = max_bytes
+        for offset, length in reversed(self.spans):
+            if remaining <= 0:
+                break
+            spans.insert(0, (offset + max(0, length - remaining), min(length, remaining)))
+            remaining -= length
+        return omitted, CapturedOutput(self.filename, spans, max_bytes).read()
+
+
+def merge_spans(*span_lists):
+    """Merge lists of spans into one list ordered by offset.
+
+    :returns: A list of (offset, length) tuples
+    :rtype: list
+    """
+    return sorted([tuple(span) for spans in span_lists for span in spans])
+
+
+class BuildLog(object):
+
+    """The log segment and index of one execution.
+
+    The executor creates one for each execution, which the loggers of the
+    stages of all jobs append to, so writes are serialized with a lock, since
+    function stages write from a thread pool.
+
+    If the segment is compressed, output is buffered until a frame's worth
+    has been written, and then compressed and appended to the segment.
+    """
+
+    def __init__(self, log_path, label, compression=None, compression_level=None):
+        """
+        :param log_path: The directory containing the logs
+        :param label: The label of the execution (build, clean, etc)
+        :param compression: The compression method of the segment, one of
+            :py:func:`get_compression_methods`, or None to not compress it
+        :param compression_level: The compression level, higher levels
+            compress more using more CPU, or None for the default level
+        """
+        self.log_path = log_path
+        self.label = label
+        self.name = '{}.{}.{}'.format(label, time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        self.path = os.path.join(log_path, self.name + SEGMENT_EXTENSION + COMPRESSION_EXTENSIONS.get(compression, ''))
+        self.index_path = os.path.join(log_path, self.name + INDEX_EXTENSION)
+        self.diagnostics_path = os.path.join(log_path, self.name + DIAGNOSTICS_EXTENSION)
+        self.compression = compression
+
+        if not os.path.isdir(log_path):
+            os.makedirs(log_path)
+        self._segment = open(self.path, 'ab')
+        self._index = open(self.index_path, 'a')
+        # Most builds don't have any diagnostics, so the file is only created for the first one
+        self._diagnostics = None
+        self._lock = threading.Lock()
+
+        # Offsets are offsets of the uncompressed output, which continue any segment of this execution
+        self._segment.seek(0, os.SEEK_END)
+        self._size = self._segment.tell()
+
+        if compression is not None:
+            self._compress = _get_compressor(
+                compression, compression_level if compression_level is not None else COMPRESSION_LEVELS[compression][1])
+            self._frames = open(get_frames_path(self.path), 'a')
+            frames = read_frames(self.path)
+            self._size = frames[-1][0] + frames[-1][1] if len(frames) > 0 else 0
+            # Uncompressed output which hasn't been written to a frame yet
+            self._pending = []
+            self._pending_size = 0
+
+        remove_old_builds(log_path, label)
+
+    def write(self, data):
+        """Append output to the segment.
+
+        :type data: bytes
+        :returns: The offset at which the output was written
+        :rtype: int
+        """
+        with self._lock:
+            offset = self._size
+            self._size += len(data)
+            if self.compression is None:
+                self._segment.write(data)
+            else:
+                self._pending.append(data)
+                self._pending_size += len(data)
+                if self._pending_size >= COMPRESSION_FRAME_SIZE:
+                    self._write_frame()
+        return offset
+
+    def _write_frame(self):
+        """Compress the pending output into a frame, with the lock held."""
+        if self._pending_size == 0 or self._segment.closed:
+            return
+        frame = self._compress(b''.join(self._pending))
+        frame_offset = self._segment.tell()
+        self._segment.write(frame)
+        self._frames.write('{} {} {} {}\n'.format(
+            self._size - self._pending_size, self._pending_size, frame_offset, len(frame)))
+        self._pending = []
+        self._pending_size = 0
+
+    def flush(self):
+        """Make all of the output written so far readable from the segment.
+
+        This ends the current frame of a compressed segment early, so it is
+        only done when output which isn't held in memory anymore is read.
+        """
+        with self._lock:
+            if not self._segment.closed:
+                if self.compression is not None:
+                    self._write_frame()
+                # The frames must never refer to data which isn't in the segment yet
+                self._segment.flush()
+                if self.compression is not None:
+                    self._frames.flush()
+
+    def add_stage(self, job_id, stage_label, start_time, spans):
+        """Add a finished stage to the index.
+
+        :param spans: Map from stream to the list of spans it wrote
+        """
+        record = dict(
+            job_id=job_id,
+            stage_label=stage_label,
+            start_time=start_time,
+            end_time=time.time(),
+            stdout=[list(span) for span in spans.get('stdout', [])],
+            stderr=[list(span) for span in spans.get('stderr', [])])
+        with self._lock:
+            if not self._index.closed:
+                self._index.write(json.dumps(record) + '\n')
+                self._index.flush()
+
+    def add_diagnostics(self, job_id, stage_label, diagnostics):
+        """Add the diagnostics found in the output of a stage to the diagnostics file.
+
+        :param diagnostics: A list of diagnostic dicts
+        """
+        if len(diagnostics) == 0:
+            return
+        lines = [json.dumps(dict(diagnostic, job_id=job_id, stage_label=stage_label)) + '\n'
+                 for diagnostic in diagnostics]
+        with self._lock:
+            if self._index.closed:
+                return
+            if self._diagnostics is None:
+                self._diagnostics = open(self.diagnostics_path, 'a')
+            self._diagnostics.writelines(lines)
+            self._diagnostics.flush()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._segment.close()
+            self._index.close()
+            if self._diagnostics is not None:
+                self._diagnostics.close()
+            if self.compression is not None:
+                self._frames.close()
+
+
+def list_builds(log_path, label=None):
+    """List the builds whose logs are kept.
+
+    :param log_path: The directory containing the logs
+    :param label: Only list executions with this label
+    :returns: The names of the builds, oldest first
+    :rtype: list
+    """
+    try:
+        filenames = os.listdir(log_path)
+    except OSError:
+        return []
+
+    builds = []
+    for filename in filenames:
+        if not filename.endswith(INDEX_EXTENSION):
+            continue
+        name = filename[:-len(INDEX_EXTENSION)]
+        fields = name.split('.')
+        if len(fields) != 3 or (label is not None and fields[0] != label):
+            continue
+        builds.append((fields[1], int(fields[2]) if fields[2].isdigit() else 0, name))
+    return [name for _, _, name in sorted(builds)]
+
+
+def remove_old_builds(log_path, label, max_builds=MAX_LOG_BUILDS):
+    """Remove the segments of all but the most recent builds of a label."""
+    builds = list_builds(log_path, label)
+    for name in builds[:max(0, len(builds) - max_builds)]:
+        extensions = [SEGMENT_EXTENSION + e for e in [''] + list(COMPRESSION_EXTENSIONS.values())]
+        for extension in extensions + [FRAMES_EXTENSION, INDEX_EXTENSION, DIAGNOSTICS_EXTENSION]:
+            try:
+                os.unlink(os.path.join(log_path, name + extension))
+            except OSError:
+                pass
+
+
+def _read_json_lines(path):
+    """Read a file with one JSON object per line, or nothing if it doesn't exist."""
+    records = []
+    try:
+        with open(path) as json_file:
+            for line in json_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The last record of an interrupted build can be incomplete
+                    pass
+    except (IOError, OSError):
+        pass
+    return records
+
+
+class LogView(object):
+
+    """A read-only view of the logs of the kept builds."""
+
+    def __init__(self, log_path):
+        """
+        :param log_path: The directory containing the logs
+        """
+        self.log_path = log_path
+
+    def builds(self, label=None):
+        """Get the names of the kept builds, oldest first."""
+        return list_builds(self.log_path, label)
+
+    def stages(self, build):
+        """Get the index records of the stages of a build, in the order they finished.
+
+        :rtype: list
+        """
+        return _read_json_lines(os.path.join(self.log_path, build + INDEX_EXTENSION))
+
+    def diagnostics(self, build):
+        """Get the diagnostics found in the output of a build, in the order they were found.
+
+        :returns: A list of diagnostic dicts, with the `job_id` and
+            `stage_label` of the stage which reported each of them
+        :rtype: list
+        """
+        return _read_json_lines(os.path.join(self.log_path, build + DIAGNOSTICS_EXTENSION))
+
+    def segment_path(self, build):
+        """Get the path of the segment of a build, which may be compressed."""
+        for extension in COMPRESSION_EXTENSIONS.values():
+            path = os.path.join(self.log_path, build + SEGMENT_EXTENSION + extension)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.log_path, build + SEGMENT_EXTENSION)
+
+    def output(self, build, record, stream=None):
+        """Get the output of a stage of a build.
+
+        :param build: The name of the build
+        :param record: The index record of the stage
+        :param stream: 'stdout' or 'stderr', or None for the interleaved output
+        :rtype: :py:class:`CapturedOutput`
+        """
+        spans = record[stream] if stream is not None else merge_spans(record['stdout'], record['stderr'])
+        return CapturedOutput(
+            self.segment_path(build),
+            [tuple(span) for span in spans],
+            sum([length for _, length in spans]))
+
+    def legacy_layout(self):
+        """Map the kept logs to the paths of the per-stage logfiles of previous versions.
+
+        Each run of a stage is named `{job_id}/{label}.{stage_label}.{NNN}.log`,
+        numbered from the oldest kept build, and its latest run is also named
+        `{job_id}/{label}.{stage_label}.log`.
+
+        :returns: Map from relative path to :py:class:`CapturedOutput`
+        :rtype: dict
+        """
+        layout = {}
+        counts = {}
+        for build in self.builds():
+            label = build.split('.')[0]
+            for record in self.stages(build):
+                basename = os.path.join(record['job_id'], '{}.{}'.format(label, record['stage_label']))
+                index = counts.get(basename, 0)
+                counts[basename] = index + 1
+                output = self.output(build, record)
+                layout['{}.{:0>3}.log'.format(basename, index)] = output
+                layout[basename + '.log'] = output
+        return layout
+
+    def export(self, dest):
+        """Write the logs in the per-stage layout of previous versions.
+
+        :param dest: The directory in which to write the logfiles
+        :returns: The number of logfiles which were written
+        :rtype: int
+        """
+        layout = self.legacy_layout()
+        for relpath, output in sorted(layout.items()):
+            path = os.path.join(dest, relpath)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as logfile:
+                for block in output.iter_blocks():
+                    logfile.write(block)
+        return len(layout)
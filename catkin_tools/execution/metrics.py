@@ -0,0 +1,305 @@
+"""Live metrics of an execution, served in the Prometheus text format.
+
+The :py:class:`MetricsCollector` is given the events of the executor as an
+event handler of a controller, and only updates counters as they arrive. The
+state of the :py:class:`JobServer` and of the event bus is read when the
+metrics are scraped, so that a build which isn't being watched doesn't do
+any more work. The :py:class:`MetricsServer` serves them over HTTP on a TCP
+port or a unix socket, from a thread of its own::
+
+    $ curl -s localhost:9100/metrics | grep catkin_jobs
+    catkin_jobs{execution="build",state="running"} 4
+"""
+
+import os
+import socket
+import stat
+import threading
+
+from collections import defaultdict
+
+try:
+    # Python3
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import UnixStreamServer
+except ImportError:
+    # Python2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import UnixStreamServer
+
+from .jobs import JobServer
+from .jobs import memory_usage
+
+# Upper bounds in seconds of the buckets of the stage duration histograms
+STAGE_DURATION_BUCKETS = [0.1, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0]
+
+# Host on which metrics are served if only a port is given
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def parse_metrics_address(spec):
+    """Parse the address on which metrics are served.
+
+    :param spec: `[HOST:]PORT` for a TCP port, or `unix:PATH` for a unix socket
+    :returns: A (host, port) tuple, or the path of the unix socket
+    :raises: ValueError if the address is invalid
+    """
+    if spec.startswith('unix:'):
+        if len(spec) == len('unix:'):
+            raise ValueError("'{}' is missing the path of the socket".format(spec))
+        return spec[len('unix:'):]
+    host, _, port = spec.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError("'{}' is not a port number".format(port))
+    if not 0 <= port <= 65535:
+        raise ValueError("'{}' is not a port number".format(port))
+    return (host.strip('[]') or DEFAULT_METRICS_HOST, port)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(['{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                           for k, v in labels]) + '}'
+
+
+class MetricsCollector(object):
+
+    """Counts the jobs, stages and output of an execution, to be used as an event handler of a controller."""
+
+    def __init__(self, label, event_bus=None):
+        """
+        :param label: The label of the execution, like `build`
+        :param event_bus: The :py:class:`EventBus` of the execution, whose
+            counters are also reported, or None
+        """
+        self.label = label
+        self.event_bus = event_bus
+
+        self._lock = threading.Lock()
+        # Number of jobs in each state, from the last JOB_STATUS event
+        self._jobs = dict(pending=0, queued=0, running=0)
+        # Map from outcome -> number of jobs which finished that way
+        self._finished_jobs = defaultdict(int)
+        # Map from stream -> bytes of output of the finished stages
+        self._output_bytes = defaultdict(int)
+        # Map from stage label -> [bucket counts, sum of durations, count]
+        self._stage_durations = {}
+        # Map from stage label -> number of stages which failed
+        self._failed_stages = defaultdict(int)
+        # Map from (job id, stage label) -> monotonic time at which the stage started
+        self._stage_start_times = {}
+
+    def handle(self, event):
+        """Count an ExecutionEvent."""
+        eid = event.event_id
+        data = event.data
+
+        with self._lock:
+            if 'JOB_STATUS' == eid:
+                self._jobs['pending'] = len(data['pending'])
+                self._jobs['queued'] = len(data['queued'])
+                self._jobs['running'] = len(data['active'])
+
+            elif 'STARTED_STAGE' == eid:
+                self._stage_start_times[data['job_id'], data['stage_label']] = event.monotonic_time
+
+            elif 'FINISHED_STAGE' == eid:
+                label = data['stage_label']
+                start_time = self._stage_start_times.pop((data['job_id'], label), None)
+                if start_time is not None:
+                    self._observe_stage(label, event.monotonic_time - start_time)
+                if not data.get('succeeded', True):
+                    self._failed_stages[label] += 1
+                # The output is counted as the stages finish, since it isn't
+                # turned into events while nothing displays it
+                for stream in ['stdout', 'stderr']:
+                    if data.get(stream) is not None:
+                        self._output_bytes[stream] += len(data[stream])
+
+            elif 'FINISHED_JOB' == eid:
+                self._finished_jobs['succeeded' if data['succeeded'] else 'failed'] += 1
+
+            elif 'ABANDONED_JOB' == eid:
+                self._finished_jobs['abandoned'] += 1
+
+            elif 'CANCELLED_JOB' == eid:
+                self._finished_jobs['cancelled'] += 1
+
+    def _observe_stage(self, label, duration):
+        if label not in self._stage_durations:
+            self._stage_durations[label] = [[0] * len(STAGE_DURATION_BUCKETS), 0.0, 0]
+        histogram = self._stage_durations[label]
+        for i, bound in enumerate(STAGE_DURATION_BUCKETS):
+            if duration <= bound:
+                histogram[0][i] += 1
+        histogram[1] += duration
+        histogram[2] += 1
+
+    def render(self):
+        """Get the metrics in the Prometheus text exposition format.
+
+        :rtype: str
+        """
+        lines = []
+
+        def metric(name, metric_type, help, samples):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix, _format_labels(labels), _format_value(value)))
+
+        with self._lock:
+            jobs = sorted(self._jobs.items())
+            finished_jobs = sorted(self._finished_jobs.items())
+            output_bytes = sorted(self._output_bytes.items())
+            failed_stages = sorted(self._failed_stages.items())
+            stage_durations = sorted([(k, (list(v[0]), v[1], v[2])) for k, v in self._stage_durations.items()])
+
+        execution = ('execution', self.label)
+        metric('catkin_jobs', 'gauge', 'Number of jobs which are pending, queued or running.',
+               [('', [execution, ('state', k)], v) for k, v in jobs])
+        metric('catkin_jobs_finished_total', 'counter', 'Number of jobs which finished, by outcome.',
+               [('', [execution, ('outcome', k)], v) for k, v in finished_jobs])
+        metric('catkin_output_bytes_total', 'counter', 'Bytes of output of the finished stages.',
+               [('', [execution, ('stream', k)], v) for k, v in output_bytes])
+        metric('catkin_stages_failed_total', 'counter', 'Number of stages which failed.',
+               [('', [execution, ('stage', k)], v) for k, v in failed_stages])
+
+        samples = []
+        for label, (buckets, total, count) in stage_durations:
+            for bound, n in zip(STAGE_DURATION_BUCKETS + [float('inf')], buckets + [count]):
+                samples.append(('_bucket', [execution, ('stage', label), ('le', _format_value(bound))], n))
+            samples.append(('_sum', [execution, ('stage', label)], total))
+            samples.append(('_count', [execution, ('stage', label)], count))
+        metric('catkin_stage_duration_seconds', 'histogram', 'Duration of the stages of the jobs.', samples)
+
+        if JobServer._singleton is not None:
+            metric('catkin_jobserver_max_jobs', 'gauge', 'Number of tokens of the jobserver.',
+                   [('', [], JobServer.max_jobs())])
+            metric('catkin_jobserver_effective_jobs', 'gauge', 'Number of tokens which are currently allowed.',
+                   [('', [], JobServer.effective_jobs())])
+            running_jobs = JobServer.running_jobs()
+            if running_jobs != '?':
+                metric('catkin_jobserver_tokens_in_use', 'gauge', 'Number of tokens taken from the jobserver.',
+                       [('', [], running_jobs)])
+            metric('catkin_jobserver_load_ok', 'gauge', 'Whether the jobserver sees the load below its limit.',
+                   [('', [], int(JobServer.load_ok()))])
+            metric('catkin_jobserver_memory_ok', 'gauge', 'Whether the jobserver sees the memory below its limit.',
+                   [('', [], int(JobServer.mem_ok()))])
+
+        try:
+            metric('catkin_load_average', 'gauge', 'System load average.',
+                   [('', [('period', p)], v) for p, v in zip(['1m', '5m', '15m'], os.getloadavg())])
+        except OSError:
+            pass
+        used, total = memory_usage()
+        if used is not None:
+            metric('catkin_memory_used_bytes', 'gauge', 'Memory in use on the system.', [('', [], used)])
+            metric('catkin_memory_total_bytes', 'gauge', 'Memory of the system.', [('', [], total)])
+
+        if self.event_bus is not None:
+            stats = self.event_bus.stats()
+            metric('catkin_events_total', 'counter', 'Number of events which passed through the event bus.',
+                   [('', [('outcome', k)], stats[k]) for k in ['put', 'delivered', 'coalesced', 'dropped']])
+            metric('catkin_events_queued', 'gauge', 'Number of events waiting to be delivered.',
+                   [('', [], stats['depth'])])
+            metric('catkin_event_latency_max_seconds', 'gauge', 'Longest time an event waited to be delivered.',
+                   [('', [], stats['max_latency'])])
+
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = self.server.collector.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', _CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets don't have a client address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        # Requests aren't logged, they would garble the console output
+        pass
+
+
+class _TCPMetricsServer(HTTPServer):
+    allow_reuse_address = True
+
+
+class _UnixMetricsServer(UnixStreamServer):
+    pass
+
+
+class MetricsServer(object):
+
+    """Serves the metrics of a :py:class:`MetricsCollector` from a daemon thread."""
+
+    def __init__(self, collector, address):
+        """
+        :param collector: The :py:class:`MetricsCollector` to serve
+        :param address: A (host, port) tuple, or the path of a unix socket,
+            see :py:func:`parse_metrics_address`
+        :raises: socket.error if the address can't be bound
+        """
+        self.address = address
+        if isinstance(address, tuple):
+            self._server = _TCPMetricsServer(address, _MetricsRequestHandler)
+            self.address = self._server.server_address[:2]
+        else:
+            # A socket left behind by a previous build is replaced, but nothing else is
+            if os.path.exists(address) and not os.path.isdir(address):
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    raise socket.error("'{}' exists and is not a socket".format(address))
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(address)
+                except socket.error:
+                    os.remove(address)
+                else:
+                    raise socket.error("Another process is serving metrics on '{}'".format(address))
+                finally:
+                    probe.close()
+            self._server = _UnixMetricsServer(address, _MetricsRequestHandler)
+        self._server.collector = collector
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='catkin-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        if not isinstance(self.address, tuple):
+            try:
+                os.remove(self.address)
+            except OSError:
+                pass
@@ -0,0 +1,120 @@
+"""Adaptive concurrency based on the pressure stall information of Linux."""
+
+import os
+import time
+
+# Directory in which the kernel reports pressure stall information (Linux 4.20 and later)
+PSI_ROOT = '/proc/pressure'
+
+# Resources whose pressure is taken into account
+PSI_RESOURCES = ['cpu', 'memory', 'io']
+
+
+def read_pressure(resource, root=PSI_ROOT):
+    """Read the pressure stall information of a resource.
+
+    :param resource: One of 'cpu', 'memory' or 'io'
+    :param root: The directory containing the pressure files
+    :returns: Map from 'some' and 'full' to maps with the keys 'avg10',
+        'avg60', 'avg300' in percent and 'total' in microseconds, or None if
+        the pressure isn't available
+    :rtype: dict
+    """
+    try:
+        with open(os.path.join(root, resource)) as pressure_file:
+            lines = pressure_file.read().splitlines()
+    except (IOError, OSError):
+        return None
+
+    pressure = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        values = dict([field.split('=', 1) for field in fields[1:]])
+        pressure[fields[0]] = dict([(k, float(v)) for k, v in values.items()])
+    return pressure
+
+
+def pressure_available(root=PSI_ROOT):
+    """Return True if the pressure of all of the resources can be read."""
+    return all([read_pressure(resource, root) is not None for resource in PSI_RESOURCES])
+
+
+class AdaptiveConcurrency(object):
+
+    """Adjusts the number of concurrent jobs to the pressure on the system.
+
+    The pressure of a resource is the share of time in which some tasks were
+    stalled waiting for it, measured from the growth of its total stall time
+    between two samples. This reacts within a single sample period, unlike
+    the load average or the kernel's own averages.
+
+    The number of jobs is lowered multiplicatively while any resource is
+    under high pressure, and raised by one while all of them are under low
+    pressure.
+    """
+
+    def __init__(self, max_jobs, min_jobs=1, high_pressure=40.0, low_pressure=10.0, decrease_factor=0.75,
+                 root=PSI_ROOT):
+        """
+        :param max_jobs: The largest number of jobs
+        :param min_jobs: The smallest number of jobs
+        :param high_pressure: Percentage of stalled time above which the jobs are lowered
+        :param low_pressure: Percentage of stalled time below which the jobs are raised
+        :param decrease_factor: Factor by which the jobs are lowered
+        :param root: The directory containing the pressure files
+        """
+        self.max_jobs = max_jobs
+        self.min_jobs = min(min_jobs, max_jobs)
+        self.high_pressure = high_pressure
+        self.low_pressure = low_pressure
+        self.decrease_factor = decrease_factor
+        self.root = root
+
+        self.jobs = max_jobs
+
+        # Total stall times and time of the previous sample
+        self._last_totals = None
+        self._last_time = None
+
+    def sample(self, now=None):
+        """Measure the pressure on each resource since the previous sample.
+
+        :returns: Map from resource to the percentage of time in which some
+            tasks were stalled on it, or None for the first sample or if the
+            pressure isn't available
+        :rtype: dict
+        """
+        now = time.time() if now is None else now
+
+        totals = {}
+        for resource in PSI_RESOURCES:
+            pressure = read_pressure(resource, self.root)
+            if pressure is None or 'some' not in pressure:
+                return None
+            totals[resource] = pressure['some']['total']
+
+        last_totals, last_time = self._last_totals, self._last_time
+        self._last_totals, self._last_time = totals, now
+        if last_totals is None or now <= last_time:
+            return None
+
+        # Stall times are in microseconds
+        return dict([
+            (resource, min(100.0, 100.0 * (totals[resource] - last_totals[resource]) / (1e6 * (now - last_time))))
+            for resource in PSI_RESOURCES])
+
+    def update(self, pressures):
+        """Adjust the number of jobs to the measured pressures.
+
+        :param pressures: Map from resource to percentage of stalled time
+        :returns: The new number of jobs
+        :rtype: int
+        """
+        highest = max(pressures.values())
+        if highest >= self.high_pressure:
+            self.jobs = max(self.min_jobs, min(self.jobs - 1, int(self.jobs * self.decrease_factor)))
+        elif highest < self.low_pressure:
+            self.jobs = min(self.max_jobs, self.jobs + 1)
+        return self.jobs
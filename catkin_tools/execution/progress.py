@@ -0,0 +1,130 @@
+"""Incremental parsing of the progress reported by build tools in their output.
+
+Build tools report their progress at the start of the lines they print, like
+make's `[ 42%] Building CXX object ...` and ninja's `[17/40] Building CXX
+object ...`. The :py:class:`ProgressParser` finds these reports in the raw
+bytes of the output as it is received, across the boundaries of the chunks
+it is received in, without decoding it. The :py:class:`ProgressMonitor`
+limits how often the progress of a stage is reported, and estimates how long
+the stage will take to finish from the rate at which it has progressed.
+"""
+
+import re
+
+# Patterns matching the progress reports at the start of a line, with the
+# groups of the number of steps done, and the total number of steps if it
+# isn't 100, in the order in which they're tried
+PROGRESS_PATTERNS = [
+    # make: [ 42%]
+    re.compile(br'(?:^|[\r\n])\[\s*([0-9]+)%\]'),
+    # ninja: [17/40]
+    re.compile(br'(?:^|[\r\n])\[([0-9]+)/([0-9]+)\]'),
+]
+
+# Number of bytes at the start of a line in which progress is reported
+MAX_PREFIX_LENGTH = 32
+
+# Minimum time in seconds between progress reports of a stage
+PROGRESS_PERIOD = 0.5
+
+
+class ProgressParser(object):
+
+    """Finds the latest progress report in output as it is received.
+
+    Only the start of an incomplete line is held until the rest of it is
+    received, since progress is only reported there.
+    """
+
+    def __init__(self, patterns=None):
+        """
+        :param patterns: A list of compiled bytes regular expressions, see
+            PROGRESS_PATTERNS, which is used if this is None
+        """
+        self.patterns = patterns if patterns is not None else PROGRESS_PATTERNS
+        self._prefix = b''
+
+    def feed(self, data):
+        """Parse the next chunk of output.
+
+        :param data: The bytes of output
+        :returns: A tuple of the number of steps done and the total number
+            of steps of the last progress report in the complete lines of
+            output, or None if there wasn't any
+        :rtype: tuple
+        """
+        data = self._prefix + data
+        end = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+        self._prefix = data[end:end + MAX_PREFIX_LENGTH]
+        if end == 0:
+            return None
+
+        lines = data[:end]
+        for pattern in self.patterns:
+            # Only the last report of a chunk matters
+            matches = pattern.findall(lines)
+            if len(matches) > 0:
+                match = matches[-1]
+                if isinstance(match, tuple):
+                    done, total = int(match[0]), int(match[1])
+                else:
+                    done, total = int(match), 100
+                if total > 0:
+                    return min(done, total), total
+        return None
+
+
+class ProgressMonitor(object):
+
+    """Reports the progress of a stage at a limited rate, with an estimate of when it will finish."""
+
+    def __init__(self, parser=None, period=PROGRESS_PERIOD):
+        """
+        :param parser: The :py:class:`ProgressParser` of the output of the
+            stage, or None to use one with the default patterns
+        :param period: The minimum time in seconds between reports
+        """
+        self.parser = parser or ProgressParser()
+        self.period = period
+
+        self._last_report_time = None
+        self._last_percent = None
+        # The time and fraction of the first progress report, from which the rate of progress is measured
+        self._first = None
+
+    def feed(self, data, now):
+        """Parse the next chunk of output of the stage.
+
+        :param data: The bytes of output
+        :param now: The current time
+        :returns: A dict with the `percent` of the stage which is done, the
+            number of steps `done` and their `total`, and the estimated
+            `eta` in seconds, or None if it can't be estimated yet, or None
+            if there is no progress to report
+        :rtype: dict
+        """
+        progress = self.parser.feed(data)
+        if progress is None:
+            return None
+
+        done, total = progress
+        fraction = float(done) / total
+        if self._first is None or fraction < self._first[1]:
+            # Restart the estimate if the tool started counting over, like make does for each directory
+            self._first = (now, fraction)
+
+        percent = int(100 * fraction)
+        if percent == self._last_percent:
+            return None
+        if self._last_report_time is not None and now - self._last_report_time < self.period and percent < 100:
+            return None
+        self._last_report_time = now
+        self._last_percent = percent
+
+        # Extrapolate the rate of progress so far
+        eta = None
+        first_time, first_fraction = self._first
+        if now > first_time and fraction > first_fraction:
+            eta = (1.0 - fraction) * (now - first_time) / (fraction - first_fraction)
+
+        return dict(percent=percent, done=done, total=total, eta=eta)
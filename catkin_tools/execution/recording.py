@@ -0,0 +1,266 @@
+"""Recording of the events of an execution, and their replay into a controller.
+
+The :py:class:`EventRecorder` writes every event given to a controller to a
+file, with the time at which it arrived, along with the jobs of the
+execution and the options of the controller. A recording can then be played
+back into a :py:class:`ConsoleStatusController`, at the speed at which it
+was recorded or faster, without running any of the jobs, to measure how much
+it costs to display an execution::
+
+    {"format": "catkin-events", "version": 1, "label": "build", "jobs": [...], ...}
+    {"t": 0.0021, "event": "JOB_STATUS", "data": {"pending": ["rospack"], ...}}
+
+Unlike an event stream, a recording keeps all of the output which was
+displayed, so that it is rendered again the same way.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .controllers import ConsoleStatusController
+from .event_bus import EventBus
+from .event_stream import OMITTED_EVENT_DATA
+from .events import ExecutionEvent
+from .events import monotonic
+from .jobs import Job
+from .jobs import JobServer
+from .logs import CapturedOutput
+from .stages import Stage
+
+RECORDING_FORMAT = 'catkin-events'
+RECORDING_VERSION = 1
+
+# Key of the JSON objects which hold the output of a stage
+_OUTPUT_KEY = '__output__'
+
+
+def _encode(value):
+    """Encode the values of event data which aren't JSON types."""
+    if isinstance(value, CapturedOutput):
+        return {_OUTPUT_KEY: value.read().decode('utf-8', 'replace')}
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+def _decode(obj):
+    """Turn the output of stages back into :py:class:`CapturedOutput`."""
+    if _OUTPUT_KEY in obj:
+        data = obj[_OUTPUT_KEY].encode('utf-8')
+        return CapturedOutput(None, [], len(data), [data] if data else [])
+    return obj
+
+
+def thread_cpu_time():
+    """Get the CPU time used by the calling thread in seconds.
+
+    Where the time of the thread can't be measured, the CPU time of the
+    process is used instead.
+    """
+    if hasattr(time, 'thread_time'):
+        return time.thread_time()
+    if resource is not None and hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    times = os.times()
+    return times[0] + times[1]
+
+
+class EventRecorder(object):
+
+    """Records events with their timing, to be used as an event handler of a controller."""
+
+    def __init__(self, stream, label, job_labels, jobs, controller_options=None):
+        """
+        :param stream: A writable text file
+        :param label: The label of the execution, like `build`
+        :param job_labels: The labels of the jobs of the controller
+        :param jobs: The list of :py:class:`Job` of the execution
+        :param controller_options: The options with which the controller
+            was created, which are used again when the recording is replayed
+        """
+        self.stream = stream
+        self.start_time = monotonic()
+        self.n_events = 0
+
+        header = dict(
+            format=RECORDING_FORMAT,
+            version=RECORDING_VERSION,
+            label=label,
+            job_labels=list(job_labels),
+            jobs=[dict(jid=job.jid, deps=list(job.deps), stages=[s.label for s in job.stages]) for job in jobs],
+            max_jobs=JobServer.max_jobs() if JobServer._singleton is not None else None,
+            options=controller_options or {},
+            time=time.time())
+        self._write(header)
+
+    def _write(self, obj):
+        if self.stream is None:
+            return
+        try:
+            self.stream.write(json.dumps(obj, default=_encode, sort_keys=True) + '\n')
+        except (IOError, OSError, ValueError):
+            # A recording which can't be written doesn't stop the execution
+            self.stream = None
+
+    def handle(self, event):
+        """Record an ExecutionEvent."""
+        self.n_events += 1
+        self._write(dict(
+            t=round(event.monotonic_time - self.start_time, 6),
+            event=event.event_id,
+            data=dict([(k, v) for k, v in event.data.items() if k not in OMITTED_EVENT_DATA])))
+
+    def close(self):
+        if self.stream is None:
+            return
+        try:
+            self.stream.close()
+        except (IOError, OSError):
+            pass
+        self.stream = None
+
+
+def read_recording(stream):
+    """Read a recording written by an :py:class:`EventRecorder`.
+
+    :param stream: A readable text file
+    :returns: Tuple of the header of the recording, and a list of
+        (time, event id, data) tuples of the events, where the time is in
+        seconds since the recording started
+    :raises: ValueError if the file isn't a recording
+    """
+    lines = iter(stream)
+    try:
+        header = json.loads(next(lines))
+    except StopIteration:
+        raise ValueError("The recording is empty")
+    if not isinstance(header, dict) or header.get('format') != RECORDING_FORMAT:
+        raise ValueError("Not a recording of catkin events")
+    if header.get('version') != RECORDING_VERSION:
+        raise ValueError("Unsupported recording version: {}".format(header.get('version')))
+
+    events = []
+    for line in lines:
+        if len(line.strip()) == 0:
+            continue
+        record = json.loads(line, object_hook=_decode)
+        events.append((record['t'], record['event'], record['data']))
+    return header, events
+
+
+class CountingStream(object):
+
+    """A text stream which counts the bytes written to it, and optionally passes them on."""
+
+    def __init__(self, stream=None):
+        """
+        :param stream: The stream to write to, or None to discard what is written
+        """
+        self.stream = stream
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data.encode('utf-8')) if not isinstance(data, bytes) else len(data)
+        if self.stream is not None:
+            self.stream.write(data)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def isatty(self):
+        return self.stream is not None and self.stream.isatty()
+
+
+def _feed_events(event_queue, events, speed, feed_times):
+    """Put the events on the queue at the times they were recorded, divided by the speed."""
+    start_time = monotonic()
+    for t, event_id, data in events:
+        if speed > 0:
+            delay = start_time + t / speed - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        # The events are created again, so that they have the time at which they were replayed
+        event_queue.put(ExecutionEvent(event_id, **data))
+    event_queue.put(None)
+    feed_times.append(monotonic() - start_time)
+
+
+def replay_recording(header, events, speed=1.0, output=None, controller_options=None):
+    """Replay a recording into a console controller, and measure the cost of displaying it.
+
+    The controller is run in the calling thread, while the events are fed to
+    it from another thread through an :py:class:`EventBus`, like they are
+    by the executor.
+
+    :param header: The header of the recording, see :py:func:`read_recording`
+    :param events: The events of the recording
+    :param speed: The factor by which the events are replayed faster than
+        they were recorded, or 0 to feed them as fast as possible
+    :param output: The stream the controller writes to, or None to discard
+        what it writes
+    :param controller_options: Options of the controller which override
+        the ones with which the recording was made
+    :returns: Dict with the `wall_time` of the replay and the `cpu_time` of
+        the controller in seconds, the `events` which were replayed and the
+        `feed_time` it took to put them on the queue, the `stats()` of the
+        event bus in `event_bus`, and the `terminal_bytes` written in total
+        and the `status_bytes` of them written by the status line
+    :rtype: dict
+    """
+    jobs = [Job(j['jid'], j['deps'], [Stage(label) for label in j['stages']]) for j in header['jobs']]
+
+    options = dict(header.get('options', {}))
+    options.update(controller_options or {})
+    # A replay is never worth a desktop notification
+    options['show_notifications'] = False
+
+    # The status line shows the state of the jobserver, whose tokens aren't used by a replay
+    if JobServer._singleton is None:
+        JobServer.initialize(max_jobs=header.get('max_jobs'))
+
+    event_queue = EventBus()
+    terminal = CountingStream(output)
+    stdout = sys.stdout
+    sys.stdout = terminal
+    try:
+        controller = ConsoleStatusController(
+            header['label'],
+            header['job_labels'],
+            jobs,
+            event_queue,
+            **options)
+
+        feed_times = []
+        feeder = threading.Thread(target=_feed_events, args=(event_queue, events, speed, feed_times))
+        feeder.daemon = True
+
+        start_time = monotonic()
+        start_cpu_time = thread_cpu_time()
+        feeder.start()
+        controller.run()
+        cpu_time = thread_cpu_time() - start_cpu_time
+        wall_time = monotonic() - start_time
+        feeder.join()
+    finally:
+        sys.stdout = stdout
+
+    return dict(
+        wall_time=wall_time,
+        cpu_time=cpu_time,
+        events=len(events),
+        feed_time=feed_times[0] if feed_times else None,
+        event_bus=event_queue.stats(),
+        terminal_bytes=terminal.bytes_written,
+        status_bytes=controller.status_renderer.bytes_written)
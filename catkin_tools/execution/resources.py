@@ -0,0 +1,286 @@
+"""Accounting and limiting of the resources used by the subprocesses of job stages."""
+
+import re
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Period in seconds at which the memory usage of running stages is sampled
+DEFAULT_SAMPLE_PERIOD = 1.0
+
+
+def get_child_cpu_time():
+    """Get the CPU time used by all of the reaped children of this process.
+
+    :returns: User and system CPU time in seconds, or None if unavailable
+    :rtype: float
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class ResourceMonitor(object):
+
+    """Tracks the CPU time and peak memory usage of running stage subprocesses.
+
+    CPU time is attributed to a stage from the growth of this process's
+    `RUSAGE_CHILDREN` counters between stage completions. A stage's
+    subprocess includes the time of all of the descendants it has waited for,
+    so this is exact unless several stage subprocesses exit at nearly the
+    same time.
+
+    Peak memory is the largest resident set size of a stage's whole process
+    tree, sampled periodically. This requires `psutil`, and is None otherwise.
+
+    With a :py:class:`~catkin_tools.execution.cgroups.CgroupSandbox`, each
+    stage runs in its own cgroup, and the CPU time, peak memory and I/O
+    accounted by the kernel for its sub-group are used instead.
+    """
+
+    def __init__(self, loop, sample_period=DEFAULT_SAMPLE_PERIOD, sandbox=None):
+        """
+        :param loop: The event loop on which samples are scheduled
+        :param sample_period: Period in seconds between memory samples
+        :param sandbox: A CgroupSandbox in which to run the stages, or None
+        """
+        self.loop = loop
+        self.sample_period = sample_period
+        self.sandbox = sandbox
+
+        # Map from (job_id, stage_label) -> root pid of the stage subprocess
+        self._pids = {}
+        # Map from (job_id, stage_label) -> largest sampled tree rss in bytes
+        self._peak_rss = {}
+        self._sample_handle = None
+        self._last_child_cpu_time = get_child_cpu_time()
+
+        try:
+            import psutil
+            self._psutil = psutil
+        except ImportError:
+            self._psutil = None
+
+    def prepare(self, key, kwargs):
+        """Prepare the command of a stage to be monitored.
+
+        :param key: Tuple of (job_id, stage_label)
+        :param kwargs: The keyword arguments of `async_execute_process`
+        :returns: The keyword arguments with which to execute the command
+        :rtype: dict
+        """
+        if self.sandbox is None:
+            return kwargs
+        return self.sandbox.wrap(key, kwargs)
+
+    def start(self, key, pid):
+        """Start monitoring a stage subprocess.
+
+        :param key: Tuple of (job_id, stage_label)
+        :param pid: The process id of the stage subprocess
+        """
+        self._pids[key] = pid
+        self._peak_rss[key] = None
+
+        # The kernel already measures the peak memory of sandboxed stages
+        if self._sandboxed(key) and self.sandbox.reports_peak_memory:
+            return
+
+        if self._psutil is not None and self._sample_handle is None:
+            self._sample_handle = self.loop.call_later(self.sample_period, self._sample)
+
+    def stop(self, key):
+        """Stop monitoring a stage subprocess which has exited.
+
+        :param key: Tuple of (job_id, stage_label)
+        :returns: Tuple of CPU time in seconds, peak rss in bytes and bytes
+            read and written, any of which may be None
+        :rtype: tuple
+        """
+        self._pids.pop(key, None)
+        peak_rss = self._peak_rss.pop(key, None)
+        io_bytes = None
+
+        cpu_time = None
+        child_cpu_time = get_child_cpu_time()
+        if child_cpu_time is not None:
+            cpu_time = child_cpu_time - self._last_child_cpu_time
+            self._last_child_cpu_time = child_cpu_time
+
+        if self.sandbox is not None:
+            stats = self.sandbox.stop(key)
+            if stats is not None:
+                cpu_time = stats['cpu_time']
+                peak_rss = stats['peak_rss'] if stats['peak_rss'] is not None else peak_rss
+                io_bytes = stats['io_bytes']
+
+        if len(self._pids) == 0 and self._sample_handle is not None:
+            self._sample_handle.cancel()
+            self._sample_handle = None
+
+        return cpu_time, peak_rss, io_bytes
+
+    def _sandboxed(self, key):
+        return self.sandbox is not None and key in self.sandbox
+
+    def _sample(self):
+        """Sample the memory usage of all monitored process trees at once."""
+        self._sample_handle = None
+        psutil = self._psutil
+
+        # Build the process tree with a single pass over the process table
+        children = {}
+        rss = {}
+        for proc in psutil.process_iter():
+            try:
+                ppid = proc.ppid()
+                rss[proc.pid] = proc.memory_info().rss
+            except psutil.Error:
+                continue
+            children.setdefault(ppid, []).append(proc.pid)
+
+        for key, pid in self._pids.items():
+            if self._sandboxed(key) and self.sandbox.reports_peak_memory:
+                continue
+            tree_rss = 0
+            unvisited = [pid]
+            while len(unvisited) > 0:
+                p = unvisited.pop()
+                tree_rss += rss.get(p, 0)
+                unvisited.extend(children.get(p, []))
+            self._peak_rss[key] = max(self._peak_rss[key] or 0, tree_rss)
+
+        if len(self._pids) > 0:
+            self._sample_handle = self.loop.call_later(self.sample_period, self._sample)
+
+
+class ResourceClassLimiter(object):
+
+    """Limits the number of concurrently running stages of each resource class.
+
+    Stages declare the kind of resources they mostly use with their
+    `resource_class`, for example `configure` stages are mostly
+    single-threaded and I/O bound, while `compile` stages are CPU bound.
+    Stages without a resource class, and stages whose class has no limit,
+    are never held back.
+
+    Waiters are futures which are completed whenever a slot is released.
+    """
+
+    def __init__(self, limits=None):
+        """
+        :param limits: Map from resource class -> maximum number of
+            concurrently running stages of that class, or None for no limit
+        """
+        self.limits = dict([(c, n) for c, n in (limits or {}).items() if n is not None])
+
+        # Map from resource class -> number of running stages
+        self.running = {}
+        # Map from resource class -> largest number of concurrently running stages
+        self.peak_running = {}
+        # Futures waiting for a slot to be released
+        self.waiters = []
+
+    def available(self, resource_class):
+        """Return True if a stage of the given resource class can be started now."""
+        limit = self.limits.get(resource_class)
+        return limit is None or self.running.get(resource_class, 0) < limit
+
+    def job_available(self, job):
+        """Return True if the first limited stage of a job could be started now."""
+        for stage in job.stages:
+            if stage.resource_class in self.limits:
+                return self.available(stage.resource_class)
+        return True
+
+    def acquire(self, resource_class):
+        """Occupy a slot of a resource class, which should be available."""
+        if resource_class is None:
+            return
+        running = self.running.get(resource_class, 0) + 1
+        self.running[resource_class] = running
+        self.peak_running[resource_class] = max(running, self.peak_running.get(resource_class, 0))
+
+    def release(self, resource_class):
+        """Free a slot of a resource class and wake up all of the waiters."""
+        if resource_class is None:
+            return
+        self.running[resource_class] -= 1
+
+        waiters = self.waiters
+        self.waiters = []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+    def add_waiter(self, future):
+        """Complete a future the next time a slot is released."""
+        self.waiters = [f for f in self.waiters if not f.done()]
+        self.waiters.append(future)
+
+
+def parse_memory_size(size, total=None):
+    """Parse an amount of memory.
+
+    :param size: Number of bytes, or a string with an optional suffix, either
+        'k', 'm' or 'g' for kilobytes, megabytes and gigabytes, or '%' for a
+        percentage of the total memory
+    :param total: The total memory in bytes, required for percentages
+    :returns: The amount of memory in bytes
+    :rtype: int
+    :raises: ValueError if the size can't be parsed
+    """
+    if type(size) in [int, float]:
+        return int(size)
+
+    m = re.match(r'^\s*([0-9]+(?:\.[0-9]*)?)\s*([kKmMgG%]?)\s*$', str(size))
+    if m is None:
+        raise ValueError('Invalid memory size: {}'.format(size))
+
+    value, suffix = float(m.group(1)), m.group(2).lower()
+    if suffix == '%':
+        if total is None:
+            raise ValueError('The total memory is unknown, so it cannot be used: {}'.format(size))
+        return int(total * value / 100.0)
+    return int(value * {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}[suffix])
+
+
+class MemoryBudget(object):
+
+    """Only admits jobs while their predicted memory usage fits in a budget.
+
+    Each active job reserves its estimated memory usage until it finishes.
+    A job is admitted if its estimate fits in what is left of the budget, or
+    if no other jobs are active, so that jobs whose estimates exceed the
+    whole budget still run on their own.
+    """
+
+    def __init__(self, limit, estimates=None):
+        """
+        :param limit: The memory in bytes which can be used by the jobs
+        :param estimates: Map from job id -> estimated memory usage in bytes,
+            jobs without an estimate aren't limited
+        """
+        self.limit = limit
+        self.estimates = estimates or {}
+
+        # Map from job id -> reserved bytes for active jobs
+        self.reserved = {}
+
+    def headroom(self):
+        """Get the memory in bytes which isn't reserved by any active job."""
+        return self.limit - sum(self.reserved.values())
+
+    def fits(self, job_id):
+        """Return True if a job can be started without exceeding the budget."""
+        return len(self.reserved) == 0 or self.estimates.get(job_id, 0) <= self.headroom()
+
+    def reserve(self, job_id):
+        self.reserved[job_id] = self.estimates.get(job_id, 0)
+
+    def release(self, job_id):
+        self.reserved.pop(job_id, None)
@@ -0,0 +1,146 @@
+"""Critical-path-first prioritization of the jobs in a job graph.
+
+All of the functions in this module operate on a dependency map from job ids
+to the ids of the jobs that they depend on. Dependencies which are not keys in
+the map are ignored.
+"""
+
+
+def get_dependants(deps):
+    """Invert a dependency map.
+
+    :param deps: Map from job id to the ids of the jobs it depends on
+    :type deps: dict
+    :returns: Map from job id to the ids of the jobs which depend on it
+    :rtype: dict
+    """
+    dependants = dict([(jid, []) for jid in deps])
+    for jid, job_deps in deps.items():
+        for dep_id in job_deps:
+            if dep_id in dependants:
+                dependants[dep_id].append(jid)
+    return dependants
+
+
+def get_topological_order(deps):
+    """Get the job ids ordered so that each job comes after its dependencies.
+
+    :param deps: Map from job id to the ids of the jobs it depends on
+    :type deps: dict
+    :returns: List of job ids
+    :rtype: list
+    """
+    dependants = get_dependants(deps)
+    n_deps = dict([(jid, len([d for d in job_deps if d in deps])) for jid, job_deps in deps.items()])
+
+    ordered = [jid for jid in sorted(deps) if n_deps[jid] == 0]
+    for jid in ordered:
+        for dependant_id in dependants[jid]:
+            n_deps[dependant_id] -= 1
+            if n_deps[dependant_id] == 0:
+                ordered.append(dependant_id)
+
+    if len(ordered) != len(deps):
+        raise ValueError('The job graph contains circular dependencies.')
+
+    return ordered
+
+
+def get_job_costs(deps, durations=None):
+    """Estimate the cost of running each job.
+
+    Jobs which have a recorded duration cost that duration. Jobs without one
+    cost the mean of the recorded durations, or a unit cost if there is no
+    history at all, in which case the critical path is measured in jobs.
+
+    :param deps: Map from job id to the ids of the jobs it depends on
+    :type deps: dict
+    :param durations: Map from job id to a previously-recorded duration in seconds
+    :type durations: dict
+    :returns: Map from job id to estimated cost
+    :rtype: dict
+    """
+    known = dict([(jid, d) for jid, d in (durations or {}).items() if jid in deps and d is not None])
+    default_cost = (sum(known.values()) / len(known)) if len(known) > 0 else 1.0
+    return dict([(jid, known.get(jid, default_cost)) for jid in deps])
+
+
+def get_critical_path_lengths(deps, costs):
+    """Compute the remaining critical path length of each job.
+
+    The remaining critical path length of a job is its own cost plus the
+    longest remaining critical path length of any of its dependants.
+
+    :param deps: Map from job id to the ids of the jobs it depends on
+    :type deps: dict
+    :param costs: Map from job id to estimated cost
+    :type costs: dict
+    :returns: Map from job id to remaining critical path length
+    :rtype: dict
+    """
+    dependants = get_dependants(deps)
+    lengths = {}
+    for jid in reversed(get_topological_order(deps)):
+        lengths[jid] = costs[jid] + max([lengths[d] for d in dependants[jid]] or [0.0])
+    return lengths
+
+
+def get_job_priorities(deps, durations=None):
+    """Compute scheduling priorities for each job.
+
+    Jobs with a longer remaining critical path are more urgent. Ties are
+    broken by the number of jobs which depend on each job.
+
+    :param deps: Map from job id to the ids of the jobs it depends on
+    :type deps: dict
+    :param durations: Map from job id to a previously-recorded duration in seconds
+    :type durations: dict
+    :returns: Map from job id to a sort key, where larger keys run first
+    :rtype: dict
+    """
+    lengths = get_critical_path_lengths(deps, get_job_costs(deps, durations))
+    dependants = get_dependants(deps)
+    return dict([(jid, (lengths[jid], len(dependants[jid]))) for jid in deps])
+
+
+def get_critical_path(deps, lengths):
+    """Get the chain of jobs which bounds the duration of the whole graph.
+
+    :param deps: Map from job id to the ids of the jobs it depends on
+    :type deps: dict
+    :param lengths: Map from job id to remaining critical path length
+    :type lengths: dict
+    :returns: List of job ids from the first to the last job on the path
+    :rtype: list
+    """
+    if len(deps) == 0:
+        return []
+
+    dependants = get_dependants(deps)
+    roots = [jid for jid, job_deps in deps.items() if not any([d in deps for d in job_deps])]
+
+    path = [max(sorted(roots), key=lambda jid: lengths[jid])]
+    while len(dependants[path[-1]]) > 0:
+        path.append(max(sorted(dependants[path[-1]]), key=lambda jid: lengths[jid]))
+
+    return path
+
+
+def estimate_wall_time(costs, lengths, parallelism):
+    """Estimate the wall time needed to run all jobs.
+
+    This is the larger of the critical path length and the total cost spread
+    evenly across the available parallelism.
+
+    :param costs: Map from job id to estimated cost
+    :type costs: dict
+    :param lengths: Map from job id to remaining critical path length
+    :type lengths: dict
+    :param parallelism: Maximum number of jobs which can run at once
+    :type parallelism: int
+    :returns: Estimated wall time, in the units of the costs
+    :rtype: float
+    """
+    if len(costs) == 0:
+        return 0.0
+    return max(max(lengths.values()), sum(costs.values()) / float(max(1, parallelism)))
@@ -11,12 +11,17 @@ class Stage(object):
 
     Like Jobs, Stages are stateless, and simply describe what needs to be done
     and how to do it.
+
+    A stage's resource class names the kind of resources it mostly uses, like
+    'configure', 'compile' or 'install'. The executor can limit the number of
+    concurrently running stages of each class.
     """
 
-    def __init__(self, label, logger_factory=IOBufferProtocol.factory, occupy_job=True):
+    def __init__(self, label, logger_factory=IOBufferProtocol.factory, occupy_job=True, resource_class=None):
         self.label = str(label)
         self.logger_factory = logger_factory
         self.occupy_job = occupy_job
+        self.resource_class = resource_class
 
 
 class CommandStage(Stage):
@@ -26,6 +31,7 @@ class CommandStage(Stage):
     :param label: The label for the stage
     :param command: A list of strings composing a system command
     :param protocol: A protocol class to use for this stage
+    :param resource_class: The kind of resources used by the command, or None
 
     Additional kwargs are passed to `async_execute_process`
     """
@@ -40,12 +46,13 @@ class CommandStage(Stage):
             emulate_tty=True,
             stderr_to_stdout=False,
             occupy_job=True,
-            logger_factory=IOBufferProtocol.factory):
+            logger_factory=IOBufferProtocol.factory,
+            resource_class=None):
         """ """
 
         if not type(cmd) in [list, tuple] or not all([type(s) is str for s in cmd]):
             raise ValueError('Command stage must be a list of strings: {}'.format(cmd))
-        super(CommandStage, self).__init__(label, logger_factory, occupy_job)
+        super(CommandStage, self).__init__(label, logger_factory, occupy_job, resource_class)
 
         self.async_execute_process_kwargs = {
             'cmd': cmd,
@@ -0,0 +1,153 @@
+"""A timeline of an execution in the Chrome trace event format.
+
+The :py:class:`TraceRecorder` builds the timeline from the events of the
+executor, and writes it as a JSON file which can be opened with
+``chrome://tracing`` or https://ui.perfetto.dev. Each job is placed on the
+track of the jobserver slot it holds while it runs, with its stages nested
+in it, so idle slots and gaps between jobs are visible. The time a job or a
+stage spent waiting for a jobserver token is shown before it starts, and
+counter tracks show the number of running jobs, the system load and the
+memory in use.
+"""
+
+import json
+import os
+
+from .jobs import memory_usage
+
+# Minimum period in seconds at which the system load and memory usage are sampled
+COUNTER_PERIOD = 1.0
+
+# Process id of all of the tracks of the trace
+_PID = 1
+
+
+def _us(seconds):
+    """Convert seconds to the microseconds of trace timestamps."""
+    return int(round(seconds * 1e6))
+
+
+class TraceRecorder(object):
+
+    """Records the timeline of jobs and stages, to be used as an event handler of a controller."""
+
+    def __init__(self, label):
+        """
+        :param label: The label of the execution, like `build`
+        """
+        self.label = label
+        self.start_time = None
+        self.trace_events = []
+
+        # Map from job id -> (slot, monotonic time at which the job started)
+        self._jobs = {}
+        # Map from (job id, stage label) -> monotonic time at which the stage started
+        self._stages = {}
+        # Slots which are in use, and the number of slots which were ever used
+        self._slots = set()
+        self._n_slots = 0
+
+        self._n_running = None
+        self._last_sample_time = None
+
+    def _ts(self, monotonic_time):
+        if self.start_time is None:
+            self.start_time = monotonic_time
+        return _us(monotonic_time - self.start_time)
+
+    def _complete(self, name, cat, start_time, end_time, slot, args=None):
+        trace_event = dict(
+            name=name, cat=cat, ph='X', pid=_PID, tid=slot,
+            ts=self._ts(start_time), dur=max(0, _us(end_time - start_time)))
+        if args:
+            trace_event['args'] = args
+        self.trace_events.append(trace_event)
+
+    def _counter(self, name, monotonic_time, **values):
+        self.trace_events.append(dict(name=name, ph='C', pid=_PID, ts=self._ts(monotonic_time), args=values))
+
+    def handle(self, event):
+        """Add an ExecutionEvent to the timeline."""
+        eid = event.event_id
+        now = event.monotonic_time
+        self._ts(now)
+
+        if 'STARTED_JOB' == eid:
+            # Jobs take the lowest free slot, like tokens are taken from the jobserver
+            slot = 1
+            while slot in self._slots:
+                slot += 1
+            self._slots.add(slot)
+            self._n_slots = max(self._n_slots, slot)
+            self._jobs[event.data['job_id']] = (slot, now)
+            token_wait = event.data.get('token_wait') or 0.0
+            if token_wait > 0:
+                self._complete('waiting for token', 'token', now - token_wait, now, slot,
+                               dict(job_id=event.data['job_id']))
+
+        elif 'STARTED_STAGE' == eid:
+            key = (event.data['job_id'], event.data['stage_label'])
+            self._stages[key] = now
+            slot = self._jobs.get(key[0], (0, None))[0]
+            token_wait = event.data.get('token_wait') or 0.0
+            if token_wait > 0:
+                self._complete('waiting for token', 'token', now - token_wait, now, slot,
+                               dict(job_id=key[0], stage_label=key[1]))
+
+        elif 'FINISHED_STAGE' == eid:
+            key = (event.data['job_id'], event.data['stage_label'])
+            start_time = self._stages.pop(key, None)
+            if start_time is not None:
+                slot = self._jobs.get(key[0], (0, None))[0]
+                self._complete(key[1], 'stage', start_time, now, slot, dict(
+                    job_id=key[0],
+                    succeeded=event.data.get('succeeded'),
+                    retcode=event.data.get('retcode')))
+
+        elif eid in ['FINISHED_JOB', 'CANCELLED_JOB']:
+            job_id = event.data['job_id']
+            if job_id in self._jobs:
+                slot, start_time = self._jobs.pop(job_id)
+                self._slots.discard(slot)
+                self._complete(job_id, 'job', start_time, now, slot, dict(
+                    succeeded=event.data.get('succeeded', False),
+                    cancelled='CANCELLED_JOB' == eid))
+
+        elif 'JOB_STATUS' == eid:
+            n_running = len(event.data['active'])
+            if n_running != self._n_running:
+                self._n_running = n_running
+                self._counter('Running jobs', now, jobs=n_running)
+            if self._last_sample_time is None or now - self._last_sample_time >= COUNTER_PERIOD:
+                self._last_sample_time = now
+                self._sample(now)
+
+    def _sample(self, now):
+        try:
+            self._counter('Load', now, load=os.getloadavg()[0])
+        except OSError:
+            pass
+        used, _ = memory_usage()
+        if used is not None:
+            self._counter('Memory', now, used_mib=round(used / float(1024 * 1024), 1))
+
+    def to_json(self):
+        """Get the trace, with the names of the tracks.
+
+        :returns: A dict in the JSON object format of the trace event format
+        :rtype: dict
+        """
+        metadata = [dict(name='process_name', ph='M', pid=_PID, args=dict(name='catkin ' + self.label))]
+        for slot in range(1, self._n_slots + 1):
+            metadata.append(dict(
+                name='thread_name', ph='M', pid=_PID, tid=slot, args=dict(name='Slot {}'.format(slot))))
+            metadata.append(dict(name='thread_sort_index', ph='M', pid=_PID, tid=slot, args=dict(sort_index=slot)))
+        return dict(traceEvents=metadata + self.trace_events, displayTimeUnit='ms')
+
+    def write(self, filename):
+        """Write the trace to a file.
+
+        :param filename: The path of the JSON file
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.to_json(), f)
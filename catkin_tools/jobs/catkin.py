@@ -480,7 +480,8 @@ def create_catkin_build_job(context, package, package_path, dependencies, force_
              + context.cmake_args),
             cwd=build_space,
             logger_factory=CMakeIOBufferProtocol.factory_factory(pkg_dir),
-            occupy_job=True
+            occupy_job=True,
+            resource_class='configure'
         ))
     else:
         stages.append(CommandStage(
@@ -488,7 +489,8 @@ def create_catkin_build_job(context, package, package_path, dependencies, force_
             env_prefix + [MAKE_EXEC, 'cmake_check_build_system'],
             cwd=build_space,
             logger_factory=CMakeIOBufferProtocol.factory_factory(pkg_dir),
-            occupy_job=True
+            occupy_job=True,
+            resource_class='configure'
         ))
 
     # Pre-clean command
@@ -499,6 +501,7 @@ def create_catkin_build_job(context, package, package_path, dependencies, force_
             'preclean',
             env_prefix + [MAKE_EXEC, 'clean'] + make_args,
             cwd=build_space,
+            resource_class='compile'
         ))
 
     # Make command
@@ -508,6 +511,7 @@ def create_catkin_build_job(context, package, package_path, dependencies, force_
         'make',
         env_prefix + [MAKE_EXEC] + make_args,
         cwd=build_space,
+        resource_class='compile'
     ))
 
     # Symlink command if using a linked develspace
@@ -530,13 +534,21 @@ def create_catkin_build_job(context, package, package_path, dependencies, force_
     if context.install:
         stages.append(CommandStage(
             'install',
-            command=env_prefix + [MAKE_EXEC, 'install'],
-            cwd=build_space))
+            env_prefix + [MAKE_EXEC, 'install'],
+            cwd=build_space,
+            resource_class='install'))
+
+    # When the devel space is shared, dependent catkin packages find this
+    # package's products in it, so they don't need to wait for it to be installed
+    provides = None
+    if context.install and not context.isolate_install and not context.isolate_devel:
+        provides = 'symlink' if context.link_devel else 'make'
 
     return Job(
         jid=package.name,
         deps=dependencies,
-        stages=stages)
+        stages=stages,
+        provides=provides)
 
 
 def create_catkin_tools_bootstrap_job(context, package, package_path, devel_space):
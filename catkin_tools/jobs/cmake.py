@@ -261,14 +261,16 @@ def create_cmake_build_job(context, package, package_path, dependencies, force_c
                 '-DCMAKE_INSTALL_PREFIX=' + install_target]
              + context.cmake_args),
             cwd=build_space,
-            logger_factory=CMakeIOBufferProtocol.factory_factory(pkg_dir)
+            logger_factory=CMakeIOBufferProtocol.factory_factory(pkg_dir),
+            resource_class='configure'
         ))
     else:
         stages.append(CommandStage(
             'check',
             env_prefix + [MAKE_EXEC, 'cmake_check_build_system'],
             cwd=build_space,
-            logger_factory=CMakeIOBufferProtocol.factory_factory(pkg_dir)
+            logger_factory=CMakeIOBufferProtocol.factory_factory(pkg_dir),
+            resource_class='configure'
         ))
 
     # Pre-clean command
@@ -279,20 +281,23 @@ def create_cmake_build_job(context, package, package_path, dependencies, force_c
             'preclean',
             env_prefix + [MAKE_EXEC, 'clean'] + make_args,
             cwd=build_space,
+            resource_class='compile'
         ))
 
     # Make command
     stages.append(CommandStage(
         'make',
         env_prefix + [MAKE_EXEC] + handle_make_arguments(context.make_args),
-        cwd=build_space
+        cwd=build_space,
+        resource_class='compile'
     ))
 
     # Make install command (always run on plain cmake)
     stages.append(CommandStage(
         'install',
         env_prefix + [MAKE_EXEC, 'install'],
-        cwd=build_space))
+        cwd=build_space,
+        resource_class='install'))
 
     # Copy install manifest
     stages.append(FunctionStage(
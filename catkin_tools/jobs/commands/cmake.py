@@ -17,6 +17,8 @@ from __future__ import print_function
 import os
 
 from catkin_tools.execution.io import IOBufferProtocol
+from catkin_tools.execution.io import STDERR
+from catkin_tools.execution.io import STDOUT
 
 from catkin_tools.terminal_color import fmt
 from catkin_tools.terminal_color import sanitize
@@ -45,8 +47,8 @@ class CMakeIOBufferProtocol(IOBufferProtocol):
     into the created protocol.
     """
 
-    def __init__(self, label, job_id, stage_label, event_queue, log_path, source_path, *args, **kwargs):
-        super(CMakeIOBufferProtocol, self).__init__(label, job_id, stage_label, event_queue, log_path, *args, **kwargs)
+    def __init__(self, label, job_id, stage_label, event_queue, build_log, source_path, *args, **kwargs):
+        super(CMakeIOBufferProtocol, self).__init__(label, job_id, stage_label, event_queue, build_log, *args, **kwargs)
         self.source_path = source_path
 
         # These are buffers for incomplete lines that we want to wait to parse
@@ -56,13 +58,11 @@ class CMakeIOBufferProtocol(IOBufferProtocol):
 
     def on_stdout_received(self, data):
         data_head, self.stdout_tail = split_to_last_line_break(self.stdout_tail + data)
-        colored = self.color_lines(data_head)
-        super(CMakeIOBufferProtocol, self).on_stdout_received(colored)
+        self.on_colored_output_received(STDOUT, data_head)
 
     def on_stderr_received(self, data):
         data_head, self.stderr_tail = split_to_last_line_break(self.stderr_tail + data)
-        colored = self.color_lines(data_head)
-        super(CMakeIOBufferProtocol, self).on_stderr_received(colored)
+        self.on_colored_output_received(STDERR, data_head)
 
     def close(self):
         # Make sure tail buffers are flushed
@@ -72,34 +72,34 @@ class CMakeIOBufferProtocol(IOBufferProtocol):
     def flush_tails(self):
         """Write out any unprocessed tail buffers."""
 
-        colored = self.color_lines(self.stdout_tail)
-        super(CMakeIOBufferProtocol, self).on_stdout_received(colored)
+        self.on_colored_output_received(STDOUT, self.stdout_tail)
         self.stdout_tail = b''
 
-        colored = self.color_lines(self.stderr_tail)
-        super(CMakeIOBufferProtocol, self).on_stderr_received(colored)
+        self.on_colored_output_received(STDERR, self.stderr_tail)
         self.stderr_tail = b''
 
-    def color_lines(self, data):
-        """Apply colorization rules to each line in data"""
-        decoded_data = data.decode('utf-8')
-        # TODO: This will only work if all lines are received at once. Instead
-        # of direclty splitting lines, we should buffer the data lines until
-        # the last character is a line break
-        lines = decoded_data.splitlines(True)  # Keep line breaks
-        colored_lines = [self.colorize_cmake(l) for l in lines]
-        colored_data = ''.join(colored_lines)
-        encoded_data = colored_data.encode('utf-8')
-        return encoded_data
+    def on_colored_output_received(self, stream, data):
+        """Colorize complete lines of output, and pass them on without decoding them again."""
+        colored_data = self.colorize_lines(data)
+        self.on_output_received(stream, colored_data.encode('utf-8'), colored_data)
+
+    def colorize_lines(self, data):
+        """Apply colorization rules to each line in data
+
+        :type data: utf-8 encoded bytes
+        :rtype: str
+        """
+        lines = data.decode('utf-8').splitlines(True)  # Keep line breaks
+        return ''.join([self.colorize_cmake(l) for l in lines])
 
     @classmethod
     def factory_factory(cls, source_path):
         """Factory factory for constructing protocols that know the source path for this CMake package."""
-        def factory(label, job_id, stage_label, event_queue, log_path):
+        def factory(label, job_id, stage_label, event_queue, build_log):
             # factory is called by caktin_tools executor
             def init_proxy(*args, **kwargs):
                 # init_proxy is called by asyncio
-                return cls(label, job_id, stage_label, event_queue, log_path, source_path, *args, **kwargs)
+                return cls(label, job_id, stage_label, event_queue, build_log, source_path, *args, **kwargs)
             return init_proxy
         return factory
 
@@ -15,18 +15,12 @@
 """This modules implements the engine for building packages in parallel"""
 
 import os
+import socket
 import stat
 import sys
 import time
 import yaml
 
-try:
-    # Python3
-    from queue import Queue
-except ImportError:
-    # Python2
-    from Queue import Queue
-
 try:
     from catkin_pkg.packages import find_packages
     from catkin_pkg.topological_order import topological_order_packages
@@ -45,9 +39,28 @@ from catkin_tools.common import get_recursive_run_depends_in_workspace
 from catkin_tools.common import log
 from catkin_tools.common import wide_log
 
+from catkin_tools.execution.cgroups import CgroupSandbox
 from catkin_tools.execution.controllers import ConsoleStatusController
+from catkin_tools.execution.controllers import DEFAULT_STATUS_RATE
+from catkin_tools.execution.event_bus import EventBus
+from catkin_tools.execution.event_stream import EventStreamWriter
+from catkin_tools.execution.event_stream import open_event_stream
+from catkin_tools.execution.metrics import MetricsCollector
+from catkin_tools.execution.metrics import MetricsServer
+from catkin_tools.execution.metrics import parse_metrics_address
+from catkin_tools.execution.recording import EventRecorder
+from catkin_tools.execution.trace import TraceRecorder
 from catkin_tools.execution.executor import execute_jobs
 from catkin_tools.execution.executor import run_until_complete
+from catkin_tools.execution.history import BuildHistory
+from catkin_tools.execution.history import HistoryRecorder
+from catkin_tools.execution.jobs import JobServer
+from catkin_tools.execution.jobs import memory_usage
+from catkin_tools.execution.pressure import AdaptiveConcurrency
+from catkin_tools.execution.pressure import pressure_available
+from catkin_tools.execution.resources import MemoryBudget
+from catkin_tools.execution.resources import parse_memory_size
+from catkin_tools.execution.scheduling import get_job_priorities
 
 from catkin_tools.jobs.catkin import create_catkin_build_job
 from catkin_tools.jobs.cmake import create_cmake_build_job
@@ -61,6 +74,49 @@ from .color import clr
 
 BUILDSPACE_MARKER_FILE = '.catkin_tools.yaml'
 DEVELSPACE_MARKER_FILE = '.catkin_tools.yaml'
+BUILD_HISTORY_FILE = '.catkin_tools_history.db'
+
+
+def open_build_history(context):
+    """Open the history of previous builds in the build space of a context.
+
+    Failing to open the history only disables it, since it is not needed to
+    build the workspace.
+
+    :param context: Workspace context
+    :type context: :py:class:`catkin_tools.verbs.catkin_build.context.Context`
+    :returns: The build history, or None if it could not be opened
+    :rtype: :py:class:`catkin_tools.execution.history.BuildHistory`
+    """
+    try:
+        return BuildHistory(os.path.join(context.build_space_abs, BUILD_HISTORY_FILE))
+    except Exception as exc:
+        wide_log(clr("[build] @!@{yf}Warning:@| Could not open the build history: {}").format(exc))
+        return None
+
+
+def create_memory_budget(job_memory, mem_limit=None):
+    """Create the memory budget which limits the packages built at once.
+
+    The budget is the memory which isn't already used when the build starts,
+    up to the memory limit if one is given.
+
+    :param job_memory: Map from package name to the memory in bytes needed to build it
+    :type job_memory: dict
+    :param mem_limit: The memory which can be used by the system, as given to --mem-limit
+    :type mem_limit: str
+    :returns: The memory budget, or None if nothing is known about memory usage
+    :rtype: :py:class:`catkin_tools.execution.resources.MemoryBudget`
+    """
+    used_mem, total_mem = memory_usage()
+    if total_mem is None or len(job_memory) == 0:
+        return None
+
+    limit = total_mem
+    if mem_limit is not None:
+        limit = min(limit, parse_memory_size(mem_limit, total_mem))
+
+    return MemoryBudget(max(0, limit - used_mem), job_memory)
 
 
 def determine_packages_to_be_built(packages, context, workspace_packages):
@@ -157,6 +213,19 @@ def build_isolated_workspace(
     no_notify=False,
     continue_on_failure=False,
     summarize_build=None,
+    fail_fast=False,
+    max_configure_jobs=None,
+    mem_limit=None,
+    package_memory=None,
+    adaptive_jobs=False,
+    cgroups=False,
+    job_memory_high=None,
+    log_compression=None,
+    log_compression_level=None,
+    events_out=None,
+    trace=None,
+    metrics=None,
+    record=None,
 ):
     """Builds a catkin workspace in isolation
 
@@ -186,7 +255,7 @@ def build_isolated_workspace(
     :type interleave_output: bool
     :param no_status: disables status bar
     :type no_status: bool
-    :param limit_status_rate: rate to which status updates are limited; the default 0, places no limit.
+    :param limit_status_rate: rate in Hz to which status updates are limited; the default 0 uses 10 Hz.
     :type limit_status_rate: float
     :param lock_install: causes executors to synchronize on access of install commands
     :type lock_install: bool
@@ -197,6 +266,36 @@ def build_isolated_workspace(
     :param summarize_build: if True summarizes the build at the end, if None and continue_on_failure is True and the
         the build fails, then the build will be summarized, but if False it never will be summarized.
     :type summarize_build: bool
+    :param fail_fast: stop the packages which are still building as soon as one fails,
+        unless continue_on_failure is True
+    :type fail_fast: bool
+    :param max_configure_jobs: maximum number of packages being configured at the same time, None for no limit
+    :type max_configure_jobs: int
+    :param mem_limit: memory which the system can use before no more packages are started, as given to --mem-limit
+    :type mem_limit: str
+    :param package_memory: memory in bytes needed to build some packages, overriding the history of previous builds
+    :type package_memory: dict
+    :param adaptive_jobs: adapt the number of jobs to the pressure stall information of the system
+    :type adaptive_jobs: bool
+    :param cgroups: run each stage in its own cgroup to account for its resources exactly
+    :type cgroups: bool
+    :param job_memory_high: memory in bytes above which the processes of each stage are throttled, with cgroups
+    :type job_memory_high: int
+    :param log_compression: method with which the logs are compressed as they are written, 'zlib' or 'zstd'
+    :type log_compression: str
+    :param log_compression_level: level of the log compression, higher levels compress more using more CPU
+    :type log_compression_level: int
+    :param events_out: file name, or `fd:N` for a file descriptor, to which the events of the build are streamed as
+        JSON lines
+    :type events_out: str
+    :param trace: file name to which a timeline of the build is written in the Chrome trace event format
+    :type trace: str
+    :param metrics: address on which live metrics of the build are served in the Prometheus format, `[HOST:]PORT` or
+        `unix:PATH`
+    :type metrics: str
+    :param record: file name to which the events of the build are recorded with their timing, to be replayed with
+        `catkin replay`
+    :type record: str
 
     :raises: SystemExit if buildspace is a file or no packages were found in the source space
         or if the provided options are invalid
@@ -336,7 +435,7 @@ def build_isolated_workspace(
                 context.devel_space_abs)
 
         # Spin up status output thread
-        event_queue = Queue()
+        event_queue = EventBus()
         status_thread = ConsoleStatusController(
             'build',
             ['package', 'packages'],
@@ -346,6 +445,7 @@ def build_isolated_workspace(
             show_active_status=not no_status,
             show_buffered_stdout=not quiet,
             show_stage_events=not quiet,
+            active_status_rate=limit_status_rate or DEFAULT_STATUS_RATE,
             pre_start_time=pre_start_time)
         status_thread.start()
 
@@ -355,7 +455,9 @@ def build_isolated_workspace(
             event_queue,
             os.path.join(context.build_space_abs, '_logs'),
             continue_on_failure=False,
-            continue_without_deps=False))
+            continue_without_deps=False,
+            log_compression=log_compression,
+            log_compression_level=log_compression_level))
 
         status_thread.join()
 
@@ -407,8 +509,118 @@ def build_isolated_workspace(
                      " because it has an unknown package build type: \"{}\"".format(
                          pkg.name, build_type))
 
+    # Record how long each stage takes, and how long jobs took previously
+    build_history = open_build_history(context)
+    job_durations = None
+    history_recorder = None
+    job_memory = {}
+    if build_history is not None:
+        job_durations = build_history.get_job_durations(context.profile)
+        job_memory = build_history.get_job_peak_memory(context.profile)
+        history_recorder = HistoryRecorder(
+            'build',
+            context.profile,
+            dict([(pkg.name, os.path.join(context.source_space_abs, pkg_path)) for pkg_path, pkg in all_packages]))
+
+    # Plain cmake packages only find their dependencies in the install space, so
+    # those dependencies can't provide them with anything before they're installed
+    build_types = dict([(pkg.name, get_build_type(pkg)) for _, pkg in all_packages])
+    cmake_job_deps = set()
+    for job in jobs:
+        if build_types[job.jid] == 'cmake':
+            cmake_job_deps.update(job.deps)
+    for job in jobs:
+        if job.jid in cmake_job_deps and build_types[job.jid] == 'catkin':
+            job.provides = None
+
+    # Start the jobs on the longest remaining chain of dependencies first
+    job_priorities = get_job_priorities(dict([(j.jid, j.deps) for j in jobs]), job_durations)
+
+    # Limit the number of concurrent stages of each resource class, so that
+    # packages which are configuring don't keep the others from compiling
+    resource_class_limits = {
+        'configure': max_configure_jobs,
+        'install': 1 if lock_install else None,
+    }
+
+    # Only start packages while their memory usage is predicted to fit
+    job_memory.update(package_memory or {})
+    memory_budget = create_memory_budget(job_memory, mem_limit)
+
+    # Adapt the number of jobs to the pressure on the system
+    adaptive_concurrency = None
+    if adaptive_jobs:
+        if pressure_available():
+            adaptive_concurrency = AdaptiveConcurrency(JobServer.max_jobs())
+        else:
+            wide_log(clr("[build] @!@{yf}Warning:@| Ignoring --adaptive-jobs, the pressure stall information of "
+                         "the system isn't available."))
+
+    # Run each stage in its own cgroup
+    sandbox = None
+    if cgroups:
+        sandbox = CgroupSandbox.create(job_memory_high)
+        if sandbox is None:
+            wide_log(clr("[build] @!@{yf}Warning:@| Ignoring --cgroups, this process isn't in a cgroup v2 group "
+                         "which it can write to. The resources used by each package are measured from its "
+                         "process tree instead."))
+    if job_memory_high is not None and (sandbox is None or 'memory' not in sandbox.controllers):
+        wide_log(clr("[build] @!@{yf}Warning:@| Ignoring --job-memory-high, it requires --cgroups with the "
+                     "memory controller."))
+
+    # Handlers which are given every event of the build
+    event_handlers = []
+    if history_recorder is not None:
+        event_handlers.append(history_recorder.handle)
+
+    # Stream the events to other tools
+    event_stream = None
+    if events_out is not None:
+        try:
+            event_stream = EventStreamWriter(open_event_stream(events_out))
+        except (IOError, OSError, ValueError) as exc:
+            sys.exit(clr("[build] @!@{rf}Error:@| Unable to open --events-out {}: {}").format(events_out, exc))
+        event_handlers.append(event_stream.handle)
+
+    # Record the timeline of the build
+    trace_recorder = None
+    if trace is not None:
+        trace_recorder = TraceRecorder('build')
+        event_handlers.append(trace_recorder.handle)
+
+    # Options of the console output, which are also used to replay a recording of the build
+    controller_options = dict(
+        show_active_status=not no_status,
+        show_buffered_stdout=not quiet,
+        show_stage_events=not quiet,
+        active_status_rate=limit_status_rate or DEFAULT_STATUS_RATE)
+
+    # Record the events of the build, to replay them later
+    event_recorder = None
+    if record is not None:
+        try:
+            event_recorder = EventRecorder(
+                open(record, 'w'), 'build', ['package', 'packages'], jobs, controller_options)
+        except (IOError, OSError) as exc:
+            sys.exit(clr("[build] @!@{rf}Error:@| Unable to open --record {}: {}").format(record, exc))
+        event_handlers.append(event_recorder.handle)
+
     # Queue for communicating status
-    event_queue = Queue()
+    event_queue = EventBus()
+
+    # Serve live metrics of the build
+    metrics_server = None
+    if metrics is not None:
+        metrics_collector = MetricsCollector('build', event_bus=event_queue)
+        try:
+            metrics_server = MetricsServer(metrics_collector, parse_metrics_address(metrics))
+        except (socket.error, ValueError) as exc:
+            sys.exit(clr("[build] @!@{rf}Error:@| Unable to serve --metrics on {}: {}").format(metrics, exc))
+        event_handlers.append(metrics_collector.handle)
+        metrics_server.start()
+
+    # Interrupted builds are recorded as failed, with the stages which ran before the interruption
+    all_succeeded = False
 
     try:
         # Spin up status output thread
@@ -418,10 +630,9 @@ def build_isolated_workspace(
             jobs,
             event_queue,
             show_notifications=not no_notify,
-            show_active_status=not no_status,
-            show_buffered_stdout=not quiet,
-            show_stage_events=not quiet,
-            pre_start_time=pre_start_time)
+            pre_start_time=pre_start_time,
+            event_handlers=event_handlers,
+            **controller_options)
         status_thread.start()
 
         # Block while running N jobs asynchronously
@@ -432,7 +643,15 @@ def build_isolated_workspace(
             os.path.join(context.build_space_abs, '_logs'),
             max_toplevel_jobs=n_jobs,
             continue_on_failure=continue_on_failure,
-            continue_without_deps=False))
+            continue_without_deps=False,
+            priorities=job_priorities,
+            fail_fast=fail_fast,
+            resource_class_limits=resource_class_limits,
+            memory_budget=memory_budget,
+            adaptive_concurrency=adaptive_concurrency,
+            sandbox=sandbox,
+            log_compression=log_compression,
+            log_compression_level=log_compression_level))
 
         status_thread.join()
 
@@ -453,8 +672,31 @@ def build_isolated_workspace(
             return 1
 
     except KeyboardInterrupt:
+        # The executor has already cancelled the active jobs and reported them
         wide_log("[build] Interrupted by user!")
         event_queue.put(None)
+        status_thread.join()
+
+    finally:
+        # Save the stages of this build for future scheduling and reporting
+        if history_recorder is not None:
+            try:
+                history_recorder.save(build_history, all_succeeded)
+            except Exception as exc:
+                log(clr("[build] @!@{yf}Warning:@| Unable to save the build history: {}").format(exc))
+            finally:
+                build_history.close()
+        if event_stream is not None:
+            event_stream.close()
+        if trace_recorder is not None:
+            try:
+                trace_recorder.write(trace)
+            except (IOError, OSError) as exc:
+                log(clr("[build] @!@{yf}Warning:@| Unable to write the trace to '{}': {}").format(trace, exc))
+        if metrics_server is not None:
+            metrics_server.close()
+        if event_recorder is not None:
+            event_recorder.close()
 
 
 def _create_unmerged_devel_setup(context):
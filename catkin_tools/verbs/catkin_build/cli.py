@@ -15,6 +15,7 @@
 from __future__ import print_function
 
 import argparse
+import json
 import os
 import sys
 import time
@@ -33,16 +34,31 @@ from catkin_pkg.package import InvalidPackage
 
 from catkin_tools.argument_parsing import add_context_args
 from catkin_tools.argument_parsing import add_cmake_and_make_and_catkin_make_args
+from catkin_tools.argument_parsing import add_log_compression_args
 from catkin_tools.argument_parsing import configure_make_args
 
+from catkin_tools.common import get_cached_recursive_build_depends_in_workspace
 from catkin_tools.common import getcwd
 from catkin_tools.common import is_tty
 from catkin_tools.common import log
 from catkin_tools.common import find_enclosing_package
+from catkin_tools.common import format_time_delta
 
 from catkin_tools.context import Context
 
+from catkin_tools.execution.history import DURATION_SAMPLES
+from catkin_tools.execution.history import get_trend
 from catkin_tools.execution.jobs import JobServer
+from catkin_tools.execution.jobs import memory_usage
+from catkin_tools.execution.diagnostics import format_diagnostic
+from catkin_tools.execution.logs import COMPRESSION_LEVELS
+from catkin_tools.execution.logs import LogView
+from catkin_tools.execution.logs import get_compression_methods
+from catkin_tools.execution.resources import parse_memory_size
+from catkin_tools.execution.scheduling import get_critical_path
+from catkin_tools.execution.scheduling import get_critical_path_lengths
+from catkin_tools.execution.scheduling import estimate_wall_time
+from catkin_tools.execution.scheduling import get_job_costs
 
 from catkin_tools.jobs.job import get_build_type
 
@@ -56,8 +72,10 @@ from catkin_tools.terminal_color import set_color
 
 from .color import clr
 
+from .build import BUILD_HISTORY_FILE
 from .build import build_isolated_workspace
 from .build import determine_packages_to_be_built
+from .build import open_build_history
 from .build import topological_order_packages
 from .build import verify_start_with_option
 
@@ -105,6 +123,19 @@ the --save-config argument. To see the current config, use the
     add = parser.add_argument
     add('--dry-run', '-n', action='store_true', default=False,
         help='List the packages which will be built with the given arguments without building them.')
+    add('--history', metavar='N', type=int, nargs='?', const=10, default=None,
+        help='Show the N slowest packages and stages in recent builds, and how their durations are trending, '
+             'without building them. Defaults to 10.')
+    add('--show-log', metavar='PKGNAME[:STAGE]', default=None,
+        help='Print the output of a package, or of one of its stages, from the most recent build which built it, '
+             'without building anything.')
+    add('--export-logs', metavar='DIR', default=None,
+        help='Write the logs of the recent builds to DIR, with one logfile per package and stage, without '
+             'building anything.')
+    add('--diagnostics', metavar='FORMAT', nargs='?', const='text', default=None, choices=['text', 'json', 'github'],
+        help='Print the compiler and CMake warnings and errors of the most recent build, of the given packages or '
+             'of all of them, without building anything. FORMAT is text, json for one JSON object per line, or '
+             'github for GitHub Actions annotations. Defaults to text.')
     # What packages to build
     pkg_group = parser.add_argument_group('Packages', 'Control which packages get built.')
     add = pkg_group.add_argument
@@ -128,6 +159,9 @@ the --save-config argument. To see the current config, use the
     add('--continue-on-failure', '-c', action='store_true', default=False,
         help='Try to continue building packages whose dependencies built successfully even if some other requested '
              'packages fail to build.')
+    add('--fail-fast', action='store_true', default=False,
+        help='When a package fails to build, stop the packages which are still building instead of letting them '
+             'finish. This has no effect with --continue-on-failure.')
 
     # Build options
     build_group = parser.add_argument_group('Build', 'Control the build behavior.')
@@ -139,11 +173,53 @@ the --save-config argument. To see the current config, use the
     add('--no-install-lock', action='store_true', default=None,
         help='Prevents serialization of the install steps, which is on by default to prevent file install collisions')
 
+    def positive_int_type(value):
+        value = int(value)
+        if value < 1:
+            raise argparse.ArgumentTypeError("must be greater than zero.")
+        return value
+
+    add('--max-configure-jobs', metavar='N', type=positive_int_type, default=None,
+        help='Maximum number of packages which can be configured by CMake at the same time. Packages waiting to be '
+             'configured let other packages compile in the meantime. (default is no limit)')
+    add('--mem-limit', default=None,
+        help='Stop starting packages while the memory used by the system exceeds this amount, either as a '
+             'percentage like 80%%, or a size like 12g. Packages are also only started if the memory they used in '
+             'previous builds fits under this limit.')
+    add('--host-jobserver', action='store_true', default=False,
+        help='Share the make jobs with the other invocations of catkin on this host which use this option, instead '
+             'of each using --jobs of its own. Use `catkin jobs` to see which builds hold them.')
+    add('--adaptive-jobs', action='store_true', default=False,
+        help='Lower and raise the number of make jobs as the pressure on the CPU, memory and I/O changes, as reported '
+             'by /proc/pressure on Linux 4.20 and later.')
+    add('--cgroups', action='store_true', default=False,
+        help='Run each build step in its own cgroup to measure the CPU time, memory and I/O used by all of its '
+             'processes exactly. This requires a cgroup v2 group which is writable by the user, like a systemd '
+             'scope started with Delegate=yes.')
+    add('--job-memory-high', metavar='SIZE', default=None,
+        help='With --cgroups, throttle the processes of each build step once they use more than this amount of '
+             'memory, like 4g.')
+
+    def package_memory_type(value):
+        name, _, size = value.partition('=')
+        if not name or not size:
+            raise argparse.ArgumentTypeError("must be given as PKGNAME=SIZE.")
+        try:
+            parse_memory_size(size, memory_usage()[1])
+        except ValueError as exc:
+            raise argparse.ArgumentTypeError(str(exc))
+        return value
+
+    add('--package-memory', metavar='PKGNAME=SIZE', type=package_memory_type, action='append', default=None,
+        help='Declare the memory needed to build a package, like pcl_ros=3g. This can be given more than once. '
+             'These override the memory usage measured in previous builds, and are stored with --save-config.')
+
     config_group = parser.add_argument_group('Config', 'Parameters for the underlying build system.')
     add = config_group.add_argument
     add('--save-config', action='store_true', default=False,
         help='Save any configuration options in this section for the next build invocation.')
     add_cmake_and_make_and_catkin_make_args(config_group)
+    add_log_compression_args(config_group)
 
     # Behavior
     behavior_group = parser.add_argument_group('Interface', 'The behavior of the command-line interface.')
@@ -163,9 +239,6 @@ the --save-config argument. To see the current config, use the
     add('--no-color', action='store_true', help=argparse.SUPPRESS)
     add('--force-color', action='store_true', help=argparse.SUPPRESS)
 
-    # Experimental args
-    add('--mem-limit', default=None, help=argparse.SUPPRESS)
-
     def status_rate_type(rate):
         rate = float(rate)
         if rate < 0:
@@ -173,15 +246,34 @@ the --save-config argument. To see the current config, use the
         return rate
 
     add('--limit-status-rate', '--status-rate', type=status_rate_type, default=0.0,
-        help='Limit the update rate of the status bar to this frequency. Zero means unlimited. '
-             'Must be positive, default is 0.')
+        help='Limit the update rate of the status bar to this frequency in Hz. Zero means the default of 10 Hz. '
+             'The status bar is only redrawn where it changed. Must be positive, default is 0.')
     add('--no-notify', action='store_true', default=False,
         help='Suppresses system pop-up notification.')
+    add('--events-out', metavar='FILE|fd:N', default=None,
+        help='Stream the events of the build, like packages and their stages starting and finishing, to FILE or '
+             'to the open file descriptor N, as one JSON object per line. The console output is unchanged.')
+    add('--trace', metavar='FILE', default=None,
+        help='Write a timeline of the build to FILE in the Chrome trace event format, with the packages and stages '
+             'which ran on each jobserver slot, which can be opened with chrome://tracing or ui.perfetto.dev.')
+    add('--metrics', metavar='[HOST:]PORT|unix:PATH', default=None,
+        help='Serve live metrics of the build in the Prometheus text format over HTTP, on PORT of HOST, which is '
+             '127.0.0.1 by default, or on the unix socket PATH.')
+    add('--record', metavar='FILE', default=None,
+        help='Record the events of the build with their timing, and the output which is displayed, to FILE, '
+             'to be played back with `catkin replay`.')
 
     return parser
 
 
-def dry_run(context, packages, no_deps, start_with):
+def load_build_history(context):
+    """Open the build history of a context only if some builds have been recorded."""
+    if not os.path.exists(os.path.join(context.build_space_abs, BUILD_HISTORY_FILE)):
+        return None
+    return open_build_history(context)
+
+
+def dry_run(context, packages, no_deps, start_with, parallelism):
     # Print Summary
     log(context.summary())
     # Get all the packages in the context source space
@@ -201,6 +293,8 @@ def dry_run(context, packages, no_deps, start_with):
     log("Packages to be built:")
     max_name_len = str(max([len(pkg.name) for pth, pkg in packages_to_be_built]))
     prefix = clr('@{pf}' + ('------ ' if start_with else '- ') + '@|')
+    # Map from the names of packages which would get a build job to their deps
+    job_deps = {}
     for pkg_path, pkg in packages_to_be_built:
         build_type = get_build_type(pkg)
         if build_type == 'catkin' and 'metapackage' in [e.tagname for e in pkg.exports]:
@@ -209,8 +303,159 @@ def dry_run(context, packages, no_deps, start_with):
             start_with = None
         log(clr("{prefix}@{cf}{name:<" + max_name_len + "}@| (@{yf}{build_type}@|)")
             .format(prefix=clr('@!@{kf}(skip)@| ') if start_with else prefix, name=pkg.name, build_type=build_type))
+        if not start_with and build_type != 'metapackage' and pkg.name != 'catkin':
+            job_deps[pkg.name] = [p.name for _, p in get_cached_recursive_build_depends_in_workspace(
+                pkg, packages_to_be_built) if p.name != 'catkin']
     log("Total packages: " + str(len(packages_to_be_built)))
 
+    # Estimate the duration of each job from previous builds
+    durations = {}
+    build_history = load_build_history(context)
+    if build_history is not None:
+        durations = build_history.get_job_durations(context.profile)
+        build_history.close()
+
+    # Print the chain of packages which is expected to bound the build time
+    costs = get_job_costs(job_deps, durations)
+    lengths = get_critical_path_lengths(job_deps, costs)
+    critical_path = get_critical_path(job_deps, lengths)
+    if len(critical_path) > 0:
+        log(clr("Predicted critical path ({} packages): {}").format(
+            len(critical_path),
+            clr(' @{pf}->@| ').join([clr('@{cf}{}@|').format(name) for name in critical_path])))
+        if any([jid in durations for jid in job_deps]):
+            log("Estimated wall time: {} ({} of {} packages have recorded build durations)".format(
+                format_time_delta(estimate_wall_time(costs, lengths, parallelism)),
+                len([jid for jid in job_deps if jid in durations]),
+                len(job_deps)))
+        else:
+            log("Estimated wall time: unknown (no recorded build durations)")
+
+
+def format_trend(trend):
+    """Format a relative change in duration."""
+    if trend is None:
+        return clr('@{kf}-@|')
+    elif trend > 0.1:
+        return clr('@{rf}+{:.0%}@|').format(trend)
+    elif trend < -0.1:
+        return clr('@{gf}{:.0%}@|').format(trend)
+    return '{:+.0%}'.format(trend)
+
+
+def show_history(context, packages, n_entries):
+    """Summarize the slowest packages and stages in the recorded builds.
+
+    The duration of each package and stage is the mean of its most recent
+    successful runs. The trend compares this to the runs before them.
+    """
+    build_history = load_build_history(context)
+    if build_history is None:
+        log("[build] No builds have been recorded in the build space `{}`.".format(context.build_space_abs))
+        return
+
+    try:
+        job_runs = build_history.get_job_runs(context.profile)
+        stages = build_history.get_stages(profile=context.profile)
+    finally:
+        build_history.close()
+
+    def included(job_id):
+        return not packages or job_id in packages
+
+    # Collect the durations and resources of each stage
+    stage_runs = {}
+    for stage in stages:
+        if stage['retcode'] == 0 and included(stage['job_id']):
+            stage_runs.setdefault((stage['job_id'], stage['stage_label']), []).append(stage)
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return (sum(values) / len(values)) if len(values) > 0 else None
+
+    # Slowest packages
+    job_summaries = []
+    for job_id, runs in job_runs.items():
+        if included(job_id):
+            wall_times = [wall_time for _, wall_time in runs]
+            job_summaries.append((mean(wall_times[-DURATION_SAMPLES:]), job_id, len(runs), get_trend(wall_times)))
+    job_summaries.sort(reverse=True)
+
+    log(clr("@!Slowest packages@| (profile: {}):").format(context.profile))
+    for duration, job_id, n_runs, trend in job_summaries[:n_entries]:
+        log(clr("  @{cf}{:<32}@| {:>24}  {:>6}  ({} runs)").format(
+            job_id, format_time_delta(duration), format_trend(trend), n_runs))
+
+    # Slowest stages
+    stage_summaries = []
+    for (job_id, stage_label), runs in stage_runs.items():
+        wall_times = [r['wall_time'] for r in runs]
+        peak_rss = max([r['peak_rss'] or 0 for r in runs])
+        stage_summaries.append((
+            mean(wall_times[-DURATION_SAMPLES:]),
+            job_id,
+            stage_label,
+            mean([r['cpu_time'] for r in runs[-DURATION_SAMPLES:]]),
+            peak_rss,
+            mean([r['io_bytes'] for r in runs[-DURATION_SAMPLES:]]),
+            get_trend(wall_times)))
+    stage_summaries.sort(reverse=True)
+
+    log(clr("@!Slowest stages@|:"))
+    for duration, job_id, stage_label, cpu_time, peak_rss, io_bytes, trend in stage_summaries[:n_entries]:
+        log(clr("  @{cf}{:<32}@| {:>24}  {:>6}  cpu: {:>8}  peak rss: {:>8}  io: {:>8}").format(
+            '{}:{}'.format(job_id, stage_label),
+            format_time_delta(duration),
+            format_trend(trend),
+            '{:.1f} s'.format(cpu_time) if cpu_time is not None else '-',
+            '{:.0f} MB'.format(peak_rss / 1e6) if peak_rss else '-',
+            '{:.0f} MB'.format(io_bytes / 1e6) if io_bytes is not None else '-'))
+
+
+def show_log(context, spec):
+    """Print the output of a package's stages from the most recent build which ran them."""
+    job_id, _, stage_label = spec.partition(':')
+    view = LogView(os.path.join(context.build_space_abs, '_logs'))
+
+    for build in reversed(view.builds('build')):
+        records = [r for r in view.stages(build)
+                   if r['job_id'] == job_id and (not stage_label or r['stage_label'] == stage_label)]
+        if len(records) == 0:
+            continue
+        for record in records:
+            log(clr("@!@{cf}{}:{}@| ({})").format(record['job_id'], record['stage_label'], build))
+            for block in view.output(build, record).iter_blocks():
+                sys.stdout.write(block.decode('utf-8', 'replace'))
+        return 0
+
+    log(clr("[build] @!@{yf}Warning:@| No logs of '{}' were found.").format(spec))
+    return 1
+
+
+def show_diagnostics(context, packages, style):
+    """Print the diagnostics found in the output of the most recent build."""
+    view = LogView(os.path.join(context.build_space_abs, '_logs'))
+    builds = view.builds('build')
+    if len(builds) == 0:
+        log(clr("[build] @!@{yf}Warning:@| No logs of previous builds were found."))
+        return 1
+
+    for diagnostic in view.diagnostics(builds[-1]):
+        if packages and diagnostic['job_id'] not in packages:
+            continue
+        if style == 'json':
+            print(json.dumps(diagnostic, sort_keys=True))
+        else:
+            print(format_diagnostic(diagnostic, style))
+    return 0
+
+
+def export_logs(context, dest):
+    """Write the logs of the kept builds in the layout of one logfile per stage."""
+    n_logfiles = LogView(os.path.join(context.build_space_abs, '_logs')).export(dest)
+    log("[build] Wrote {} logfiles to '{}'.".format(n_logfiles, dest))
+    return 0
+
 
 def main(opts):
 
@@ -258,7 +503,11 @@ def main(opts):
     ctx = Context.load(opts.workspace, opts.profile, opts, append=True)
 
     # Initialize the build configuration
-    make_args, makeflags, cli_flags, jobserver = configure_make_args(ctx.make_args, ctx.use_internal_make_jobserver)
+    host_session = None
+    if opts.host_jobserver:
+        host_session = 'build {} ({})'.format(ctx.workspace, ctx.profile)
+    make_args, makeflags, cli_flags, jobserver = configure_make_args(
+        ctx.make_args, ctx.use_internal_make_jobserver, host_session)
 
     # Set the jobserver memory limit
     if jobserver and opts.mem_limit:
@@ -270,8 +519,19 @@ def main(opts):
             log("Could not import psutil, but psutil is required when using --mem-limit.")
             log("Please either install psutil or avoid using --mem-limit.")
             sys.exit("Exception: {0}".format(exc))
+        try:
+            parse_memory_size(opts.mem_limit, memory_usage()[1])
+        except ValueError as exc:
+            sys.exit(clr("[build] @!@{rf}Error:@| Invalid --mem-limit: {}").format(exc))
         JobServer.set_max_mem(opts.mem_limit)
 
+    job_memory_high = None
+    if opts.job_memory_high is not None:
+        try:
+            job_memory_high = parse_memory_size(opts.job_memory_high)
+        except ValueError as exc:
+            sys.exit(clr("[build] @!@{rf}Error:@| Invalid --job-memory-high: {}").format(exc))
+
     ctx.make_args = make_args
 
     # Load the environment of the workspace to extend
@@ -283,10 +543,27 @@ def main(opts):
                     (ctx.extend_path, exc.message)))
             return 1
 
+    # Display the build history and leave the file system untouched
+    if opts.history is not None:
+        show_history(ctx, opts.packages, opts.history)
+        return
+
+    # Display the logs of previous builds and leave the file system untouched
+    if opts.show_log is not None:
+        return show_log(ctx, opts.show_log)
+    if opts.export_logs is not None:
+        return export_logs(ctx, opts.export_logs)
+    if opts.diagnostics is not None:
+        return show_diagnostics(ctx, opts.packages, opts.diagnostics)
+
     # Display list and leave the file system untouched
     if opts.dry_run:
         # TODO: Add unbuilt
-        dry_run(ctx, opts.packages, opts.no_deps, opts.start_with)
+        try:
+            parallelism = min(int(opts.parallel_jobs), JobServer.max_jobs())
+        except TypeError:
+            parallelism = JobServer.max_jobs()
+        dry_run(ctx, opts.packages, opts.no_deps, opts.start_with, parallelism)
         return
 
     # Check if the context is valid before writing any metadata
@@ -302,6 +579,31 @@ def main(opts):
         opts.force_cmake = True
         update_metadata(ctx.workspace, ctx.profile, 'build', {'needs_force': False})
 
+    # Get the declared memory usage of the packages
+    package_memory = {}
+    for declaration in ctx.package_memory:
+        name, _, size = declaration.partition('=')
+        package_memory[name] = size
+    # Later declarations of a package replace the ones stored before them
+    ctx.package_memory = ['{}={}'.format(name, size) for name, size in sorted(package_memory.items())]
+    try:
+        _, total_mem = memory_usage()
+        package_memory_bytes = dict([(k, parse_memory_size(v, total_mem)) for k, v in package_memory.items()])
+    except ValueError as exc:
+        sys.exit(clr("[build] @!@{rf}Error:@| Invalid --package-memory: {}").format(exc))
+
+    # Get the compression of the logs
+    log_compression = ctx.log_compression or 'none'
+    log_compression_level = ctx.log_compression_level
+    if log_compression != 'none':
+        if log_compression not in get_compression_methods():
+            sys.exit(clr("[build] @!@{rf}Error:@| The logs can't be compressed with {}, the zstandard python "
+                         "module isn't installed.").format(log_compression))
+        lowest, _, highest = COMPRESSION_LEVELS[log_compression]
+        if log_compression_level is not None and not lowest <= log_compression_level <= highest:
+            sys.exit(clr("[build] @!@{rf}Error:@| The --log-compression-level of {} must be from {} to {}.").format(
+                log_compression, lowest, highest))
+
     # Save the context as the configuration
     if opts.save_config:
         Context.save(ctx)
@@ -335,5 +637,18 @@ def main(opts):
         lock_install=not opts.no_install_lock,
         no_notify=opts.no_notify,
         continue_on_failure=opts.continue_on_failure,
-        summarize_build=opts.summarize  # Can be True, False, or None
+        summarize_build=opts.summarize,  # Can be True, False, or None
+        fail_fast=opts.fail_fast,
+        max_configure_jobs=opts.max_configure_jobs,
+        mem_limit=opts.mem_limit if jobserver else None,
+        package_memory=package_memory_bytes,
+        adaptive_jobs=opts.adaptive_jobs,
+        cgroups=opts.cgroups,
+        job_memory_high=job_memory_high,
+        log_compression=log_compression if log_compression != 'none' else None,
+        log_compression_level=log_compression_level,
+        events_out=opts.events_out,
+        trace=opts.trace,
+        metrics=opts.metrics,
+        record=opts.record
     )
@@ -18,13 +18,6 @@ import os
 import sys
 import time
 
-try:
-    # Python3
-    from queue import Queue
-except ImportError:
-    # Python2
-    from Queue import Queue
-
 try:
     from catkin_pkg.packages import find_packages
     from catkin_pkg.topological_order import topological_order_packages
@@ -36,6 +29,7 @@ except ImportError as e:
     )
 
 from catkin_tools.execution.controllers import ConsoleStatusController
+from catkin_tools.execution.event_bus import EventBus
 from catkin_tools.execution.executor import execute_jobs
 from catkin_tools.execution.executor import run_until_complete
 from catkin_tools.execution.jobs import JobServer
@@ -170,7 +164,7 @@ def clean_packages(
     JobServer.initialize(max_jobs=1)
 
     # Queue for communicating status
-    event_queue = Queue()
+    event_queue = EventBus()
 
     try:
         # Spin up status output thread
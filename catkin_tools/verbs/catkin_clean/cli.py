@@ -39,7 +39,7 @@ clr = color_mapper.clr
 
 # Exempt build directories
 # See https://github.com/catkin/catkin_tools/issues/82
-exempt_build_files = ['_logs', '.catkin_tools.yaml', 'catkin_tools_prebuild']
+exempt_build_files = ['_logs', '.catkin_tools.yaml', '.catkin_tools_history.db', 'catkin_tools_prebuild']
 
 setup_files = ['.catkin', 'env.sh', 'setup.bash', 'setup.sh', 'setup.zsh', '_setup_util.py']
 
@@ -17,6 +17,7 @@ from __future__ import print_function
 import os
 
 from catkin_tools.argument_parsing import add_cmake_and_make_and_catkin_make_args
+from catkin_tools.argument_parsing import add_log_compression_args
 from catkin_tools.argument_parsing import add_context_args
 
 from catkin_tools.context import Context
@@ -130,6 +131,7 @@ def prepare_arguments(parser):
 
     build_group = parser.add_argument_group('Build Options', 'Options for configuring the way packages are built.')
     add_cmake_and_make_and_catkin_make_args(build_group)
+    add_log_compression_args(build_group)
 
     return parser
 
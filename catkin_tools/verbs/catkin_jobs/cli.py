@@ -0,0 +1,68 @@
+# Copyright 2015 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import json
+import time
+
+from catkin_tools.execution.host_jobserver import get_host_jobserver_dir
+from catkin_tools.execution.host_jobserver import get_host_jobserver_status
+from catkin_tools.terminal_color import ColorMapper
+
+color_mapper = ColorMapper()
+clr = color_mapper.clr
+
+
+def prepare_arguments(parser):
+    add = parser.add_argument
+    add('--json', action='store_true', default=False,
+        help="Print the state of the job server as JSON.")
+
+    return parser
+
+
+def main(opts):
+    status = get_host_jobserver_status()
+
+    if opts.json:
+        print(json.dumps(status, indent=2, sort_keys=True))
+        return 0
+
+    if len(status['sessions']) == 0:
+        print("No builds are using the host-wide job server in '{}'.".format(get_host_jobserver_dir()))
+        return 0
+
+    held = sum([s['held'] for s in status['sessions']])
+    print(clr("@!Host-wide job server:@| {}").format(get_host_jobserver_dir()))
+    if status['max_jobs'] is not None and status['available'] is not None:
+        # The tokens which aren't held by the builds themselves are held by their make processes
+        print(clr("@!Jobs:@| {} total, {} available, {} held by packages, {} held by make").format(
+            status['max_jobs'],
+            status['available'],
+            held,
+            max(0, status['max_jobs'] - status['available'] - held)))
+
+    now = time.time()
+    for session in status['sessions']:
+        print(clr("  @{cf}{}@| [pid {}, running for {:.0f} s] @!{}@| held, @!{}@| waiting").format(
+            session['name'],
+            session['pid'],
+            now - session['start_time'],
+            session['held'],
+            session['waiting']))
+        if len(session['jobs']) > 0:
+            print("    {}".format(', '.join(session['jobs'])))
+
+    return 0
@@ -0,0 +1,103 @@
+# Copyright 2015 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import json
+import sys
+
+from catkin_tools.execution.controllers import DEFAULT_STATUS_RATE
+from catkin_tools.execution.recording import read_recording
+from catkin_tools.execution.recording import replay_recording
+from catkin_tools.terminal_color import ColorMapper
+
+color_mapper = ColorMapper()
+clr = color_mapper.clr
+
+
+def prepare_arguments(parser):
+    add = parser.add_argument
+    add('recording', metavar='FILE',
+        help="A recording made with `catkin build --record FILE`.")
+
+    replay_group = parser.add_argument_group('Replay', 'Control how the recording is played back.')
+    add = replay_group.add_argument
+    add('--speed', metavar='FACTOR', type=float, default=1.0,
+        help="Play the events back FACTOR times faster than they were recorded, or as fast as possible if "
+             "FACTOR is 0. (default: 1)")
+    add('--discard-output', action='store_true', default=False,
+        help="Count the bytes of the console output, but don't print them, so that the terminal doesn't "
+             "take part in the measurement.")
+    add('--json', action='store_true', default=False,
+        help="Print the measurements as JSON.")
+
+    output_group = parser.add_argument_group(
+        'Output', 'Override the console options with which the build was recorded.')
+    add = output_group.add_argument
+    add('--no-status', action='store_true', default=None,
+        help="Suppresses the status line.")
+    add('--limit-status-rate', '--status-rate', type=float, metavar='HZ', default=None,
+        help="Limit the update rate of the status line to this frequency. (default: {})".format(DEFAULT_STATUS_RATE))
+    add('--interleave-output', '-i', action='store_true', default=None,
+        help="Print the output of the stages as it was generated.")
+
+    return parser
+
+
+def main(opts):
+    if opts.speed < 0:
+        sys.exit(clr("@!@{rf}Error:@| The value of --speed must be greater than or equal to zero."))
+
+    try:
+        with open(opts.recording) as f:
+            header, events = read_recording(f)
+    except (IOError, OSError, ValueError) as exc:
+        sys.exit(clr("@!@{rf}Error:@| Unable to read the recording '{}': {}").format(opts.recording, exc))
+
+    controller_options = dict()
+    if opts.no_status:
+        controller_options['show_active_status'] = False
+    if opts.limit_status_rate:
+        controller_options['active_status_rate'] = opts.limit_status_rate
+    if opts.interleave_output:
+        controller_options['show_live_stdout'] = True
+        controller_options['show_live_stderr'] = True
+
+    stats = replay_recording(
+        header,
+        events,
+        speed=opts.speed,
+        output=None if opts.discard_output else sys.stdout,
+        controller_options=controller_options)
+
+    if opts.json:
+        print(json.dumps(stats, indent=2, sort_keys=True))
+        return 0
+
+    recorded_time = events[-1][0] if events else 0.0
+    print(clr("@!Replayed:@| {} events of {} jobs in {:.3f} s, recorded in {:.3f} s").format(
+        stats['events'], len(header['jobs']), stats['wall_time'], recorded_time))
+    print(clr("@!Controller:@| {:.3f} s of CPU time, {:.1f}% of the replay").format(
+        stats['cpu_time'], 100.0 * stats['cpu_time'] / max(stats['wall_time'], 1e-6)))
+    print(clr("@!Event queue:@| {} delivered, {} coalesced, {} at most waiting, "
+              "{:.1f} ms mean and {:.1f} ms max latency").format(
+        stats['event_bus']['delivered'],
+        stats['event_bus']['coalesced'],
+        stats['event_bus']['max_depth'],
+        1000.0 * stats['event_bus']['mean_latency'],
+        1000.0 * stats['event_bus']['max_latency']))
+    print(clr("@!Terminal:@| {} bytes written, {} of them by the status line").format(
+        stats['terminal_bytes'], stats['status_bytes']))
+
+    return 0
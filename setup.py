@@ -106,9 +106,11 @@ setup(
             'config = catkin_tools.verbs.catkin_config:description',
             'create = catkin_tools.verbs.catkin_create:description',
             'init = catkin_tools.verbs.catkin_init:description',
+            'jobs = catkin_tools.verbs.catkin_jobs:description',
             'list = catkin_tools.verbs.catkin_list:description',
             'locate = catkin_tools.verbs.catkin_locate:description',
             'profile = catkin_tools.verbs.catkin_profile:description',
+            'replay = catkin_tools.verbs.catkin_replay:description',
         ],
     },
     cmdclass={'install': PermissiveInstall},
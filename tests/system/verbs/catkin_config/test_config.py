@@ -28,3 +28,19 @@ def test_config_non_bare():
     out = assert_cmd_success(['catkin', 'config', '--install'])
     assert_workspace_initialized('.')
     assert_warning_message(out, 'Source space .+ does not yet exist')
+
+
+@in_temporary_directory
+def test_config_log_compression():
+    cwd = os.getcwd()
+    os.mkdir(os.path.join(cwd, 'src'))
+    out = assert_cmd_success(['catkin', 'config', '--log-compression', 'zlib', '--log-compression-level', '4'])
+    assert 'zlib (level 4)' in out
+    out = assert_cmd_success(['catkin', 'config'])
+    assert 'zlib (level 4)' in out
+
+    # The stored level doesn't outlive its compression method
+    out = assert_cmd_success(['catkin', 'config', '--log-compression', 'none'])
+    assert 'zlib' not in out
+    out = assert_cmd_success(['catkin', 'config', '--log-compression', 'zlib'])
+    assert 'zlib (level' not in out
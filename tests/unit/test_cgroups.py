@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+
+from catkin_tools.execution.cgroups import CgroupSandbox
+from catkin_tools.execution.cgroups import get_own_cgroup
+from catkin_tools.execution.cgroups import read_cgroup_stats
+
+
+def write_file(path, contents):
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def test_cgroup_sandbox():
+    root = tempfile.mkdtemp()
+    try:
+        # A fake unified hierarchy with a delegated scope
+        scope = os.path.join(root, 'user.slice', 'build.scope')
+        os.makedirs(scope)
+        write_file(os.path.join(scope, 'cgroup.procs'), '1\n2\n')
+        write_file(os.path.join(scope, 'cgroup.controllers'), 'cpu memory pids')
+        write_file(os.path.join(root, 'self_cgroup'), '1:name=systemd:/\n0::/user.slice/build.scope\n')
+        assert get_own_cgroup(os.path.join(root, 'self_cgroup'), root) == scope
+        assert get_own_cgroup(os.path.join(root, 'missing'), root) is None
+
+        sandbox = CgroupSandbox.create(parent=scope)
+        assert sandbox.path == os.path.join(scope, 'catkin-{}'.format(os.getpid()))
+
+        # Commands move themselves into the sub-group of their stage
+        kwargs = sandbox.wrap(('pcl_ros', 'make'), {'cmd': ['make', '-j4'], 'shell': False})
+        group = os.path.join(sandbox.path, 'pcl_ros.make')
+        assert os.path.isdir(group)
+        assert ('pcl_ros', 'make') in sandbox
+        assert kwargs['cmd'][:2] == ['/bin/sh', '-c']
+        assert kwargs['cmd'][-3:] == [os.path.join(group, 'cgroup.procs'), 'make', '-j4']
+
+        write_file(os.path.join(group, 'cpu.stat'), 'usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000\n')
+        write_file(os.path.join(group, 'memory.peak'), '1048576\n')
+        write_file(os.path.join(group, 'io.stat'), '8:0 rbytes=100 wbytes=200 rios=1 wios=2\n')
+        assert read_cgroup_stats(group) == {'cpu_time': 2.5, 'peak_rss': 1048576, 'io_bytes': 300}
+
+        assert sandbox.stop(('pcl_ros', 'make')) == {'cpu_time': 2.5, 'peak_rss': 1048576, 'io_bytes': 300}
+        assert ('pcl_ros', 'make') not in sandbox
+        assert sandbox.stop(('pcl_ros', 'make')) is None
+
+        # Stages which couldn't move into their sub-group aren't accounted by it
+        sandbox.wrap(('pcl_ros', 'install'), {'cmd': ['make', 'install'], 'shell': False})
+        assert sandbox.stop(('pcl_ros', 'install')) is None
+        sandbox.close()
+    finally:
+        shutil.rmtree(root)
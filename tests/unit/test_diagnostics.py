@@ -0,0 +1,56 @@
+import shutil
+import tempfile
+
+from catkin_tools.execution.diagnostics import DiagnosticParser
+from catkin_tools.execution.diagnostics import DiagnosticSummary
+from catkin_tools.execution.diagnostics import format_diagnostic
+from catkin_tools.execution.logs import BuildLog
+from catkin_tools.execution.logs import LogView
+
+
+def test_diagnostic_parser():
+    parser = DiagnosticParser()
+    assert parser.feed(b'[ 50%] Building CXX object CMakeFiles/foo.dir/src/foo.cpp.o\n') == []
+
+    # Diagnostics are found across chunk boundaries, with or without color
+    diagnostics = parser.feed(b"/src/foo/src/foo.cpp:12:5: \x1b[01;35mwarning: \x1b[0munused variable 'x' [-Wunu")
+    assert diagnostics == []
+    diagnostics = parser.feed(b"sed-variable]\n/src/foo/include/foo.h:3:10: fatal error: bar.h: No such file\n")
+    assert diagnostics == [
+        dict(file='/src/foo/src/foo.cpp', line=12, column=5, severity='warning', flag='-Wunused-variable',
+             message="unused variable 'x'"),
+        dict(file='/src/foo/include/foo.h', line=3, column=10, severity='error', flag=None,
+             message='bar.h: No such file')]
+
+    # The message of CMake diagnostics is on the next line
+    diagnostics = parser.feed(b'CMake Warning (dev) at /src/foo/CMakeLists.txt:4 (add_library):\n')
+    parser.feed(b'\n  Policy CMP0038 is not set')
+    assert parser.flush() == []
+    assert diagnostics == [dict(file='/src/foo/CMakeLists.txt', line=4, column=None, severity='warning',
+                                flag='-Wdev', message='Policy CMP0038 is not set')]
+
+
+def test_diagnostic_index():
+    log_path = tempfile.mkdtemp()
+    try:
+        diagnostic = dict(file='foo.cpp', line=1, column=2, severity='warning', flag='-Wall', message='100% bad')
+        build_log = BuildLog(log_path, 'build')
+        build_log.add_diagnostics('foo', 'make', [diagnostic, dict(diagnostic, line=5)])
+        build_log.add_diagnostics('bar', 'make', [dict(diagnostic, file='bar.cpp', flag=None)])
+        build_log.close()
+
+        diagnostics = LogView(log_path).diagnostics(build_log.name)
+        assert [(d['job_id'], d['file'], d['line']) for d in diagnostics] == [
+            ('foo', 'foo.cpp', 1), ('foo', 'foo.cpp', 5), ('bar', 'bar.cpp', 1)]
+
+        summary = DiagnosticSummary()
+        summary.add(diagnostics)
+        assert len(summary) == 3
+        assert summary.flags.most_common() == [('-Wall', 2)]
+        assert summary.files.most_common(1) == [('foo.cpp', 2)]
+
+        assert format_diagnostic(diagnostics[0]) == 'foo.cpp:1:2: warning: 100% bad [-Wall] (foo)'
+        assert format_diagnostic(diagnostics[0], 'github') == \
+            '::warning file=foo.cpp,line=1,col=2,title=foo -Wall::100%25 bad'
+    finally:
+        shutil.rmtree(log_path)
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from catkin_tools.execution.event_bus import Empty
+from catkin_tools.execution.event_bus import EventBus
+from catkin_tools.execution.events import ExecutionEvent
+
+
+def output(event_id, job_id, data):
+    return ExecutionEvent(event_id, job_id=job_id, stage_label='make', data=data)
+
+
+def test_event_bus():
+    bus = EventBus(coalesce_period=10.0)
+    bus.subscribe(['STDOUT'])
+
+    # Output which isn't subscribed to is dropped
+    bus.put(output('STDERR', 'pkg_a', 'warning\n'))
+    assert bus.empty()
+
+    # The output of each stage is merged, and delivered before the next other event
+    for data in ['a1\n', 'a2\n']:
+        bus.put(output('STDOUT', 'pkg_a', data))
+    bus.put(output('STDOUT', 'pkg_b', 'b1\n'))
+    bus.put(output('STDOUT', 'pkg_a', 'a3\n'))
+    assert bus.qsize() == 2
+    bus.put(ExecutionEvent('FINISHED_STAGE', job_id='pkg_a', stage_label='make'))
+    events = [bus.get(False) for _ in range(3)]
+    assert [(e.event_id, e.data.get('data')) for e in events] == [
+        ('STDOUT', 'a1\na2\na3\n'), ('STDOUT', 'b1\n'), ('FINISHED_STAGE', None)]
+
+    stats = bus.stats()
+    assert (stats['put'], stats['delivered'], stats['coalesced'], stats['dropped']) == (6, 3, 2, 1)
+    assert stats['depth'] == 0 and stats['max_depth'] == 3
+
+    # Merged output is delivered once its window has passed
+    bus.coalesce_period = 0.01
+    bus.put(output('STDOUT', 'pkg_b', 'b2\n'))
+    try:
+        bus.get(False)
+        assert False, 'output was delivered before its window passed'
+    except Empty:
+        pass
+    assert bus.get(timeout=1.0).data['data'] == 'b2\n'
+
+    # A blocked consumer is woken up by other threads
+    threading.Timer(0.01, bus.put, [None]).start()
+    start = time.time()
+    assert bus.get() is None
+    assert time.time() - start < 1.0
@@ -0,0 +1,39 @@
+import json
+
+from io import StringIO
+
+from catkin_tools.execution.event_stream import EventStreamWriter
+from catkin_tools.execution.events import ExecutionEvent
+from catkin_tools.execution.logs import CapturedOutput
+
+
+def test_event_stream_writer():
+    stream = StringIO()
+    writer = EventStreamWriter(stream)
+
+    status = dict(pending=['a', 'b'], queued=[], active=[], abandoned=[], cancelled=[], completed={})
+    writer.handle(ExecutionEvent('JOB_STATUS', **status))
+    writer.handle(ExecutionEvent('JOB_STATUS', **status))
+    writer.handle(ExecutionEvent('STARTED_STAGE', job_id='a', stage_label='make', env={'SECRET': 'x'}))
+    writer.handle(ExecutionEvent('STAGE_PROGRESS', job_id='a', stage_label='make', percent=50))
+    writer.handle(ExecutionEvent(
+        'FINISHED_STAGE', job_id='a', stage_label='make', succeeded=True, retcode=0,
+        stdout=CapturedOutput('build.log', [(0, 5)], 5, [b'hello'])))
+
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    # Unchanged job status isn't written again
+    assert [e['event'] for e in events] == ['JOB_STATUS', 'STARTED_STAGE', 'STAGE_PROGRESS', 'FINISHED_STAGE']
+    assert [e['seq'] for e in events] == [0, 1, 2, 3]
+    assert sorted([e['monotonic'] for e in events]) == [e['monotonic'] for e in events]
+
+    # The environment is left out, output is written as its size
+    assert 'env' not in events[1]
+    assert events[3]['stdout'] == 5
+    assert events[3]['duration'] >= 0
+
+    # A closed stream stops the stream, not the execution
+    stream.close()
+    writer.handle(ExecutionEvent('FINISHED_JOB', job_id='a', succeeded=True))
+    assert writer.stream is None
+    writer.close()
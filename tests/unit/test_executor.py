@@ -0,0 +1,93 @@
+import shutil
+import tempfile
+
+try:
+    # Python3
+    from queue import Queue
+except ImportError:
+    # Python2
+    from Queue import Queue
+
+from osrf_pycommon.process_utils import get_loop
+
+from catkin_tools.execution.executor import JobCanceller
+from catkin_tools.execution.executor import execute_jobs
+from catkin_tools.execution.executor import run_until_complete
+from catkin_tools.execution.jobs import Job
+from catkin_tools.execution.jobs import JobServer
+from catkin_tools.execution.stages import CommandStage
+from catkin_tools.execution.stages import FunctionStage
+
+
+def succeed(logger, event_queue):
+    return 0
+
+
+def make_job(jid, deps, resource_class=None):
+    stage = FunctionStage('run', succeed)
+    stage.resource_class = resource_class
+    return Job(jid, deps, [stage])
+
+
+def initialize_jobserver():
+    if JobServer._singleton is None:
+        JobServer.initialize(max_jobs=2)
+
+
+def run_jobs(jobs, **kwargs):
+    """Execute jobs, and return the result with the reasons the jobs were abandoned or cancelled for."""
+    initialize_jobserver()
+    log_path = tempfile.mkdtemp()
+    event_queue = Queue()
+    try:
+        succeeded = run_until_complete(execute_jobs('test', jobs, event_queue, log_path, **kwargs))
+    finally:
+        shutil.rmtree(log_path)
+
+    abandoned = {}
+    while not event_queue.empty():
+        event = event_queue.get()
+        if event.event_id in ['ABANDONED_JOB', 'CANCELLED_JOB']:
+            abandoned[event.data['job_id']] = event.data['reason']
+    return succeeded, abandoned
+
+
+def test_missing_deps_are_abandoned_without_failing():
+    jobs = [make_job('a', ['unknown']), make_job('b', ['a']), make_job('c', [])]
+    succeeded, abandoned = run_jobs(jobs, continue_on_failure=True)
+    assert succeeded
+    assert abandoned == {'a': 'MISSING_DEPS', 'b': 'DEP_ABANDONED'}
+
+
+def test_unschedulable_jobs_are_abandoned_and_fail():
+    # No stage of the `link` class can ever start
+    jobs = [make_job('a', []), make_job('b', ['a'], resource_class='link'), make_job('c', ['b'])]
+    succeeded, abandoned = run_jobs(jobs, resource_class_limits={'link': 0})
+    assert not succeeded
+    assert abandoned == {'b': 'UNSCHEDULABLE', 'c': 'UNSCHEDULABLE'}
+
+
+def test_dependants_are_cancelled_when_their_provider_fails():
+    # 'b' is started once 'a' has provided it with what it needs, and is still running when 'a' fails
+    provider = Job('a', [], [
+        FunctionStage('provide', succeed),
+        CommandStage('fail', ['sh', '-c', 'sleep 0.5; exit 1'])], provides='provide')
+    jobs = [provider, Job('b', ['a'], [CommandStage('run', ['sleep', '30'])]), make_job('c', ['b'])]
+    succeeded, abandoned = run_jobs(jobs, continue_on_failure=True)
+    assert not succeeded
+    assert abandoned == {'b': 'DEP_FAILED', 'c': 'DEP_FAILED'}
+
+
+def test_cancelled_job_gives_back_its_token():
+    initialize_jobserver()
+    canceller = JobCanceller(get_loop())
+    token = JobServer.try_acquire()
+    assert token is not None
+    canceller.hold_token('a')
+    available = JobServer._singleton._available_tokens()
+
+    # The token is given back right away, and only once
+    canceller.cancel('a')
+    assert JobServer._singleton._available_tokens() == available + 1
+    canceller.release_token('a')
+    assert JobServer._singleton._available_tokens() == available + 1
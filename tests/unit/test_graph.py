@@ -0,0 +1,142 @@
+from __future__ import print_function
+
+import random
+import time
+
+from catkin_tools.execution.graph import JobGraph
+from catkin_tools.execution.graph import get_transitive_reduction
+from catkin_tools.execution.jobs import Job
+
+
+def make_synthetic_jobs(n_repos=50, n_jobs_per_repo=100, n_direct_deps=3, seed=0):
+    """Generate jobs for a workspace of independent repositories.
+
+    Each job directly depends on a few earlier jobs in its repository, and
+    like the jobs created by `catkin build`, its deps are the full recursive
+    closure of those dependencies.
+    """
+    rng = random.Random(seed)
+    jobs = []
+    for r in range(n_repos):
+        closures = []
+        for i in range(n_jobs_per_repo):
+            direct = rng.sample(range(i), min(i, n_direct_deps))
+            closure = set(direct)
+            for d in direct:
+                closure.update(closures[d])
+            closures.append(closure)
+            jobs.append(Job('repo{}_pkg{}'.format(r, i), ['repo{}_pkg{}'.format(r, d) for d in closure], []))
+    return jobs
+
+
+def run_synthetic_build(jobs, graph, fail_job_ids=()):
+    """Run all the jobs in a graph one at a time, and return the completion order."""
+    completed = set()
+    order = []
+    queued = graph.get_ready_jobs()
+    while len(queued) > 0:
+        job = queued.pop(0)
+        assert job.jid not in graph.abandoned
+        assert all([d in completed for d in job.deps]), job.jid
+        completed.add(job.jid)
+        order.append(job.jid)
+        if job.jid in fail_job_ids:
+            graph.abandon_dependants(job.jid)
+        queued.extend(graph.complete(job.jid))
+    return order
+
+
+def test_transitive_reduction():
+    deps = {
+        'a': [],
+        'b': ['a'],
+        'c': ['a', 'b'],
+        'd': ['a', 'b', 'c'],
+        'e': ['a', 'b'],
+        'f': ['missing'],
+    }
+    reduced = get_transitive_reduction(deps)
+    assert reduced == {'a': [], 'b': ['a'], 'c': ['b'], 'd': ['c'], 'e': ['b'], 'f': []}, reduced
+
+
+def test_abandon_dependants():
+    jobs = [
+        Job('a', [], []),
+        Job('b', ['a'], []),
+        Job('c', ['a', 'b'], []),
+        Job('d', [], []),
+    ]
+    graph = JobGraph(jobs)
+    assert [j.jid for j in graph.get_ready_jobs()] == ['a', 'd']
+
+    abandoned = graph.abandon_dependants('a')
+    assert [(j.jid, direct) for j, direct in abandoned] == [('b', 'a'), ('c', 'b')]
+    assert graph.complete('a') == []
+
+
+def test_abandon_dependants_of_provided_job():
+    # 'b' was started once 'a' provided it with what it needs, but then 'a' failed
+    jobs = [
+        Job('a', [], []),
+        Job('b', ['a'], []),
+        Job('c', ['a', 'b'], []),
+    ]
+    graph = JobGraph(jobs)
+    graph.start('a')
+    assert [j.jid for j in graph.complete('a')] == ['b']
+    graph.start('b')
+
+    assert graph.get_started_dependants('a') == ['b']
+
+    abandoned = graph.abandon_dependants('a')
+    assert [(j.jid, direct) for j, direct in abandoned] == [('c', 'b')]
+    assert graph.complete('b') == []
+
+
+def test_synthetic_dag_benchmark():
+    jobs = make_synthetic_jobs()
+    assert len(jobs) == 5000
+    n_closure_edges = sum([len(j.deps) for j in jobs])
+
+    start = time.time()
+    graph = JobGraph(jobs)
+    order = run_synthetic_build(jobs, graph)
+    duration = time.time() - start
+
+    assert len(order) == len(jobs)
+
+    # Each reduced edge is visited exactly once when its dependency completes
+    n_reduced_edges = sum([len(d) for d in graph.deps.values()])
+    assert graph.edge_visits == n_reduced_edges
+    assert n_reduced_edges < n_closure_edges
+
+    # Failing a job abandons its dependants without visiting any other edges
+    graph = JobGraph(jobs)
+    order = run_synthetic_build(jobs, graph, fail_job_ids=set(['repo0_pkg1']))
+    assert len(order) + len(graph.abandoned) == len(jobs)
+    assert graph.edge_visits <= 2 * n_reduced_edges
+
+    print('{} jobs, {} closure edges, {} reduced edges: {:.3f} s'.format(
+        len(jobs), n_closure_edges, n_reduced_edges, duration))
+
+
+def benchmark_pending_list_scan(jobs):
+    """Run all the jobs by re-scanning the pending jobs after each completion."""
+    start = time.time()
+    completed = {}
+    queued = [j for j in jobs if len(j.deps) == 0]
+    pending = [j for j in jobs if len(j.deps) > 0]
+    while len(queued) > 0:
+        job = queued.pop(0)
+        completed[job.jid] = True
+        queued.extend([j for j in pending if j.all_deps_completed(completed)])
+        pending = [j for j in pending if not j.all_deps_completed(completed)]
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    jobs = make_synthetic_jobs()
+    start = time.time()
+    run_synthetic_build(jobs, JobGraph(jobs))
+    print('JobGraph: {:.3f} s'.format(time.time() - start))
+    print('Pending list scan: {:.3f} s'.format(benchmark_pending_list_scan(jobs)))
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+
+from catkin_tools.execution import history
+from catkin_tools.execution.events import ExecutionEvent
+
+
+def _stage(job_id, stage_label, start_time, wall_time, retcode=0, peak_rss=None):
+    return dict(job_id=job_id, stage_label=stage_label, source_commit=None, start_time=start_time,
+                wall_time=wall_time, cpu_time=None, peak_rss=peak_rss, retcode=retcode)
+
+
+def test_build_history():
+    tmp = tempfile.mkdtemp()
+    try:
+        build_history = history.BuildHistory(os.path.join(tmp, 'history.db'))
+
+        for i, make_time in enumerate([10.0, 20.0, 30.0, 40.0]):
+            build_history.add_build('build', 'default', i * 100, i * 100 + 50, True, [
+                _stage('a', 'cmake', i * 100, 1.0),
+                _stage('a', 'make', i * 100 + 1, make_time),
+            ])
+        # Failed runs don't count towards the duration
+        build_history.add_build('build', 'default', 400, 410, False, [_stage('a', 'make', 400, 1.0, retcode=2)])
+        # Neither do other profiles
+        build_history.add_build('build', 'release', 500, 510, True, [_stage('a', 'make', 500, 1.0)])
+
+        durations = build_history.get_job_durations('default')
+        assert durations == {'a': 31.0}, durations
+
+        stages = build_history.get_stages(job_id='a', stage_label='make', profile='default', since=100, until=400)
+        assert [s['wall_time'] for s in stages] == [20.0, 30.0, 40.0], stages
+
+        # Memory estimates include failed runs, but only the most recent ones
+        for i, peak_rss in enumerate([8e9, 1e9, 2e9, 3e9]):
+            build_history.add_build('build', 'default', 600 + i * 100, 650 + i * 100, i != 3, [
+                _stage('b', 'cmake', 600 + i * 100, 1.0, peak_rss=5e8),
+                _stage('b', 'make', 601 + i * 100, 1.0, peak_rss=peak_rss),
+            ])
+        peak_memory = build_history.get_job_peak_memory('default')
+        assert peak_memory == {'b': 3e9}, peak_memory
+
+        build_history.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_history_recorder():
+    recorder = history.HistoryRecorder('build', 'default')
+    recorder.handle(ExecutionEvent('STARTED_STAGE', job_id='a', stage_label='make'))
+    recorder.handle(ExecutionEvent(
+        'FINISHED_STAGE', job_id='a', stage_label='make', retcode=0, cpu_time=1.5, peak_rss=None))
+    assert len(recorder.stages) == 1
+    assert recorder.stages[0]['cpu_time'] == 1.5
+    assert recorder.stages[0]['wall_time'] >= 0.0
+
+
+def test_get_trend():
+    assert history.get_trend([1.0, 1.0]) is None
+    assert history.get_trend([1.0, 1.0, 1.0, 2.0, 2.0, 2.0]) == 1.0
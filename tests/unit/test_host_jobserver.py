@@ -0,0 +1,107 @@
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from catkin_tools.execution.host_jobserver import HostJobServerSession
+from catkin_tools.execution.host_jobserver import get_fair_shares
+from catkin_tools.execution.host_jobserver import get_host_jobserver_status
+
+
+def write_session(directory, pid, held, waiting):
+    with open(os.path.join(directory, 'sessions', '{}.json'.format(pid)), 'w') as f:
+        json.dump(dict(pid=pid, name='other', start_time=0.0, held=held, waiting=waiting, jobs=[]), f)
+
+
+def test_fair_shares():
+    assert get_fair_shares(8, {'a': 10, 'b': 10}) == {'a': 4, 'b': 4}
+    assert get_fair_shares(8, {'a': 1, 'b': 10}) == {'a': 1, 'b': 7}
+    assert get_fair_shares(8, {'a': 2, 'b': 3, 'c': 10}) == {'a': 2, 'b': 3, 'c': 3}
+    # Nobody is starved, even with more sessions than tokens
+    assert get_fair_shares(2, {'a': 5, 'b': 5, 'c': 5}) == {'a': 1, 'b': 1, 'c': 1}
+
+
+def test_host_jobserver_session():
+    directory = os.path.join(tempfile.mkdtemp(), 'jobserver')
+    try:
+        assert get_host_jobserver_status(directory)['sessions'] == []
+
+        session = HostJobServerSession('build ws', directory)
+        read_fd, write_fd = session.join(4)
+        assert session.max_jobs == 4
+        assert os.read(read_fd, 1) == b'+'
+        session.update(1, 3, ['pkg_a'])
+
+        status = get_host_jobserver_status(directory)
+        assert status['max_jobs'] == 4
+        assert status['available'] == 3
+        assert [(s['name'], s['held'], s['waiting'], s['jobs']) for s in status['sessions']] == \
+            [('build ws', 1, 3, ['pkg_a'])]
+
+        # Another running session wants more than half of the tokens
+        write_session(directory, os.getppid(), 2, 5)
+        assert session.fair_share() == 2
+
+        # The tokens held by sessions which were killed are put back by the next one to join
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        write_session(directory, dead.pid, 2, 0)
+        joining = HostJobServerSession('build other', directory)
+        joining.join(16)
+        assert joining.max_jobs == 4
+        assert get_host_jobserver_status(directory)['available'] == 5
+        assert not os.path.exists(os.path.join(directory, 'sessions', '{}.json'.format(dead.pid)))
+
+        session.leave()
+        assert os.path.exists(session.fifo_path)
+        os.remove(os.path.join(directory, 'sessions', '{}.json'.format(os.getppid())))
+        joining.leave()
+        assert not os.path.exists(session.fifo_path)
+    finally:
+        shutil.rmtree(os.path.dirname(directory))
+
+
+def test_host_jobserver_leave_returns_lost_tokens():
+    directory = os.path.join(tempfile.mkdtemp(), 'jobserver')
+    try:
+        session = HostJobServerSession('build ws', directory)
+        session.join(4)
+        # The remaining session keeps the fifo open
+        write_session(directory, os.getppid(), 0, 0)
+        remaining_fd = os.open(session.fifo_path, os.O_RDWR)
+
+        # A session is killed while holding tokens, after the last session joined
+        read_fd, _ = session.job_pipe
+        assert os.read(read_fd, 3) == b'+++'
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        write_session(directory, dead.pid, 3, 0)
+
+        # Its tokens are put back for the remaining session by the one which leaves
+        session.leave()
+        assert not os.path.exists(os.path.join(directory, 'sessions', '{}.json'.format(dead.pid)))
+        assert get_host_jobserver_status(directory)['available'] == 4
+        os.close(remaining_fd)
+    finally:
+        shutil.rmtree(os.path.dirname(directory))
+
+
+def test_host_jobserver_make_pipe():
+    directory = os.path.join(tempfile.mkdtemp(), 'jobserver')
+    try:
+        session = HostJobServerSession('build ws', directory)
+        read_fd, _ = session.join(2)
+        make_read_fd, _ = session.open_make_pipe()
+
+        # This session never blocks on reading a token, while make before 4.4 expects to
+        assert fcntl.fcntl(read_fd, fcntl.F_GETFL) & os.O_NONBLOCK
+        assert not fcntl.fcntl(make_read_fd, fcntl.F_GETFL) & os.O_NONBLOCK
+        assert os.read(make_read_fd, 1) == b'+'
+        assert os.read(read_fd, 1) == b'+'
+
+        session.leave()
+        assert session.make_pipe is None
+    finally:
+        shutil.rmtree(os.path.dirname(directory))
@@ -0,0 +1,136 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from catkin_tools.execution.io import IOBufferLogger
+from catkin_tools.execution.io import IOBufferProtocol
+from catkin_tools.execution.io import OutputCapture
+from catkin_tools.execution.io import STDERR
+from catkin_tools.execution.io import STDOUT
+from catkin_tools.execution.logs import BuildLog
+from catkin_tools.execution.logs import CapturedOutput
+from catkin_tools.execution.logs import LogView
+from catkin_tools.execution.logs import read_frames
+from catkin_tools.execution.logs import remove_old_builds
+
+
+class EventQueue(object):
+    def __init__(self):
+        self.events = []
+
+    def put(self, event):
+        self.events.append(event)
+
+
+def test_output_capture():
+    capture = OutputCapture(max_bytes=8)
+    for stream, data, offset in [(STDOUT, b'abc', 0), (STDOUT, b'def', 3), (STDERR, b'gh', 6), (STDOUT, b'ij', 20)]:
+        capture.append(stream, data, offset)
+    assert capture.spans == {STDOUT: [[0, 6], [20, 2]], STDERR: [[6, 2]]}
+    assert capture.sizes == {STDOUT: 8, STDERR: 2}
+    assert capture.output('unused').spans == [(0, 6), (6, 2), (20, 2)]
+
+    # Only the most recent output is kept in memory, the rest is read from the log
+    assert capture.dropped_bytes == 3
+    assert capture.output('unused', STDOUT).chunks is None
+    assert OutputCapture().output('unused', STDOUT).read() == b''
+
+
+def test_protocol_output_descriptors():
+    log_path = tempfile.mkdtemp()
+    try:
+        # The subprocess protocol assigns its descriptors without replacing the captured output
+        build_log = BuildLog(log_path, 'build')
+        protocol = IOBufferProtocol('build', 'pkg', 'make', EventQueue(), build_log, stdout=1, stderr=2)
+        assert (protocol.stdout_pipe, protocol.stderr_pipe) == (1, 2)
+        protocol.on_stdout_received(b'hello\n')
+        protocol.close()
+        assert protocol.stdout.read() == b'hello\n'
+        build_log.close()
+    finally:
+        shutil.rmtree(log_path)
+
+
+def test_build_log():
+    log_path = tempfile.mkdtemp()
+    try:
+        # Stages which run at the same time share the segment of the build
+        build_log = BuildLog(log_path, 'build')
+        logger = IOBufferLogger('build', 'pkg', 'make', EventQueue(), build_log)
+        other = IOBufferLogger('build', 'other', 'make', EventQueue(), build_log)
+        logger.capture.max_bytes = 10
+        logger.out('hello\n')
+        other.out('other\n')
+        logger.err('warning\n')
+        logger.out('done\n')
+        assert logger.stderr_buffer == b'warning\n'
+        logger.close()
+        other.close()
+
+        # References to the output read it back from the segment once it doesn't fit in memory
+        stdout = logger.stdout
+        assert stdout.chunks is None
+        assert stdout.filename == build_log.path
+        assert stdout.spans == [(0, 6), (20, 5)]
+        assert len(stdout) == 11
+        assert stdout.read() == b'hello\ndone\n'
+        assert logger.interleaved.read() == b'hello\nwarning\ndone\n'
+        assert other.interleaved.chunks == [b'other\n']
+        build_log.close()
+
+        # The per-stage logfiles can be reconstructed from the index
+        view = LogView(log_path)
+        build = view.builds()[0]
+        assert [(r['job_id'], r['stage_label']) for r in view.stages(build)] == [('pkg', 'make'), ('other', 'make')]
+        layout = view.legacy_layout()
+        assert sorted(layout) == [
+            'other/build.make.000.log', 'other/build.make.log', 'pkg/build.make.000.log', 'pkg/build.make.log']
+        assert layout['pkg/build.make.log'].read() == b'hello\nwarning\ndone\n'
+        assert view.export(os.path.join(log_path, 'export')) == 4
+        with open(os.path.join(log_path, 'export', 'other', 'build.make.000.log'), 'rb') as f:
+            assert f.read() == b'other\n'
+
+        # Only the logs of the most recent builds are kept
+        for stamp in ['20000101-000000', '20000102-000000']:
+            for extension in ['.log', '.index']:
+                open(os.path.join(log_path, 'build.{}.1{}'.format(stamp, extension)), 'w').close()
+        assert len(view.builds('build')) == 3
+        remove_old_builds(log_path, 'build', max_builds=2)
+        assert view.builds('build') == ['build.20000102-000000.1', build]
+        BuildLog(log_path, 'clean').close()
+        assert view.builds('build') == ['build.20000102-000000.1', build]
+    finally:
+        shutil.rmtree(log_path)
+
+
+def test_compressed_build_log():
+    log_path = tempfile.mkdtemp()
+    try:
+        build_log = BuildLog(log_path, 'build', compression='zlib', compression_level=1)
+        assert build_log.path.endswith('.log.gz')
+        spans = []
+        for i in range(3):
+            data = 'line {}\n'.format(i).encode('utf-8') * 1000
+            spans.append((build_log.write(data), len(data)))
+            # Each flush ends a frame, and offsets are offsets of the uncompressed output
+            build_log.flush()
+        build_log.add_stage('pkg', 'make', 0.0, {'stdout': spans})
+        build_log.close()
+        frames = read_frames(build_log.path)
+        assert [(offset, length) for offset, length, _, _ in frames] == spans
+
+        # The segment is a valid gzip file
+        with gzip.open(build_log.path, 'rb') as f:
+            assert f.read().count(b'line 1\n') == 1000
+
+        # Only the frames holding the end of the output are decompressed for its tail
+        output = LogView(log_path).output(build_log.name, LogView(log_path).stages(build_log.name)[0])
+        assert output.read().count(b'\n') == 3000
+        with open(build_log.path, 'r+b') as f:
+            f.seek(frames[0][2])
+            f.write(b'corrupted')
+        assert output.tail(14) == (len(output) - 14, b'line 2\nline 2\n')
+        assert CapturedOutput('unused', [], 5, [b'ab', b'cde']).tail(2) == (3, b'de')
+    finally:
+        shutil.rmtree(log_path)
@@ -0,0 +1,95 @@
+import os
+import shutil
+import socket
+import tempfile
+
+from catkin_tools.execution.event_bus import EventBus
+from catkin_tools.execution.events import ExecutionEvent
+from catkin_tools.execution.logs import CapturedOutput
+from catkin_tools.execution.metrics import MetricsCollector
+from catkin_tools.execution.metrics import MetricsServer
+from catkin_tools.execution.metrics import parse_metrics_address
+
+
+def event(event_id, monotonic_time, **data):
+    e = ExecutionEvent(event_id, **data)
+    e.monotonic_time = monotonic_time
+    return e
+
+
+def test_parse_metrics_address():
+    assert parse_metrics_address('9100') == ('127.0.0.1', 9100)
+    assert parse_metrics_address('0.0.0.0:9100') == ('0.0.0.0', 9100)
+    assert parse_metrics_address('unix:/tmp/catkin.sock') == '/tmp/catkin.sock'
+    for spec in ['localhost', 'unix:', '70000']:
+        try:
+            parse_metrics_address(spec)
+            assert False, spec
+        except ValueError:
+            pass
+
+
+def test_metrics_collector():
+    collector = MetricsCollector('build', event_bus=EventBus())
+    collector.handle(event('JOB_STATUS', 0.0, pending=['c'], queued=['b'], active=['a']))
+    collector.handle(event('STARTED_STAGE', 1.0, job_id='a', stage_label='make'))
+    collector.handle(event(
+        'FINISHED_STAGE', 8.0, job_id='a', stage_label='make', succeeded=False,
+        stdout=CapturedOutput('build.log', [(0, 5)], 5, [b'hello']), stderr=None))
+    collector.handle(event('FINISHED_JOB', 8.0, job_id='a', succeeded=False))
+
+    metrics = collector.render().splitlines()
+    assert 'catkin_jobs{execution="build",state="running"} 1' in metrics
+    assert 'catkin_jobs_finished_total{execution="build",outcome="failed"} 1' in metrics
+    assert 'catkin_output_bytes_total{execution="build",stream="stdout"} 5' in metrics
+    assert 'catkin_stages_failed_total{execution="build",stage="make"} 1' in metrics
+    assert 'catkin_stage_duration_seconds_bucket{execution="build",stage="make",le="5"} 0' in metrics
+    assert 'catkin_stage_duration_seconds_bucket{execution="build",stage="make",le="10"} 1' in metrics
+    assert 'catkin_stage_duration_seconds_bucket{execution="build",stage="make",le="+Inf"} 1' in metrics
+    assert 'catkin_stage_duration_seconds_sum{execution="build",stage="make"} 7' in metrics
+    assert 'catkin_events_total{outcome="put"} 0' in metrics
+
+
+def test_metrics_server():
+    socket_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(socket_dir, 'metrics.sock')
+        server = MetricsServer(MetricsCollector('build'), path)
+        server.start()
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = b''
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+            client.close()
+        finally:
+            server.close()
+
+        assert response.startswith(b'HTTP/1.0 200')
+        assert b'catkin_jobs{execution="build",state="pending"} 0' in response
+        assert not os.path.exists(path)
+    finally:
+        shutil.rmtree(socket_dir)
+
+
+def test_metrics_server_keeps_other_files():
+    socket_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(socket_dir, 'notes.txt')
+        with open(path, 'w') as f:
+            f.write('notes')
+        try:
+            MetricsServer(MetricsCollector('build'), path)
+        except socket.error:
+            pass
+        else:
+            assert False, "Expected the metrics server to refuse the path"
+        with open(path) as f:
+            assert f.read() == 'notes'
+    finally:
+        shutil.rmtree(socket_dir)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+
+from catkin_tools.execution.pressure import AdaptiveConcurrency
+from catkin_tools.execution.pressure import pressure_available
+from catkin_tools.execution.pressure import read_pressure
+
+
+def write_pressure(root, resource, total):
+    with open(os.path.join(root, resource), 'w') as pressure_file:
+        pressure_file.write('some avg10=1.00 avg60=0.50 avg300=0.10 total={}\n'.format(total))
+        pressure_file.write('full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n')
+
+
+def test_adaptive_concurrency():
+    root = tempfile.mkdtemp()
+    try:
+        assert not pressure_available(root)
+        assert AdaptiveConcurrency(8, root=root).sample(now=0.0) is None
+
+        for resource in ['cpu', 'memory', 'io']:
+            write_pressure(root, resource, 0)
+        assert pressure_available(root)
+        assert read_pressure('cpu', root)['some'] == {'avg10': 1.0, 'avg60': 0.5, 'avg300': 0.1, 'total': 0.0}
+
+        adaptive = AdaptiveConcurrency(8, min_jobs=2, root=root)
+        assert adaptive.sample(now=0.0) is None
+
+        # Half of the last two seconds were stalled on the CPU
+        write_pressure(root, 'cpu', 1000000)
+        pressures = adaptive.sample(now=2.0)
+        assert pressures == {'cpu': 50.0, 'memory': 0.0, 'io': 0.0}, pressures
+        assert adaptive.update(pressures) == 6
+        assert adaptive.update(pressures) == 4
+        assert adaptive.update(pressures) == 3
+        assert adaptive.update(pressures) == 2
+        assert adaptive.update(pressures) == 2
+
+        # Moderate pressure keeps the jobs, low pressure raises them one at a time
+        assert adaptive.update({'cpu': 20.0}) == 2
+        assert adaptive.update({'cpu': 0.0}) == 3
+        for _ in range(10):
+            adaptive.update({'cpu': 0.0})
+        assert adaptive.jobs == 8
+    finally:
+        shutil.rmtree(root)
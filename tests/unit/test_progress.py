@@ -0,0 +1,29 @@
+from catkin_tools.execution.progress import ProgressMonitor
+from catkin_tools.execution.progress import ProgressParser
+
+
+def test_progress_parser():
+    parser = ProgressParser()
+    assert parser.feed(b'Scanning dependencies of target foo\n') is None
+
+    # Reports are found anywhere in a chunk, and across chunk boundaries
+    assert parser.feed(b'[  5%] Building CXX object a.o\n[ 1') == (5, 100)
+    assert parser.feed(b'0%] Building CXX object b.o\nwarning: [-Wall] 50%]\n') == (10, 100)
+
+    # Ninja reports steps, and rewrites its status line with carriage returns on terminals
+    assert parser.feed(b'[17/40] Building CXX object c.o\r[18/40] Linking libc.so\r') == (18, 40)
+
+    # Only the start of incomplete lines is held on to
+    parser.feed(b'x' * 100000)
+    assert len(parser._prefix) <= 32
+    assert parser.feed(b'\n') is None
+
+
+def test_progress_monitor():
+    monitor = ProgressMonitor(period=1.0)
+    assert monitor.feed(b'[ 10%] a\n', 100.0) == dict(percent=10, done=10, total=100, eta=None)
+
+    # Reports are rate limited, but the last one always comes through
+    assert monitor.feed(b'[ 20%] b\n', 100.5) is None
+    assert monitor.feed(b'[ 30%] c\n', 102.0) == dict(percent=30, done=30, total=100, eta=7.0)
+    assert monitor.feed(b'[100%] d\n', 102.1)['percent'] == 100
@@ -0,0 +1,51 @@
+from io import StringIO
+
+from catkin_tools.execution.events import ExecutionEvent
+from catkin_tools.execution.jobs import Job
+from catkin_tools.execution.logs import CapturedOutput
+from catkin_tools.execution.recording import EventRecorder
+from catkin_tools.execution.recording import read_recording
+from catkin_tools.execution.recording import replay_recording
+from catkin_tools.execution.stages import Stage
+
+
+class Recording(StringIO):
+    def close(self):
+        self.contents = self.getvalue()
+        StringIO.close(self)
+
+
+def test_record_and_replay():
+    stream = Recording()
+    jobs = [Job('pkg_a', [], [Stage('make')]), Job('pkg_b', ['pkg_a'], [Stage('make')])]
+    recorder = EventRecorder(stream, 'build', ['package', 'packages'], jobs, dict(
+        show_active_status=False, show_buffered_stdout=True, show_stage_events=True))
+
+    status = dict(queued=[], active=[], abandoned=[], cancelled=[], completed={})
+    warning = b"foo.cpp:1:2: warning: unused variable 'x' [-Wunused-variable]\n"
+    for job_id in ['pkg_a', 'pkg_b']:
+        recorder.handle(ExecutionEvent('JOB_STATUS', pending=[job_id], **status))
+        recorder.handle(ExecutionEvent('STARTED_JOB', job_id=job_id, token_wait=0.0))
+        recorder.handle(ExecutionEvent('STARTED_STAGE', job_id=job_id, stage_label='make', token_wait=0.0))
+        recorder.handle(ExecutionEvent(
+            'FINISHED_STAGE', job_id=job_id, stage_label='make', succeeded=True, retcode=0, cancelled=False,
+            stdout=CapturedOutput(None, [], len(warning), [warning]),
+            stderr=CapturedOutput(None, [], 0, []),
+            interleaved=CapturedOutput(None, [], len(warning), [warning]),
+            logfile_filename='make.log', cpu_time=None, peak_rss=None, io_bytes=None, diagnostics=[]))
+        recorder.handle(ExecutionEvent('FINISHED_JOB', job_id=job_id, succeeded=True))
+    recorder.close()
+
+    header, events = read_recording(StringIO(stream.contents))
+    assert [j['jid'] for j in header['jobs']] == ['pkg_a', 'pkg_b']
+    assert len(events) == 10
+    assert events[3][2]['stdout'].read() == warning
+
+    # The output of the replay is counted, and is the same each time
+    output = StringIO()
+    stats = replay_recording(header, events, speed=0, output=output)
+    assert stats['events'] == 10
+    assert stats['event_bus']['delivered'] == 11
+    assert stats['terminal_bytes'] == len(output.getvalue().encode('utf-8'))
+    assert 'unused variable' in output.getvalue()
+    assert replay_recording(header, events, speed=0)['terminal_bytes'] == stats['terminal_bytes']
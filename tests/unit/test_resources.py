@@ -0,0 +1,69 @@
+from concurrent.futures import Future
+
+from catkin_tools.execution.jobs import Job
+from catkin_tools.execution.resources import MemoryBudget
+from catkin_tools.execution.resources import ResourceClassLimiter
+from catkin_tools.execution.resources import parse_memory_size
+from catkin_tools.execution.stages import Stage
+
+
+def test_resource_class_limits():
+    limiter = ResourceClassLimiter({'configure': 2, 'install': 1, 'compile': None})
+    assert limiter.limits == {'configure': 2, 'install': 1}
+
+    # Unclassed and unlimited stages are never held back
+    assert limiter.available(None)
+    assert limiter.available('compile')
+
+    limiter.acquire('configure')
+    limiter.acquire('configure')
+    assert not limiter.available('configure')
+    assert limiter.available('install')
+
+    # Jobs are held back by their first limited stage
+    configure_job = Job('a', [], [Stage('mkdir'), Stage('cmake', resource_class='configure'),
+                                  Stage('make', resource_class='compile')])
+    install_job = Job('b', [], [Stage('make', resource_class='compile'), Stage('install', resource_class='install')])
+    assert not limiter.job_available(configure_job)
+    assert limiter.job_available(install_job)
+
+    # Waiters are woken up whenever a slot is released
+    waiter = Future()
+    limiter.add_waiter(waiter)
+    limiter.release('configure')
+    assert waiter.done()
+    assert limiter.available('configure')
+    assert limiter.waiters == []
+    assert limiter.peak_running == {'configure': 2}
+
+
+def test_parse_memory_size():
+    assert parse_memory_size(1000) == 1000
+    assert parse_memory_size('3g') == 3 * 1024 ** 3
+    assert parse_memory_size('1.5M') == 1536 * 1024
+    assert parse_memory_size('50%', 4000) == 2000
+    for invalid in ['lots', '3x', '50%']:
+        try:
+            parse_memory_size(invalid)
+        except ValueError:
+            pass
+        else:
+            assert False, invalid
+
+
+def test_memory_budget():
+    budget = MemoryBudget(4000, {'pcl': 3000, 'eigen': 3000, 'msgs': 500})
+
+    # Jobs without estimates are never held back
+    budget.reserve('pcl')
+    assert not budget.fits('eigen')
+    assert budget.fits('msgs')
+    assert budget.fits('unknown')
+    budget.reserve('unknown')
+    assert budget.headroom() == 1000
+
+    # A job which needs more than the whole budget still runs on its own
+    budget.release('pcl')
+    budget.release('unknown')
+    assert MemoryBudget(1000, {'pcl': 3000}).fits('pcl')
+    assert budget.fits('eigen')
@@ -0,0 +1,54 @@
+from catkin_tools.execution import scheduling
+
+
+def test_critical_path_without_durations():
+    # Long chain a -> b -> c -> d and a short branch a -> e
+    deps = {
+        'a': [],
+        'b': ['a'],
+        'c': ['a', 'b'],
+        'd': ['a', 'b', 'c'],
+        'e': ['a'],
+        'f': [],
+    }
+    costs = scheduling.get_job_costs(deps)
+    assert all([cost == 1.0 for cost in costs.values()]), costs
+
+    lengths = scheduling.get_critical_path_lengths(deps, costs)
+    assert lengths['a'] == 4.0, lengths
+    assert lengths['e'] == 1.0, lengths
+    assert lengths['f'] == 1.0, lengths
+
+    assert scheduling.get_critical_path(deps, lengths) == ['a', 'b', 'c', 'd']
+
+
+def test_job_priorities_use_durations():
+    deps = {
+        'msgs': [],
+        'core': ['msgs'],
+        'app': ['msgs', 'core'],
+        'docs': [],
+    }
+    durations = {'msgs': 10.0, 'core': 100.0, 'app': 5.0, 'docs': 500.0}
+    priorities = scheduling.get_job_priorities(deps, durations)
+    assert priorities['docs'] > priorities['msgs'] > priorities['core'] > priorities['app'], priorities
+
+    # Unknown jobs cost the mean of the known durations
+    costs = scheduling.get_job_costs(deps, {'msgs': 10.0, 'core': 30.0})
+    assert costs['app'] == 20.0, costs
+
+
+def test_estimate_wall_time():
+    costs = {'a': 10.0, 'b': 10.0, 'c': 10.0, 'd': 10.0}
+    lengths = {'a': 20.0, 'b': 10.0, 'c': 10.0, 'd': 10.0}
+    assert scheduling.estimate_wall_time(costs, lengths, 1) == 40.0
+    assert scheduling.estimate_wall_time(costs, lengths, 4) == 20.0
+
+
+def test_circular_dependencies():
+    try:
+        scheduling.get_topological_order({'a': ['b'], 'b': ['a']})
+    except ValueError:
+        pass
+    else:
+        assert False, 'Circular dependencies were not detected.'
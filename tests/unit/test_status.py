@@ -0,0 +1,43 @@
+from catkin_tools.execution.controllers import StatusLineRenderer
+from catkin_tools.execution.controllers import clr
+
+
+class Terminal(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+def status(elapsed, complete, jobs):
+    return clr('[{} {} s] [{}/{} complete] [{}/{} jobs] [{} queued]').format(
+        'build', elapsed, complete, 10, len(jobs), 4, 0) + ' ' + ' '.join(
+        [clr('[{}:{} - {}]').format(j, 'make', d) for j, d in jobs])
+
+
+def test_status_line_renderer():
+    terminal = Terminal()
+    renderer = StatusLineRenderer(terminal)
+
+    # The first line is written in full
+    renderer.render(status('1.0', 0, [('pkg_a', '0.5')]), 200)
+    assert 'pkg_a' in terminal.writes[-1] and terminal.writes[-1].endswith('\x1b[K\r')
+
+    # Only the parts which changed are rewritten
+    renderer.render(status('1.1', 0, [('pkg_a', '0.6')]), 200)
+    assert 'complete' not in terminal.writes[-1]
+    assert 'pkg_a' not in terminal.writes[-1] and '0.6' in terminal.writes[-1]
+    n_writes = len(terminal.writes)
+    renderer.render(status('1.1', 0, [('pkg_a', '0.6')]), 200)
+    assert len(terminal.writes) == n_writes
+
+    # Everything after a part whose length changed is rewritten, and the rest of the old line is cleared
+    renderer.render(status('1.2', 1, []), 200)
+    assert 'complete' in terminal.writes[-1] and terminal.writes[-1].endswith('\x1b[K\r')
+
+    # Lines are truncated to the width of the terminal
+    renderer.invalidate()
+    renderer.render(status('1.3', 1, [('pkg_{}'.format(i), '0.1') for i in range(20)]), 80)
+    assert renderer._length == 79
+    assert renderer.bytes_written == sum(len(w) for w in terminal.writes)
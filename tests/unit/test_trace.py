@@ -0,0 +1,40 @@
+from catkin_tools.execution.events import ExecutionEvent
+from catkin_tools.execution.trace import TraceRecorder
+
+
+def event(event_id, monotonic_time, **data):
+    e = ExecutionEvent(event_id, **data)
+    e.monotonic_time = monotonic_time
+    return e
+
+
+def test_trace_recorder():
+    recorder = TraceRecorder('build')
+    status = dict(pending=[], queued=[], abandoned=[], cancelled=[], completed={})
+    recorder.handle(event('JOB_STATUS', 10.0, active=[], **status))
+    recorder.handle(event('STARTED_JOB', 10.0, job_id='a', token_wait=0.0))
+    recorder.handle(event('STARTED_JOB', 10.5, job_id='b', token_wait=0.5))
+    recorder.handle(event('JOB_STATUS', 10.5, active=['a', 'b'], **status))
+    recorder.handle(event('STARTED_STAGE', 11.0, job_id='b', stage_label='make', token_wait=0.25))
+    recorder.handle(event('FINISHED_STAGE', 12.0, job_id='b', stage_label='make', succeeded=True, retcode=0))
+    recorder.handle(event('FINISHED_JOB', 12.0, job_id='a', succeeded=True))
+    recorder.handle(event('FINISHED_JOB', 12.5, job_id='b', succeeded=True))
+    recorder.handle(event('STARTED_JOB', 13.0, job_id='c', token_wait=0.0))
+    recorder.handle(event('FINISHED_JOB', 14.0, job_id='c', succeeded=False))
+
+    trace = recorder.to_json()
+    complete = dict([((e['cat'], e['name'], e['ts']), e) for e in trace['traceEvents'] if e['ph'] == 'X'])
+
+    # Jobs hold the lowest free slot, and stages are nested in them
+    assert complete['job', 'a', 0]['tid'] == 1 and complete['job', 'a', 0]['dur'] == 2000000
+    assert complete['job', 'b', 500000]['tid'] == 2
+    assert complete['job', 'c', 3000000]['tid'] == 1
+    assert complete['stage', 'make', 1000000]['tid'] == 2
+
+    # Waiting for tokens comes before the job or stage starts
+    assert complete['token', 'waiting for token', 0]['dur'] == 500000
+    assert complete['token', 'waiting for token', 750000]['dur'] == 250000
+
+    running = [e['args']['jobs'] for e in trace['traceEvents'] if e['name'] == 'Running jobs']
+    assert running == [0, 2]
+    assert [e['args']['name'] for e in trace['traceEvents'] if e['name'] == 'thread_name'] == ['Slot 1', 'Slot 2']